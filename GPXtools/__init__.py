@@ -17,5 +17,33 @@
 Tools to mess with bicycle GPS tracks
 """
 
-from . import gpxTools
-from .stravaAtHome import stravaAtHome
+# Everything is imported on first use (PEP 562), so that 'import GPXtools'
+# doesn't load matplotlib, cartopy, stravalib, ... for scripts that only
+# shift times or upload a file.  Submodules (GPXtools.gpxStream, ...) are
+# imported by the import system as usual.  GPXtools.stravaAtHome is the
+# class (as it always was), from submodule stravaAtHome; __getattr__ imports
+# the submodule and then binds the name to the class.  Importing the
+# submodule by name first ('import GPXtools.stravaAtHome') binds the
+# submodule instead, as in any package; its class is then
+# GPXtools.stravaAtHome.stravaAtHome.
+
+import importlib
+
+_lazy = {'gpxTools': ('.gpxTools', None), 'gpxStream': ('.gpxStream', None),
+         'GPX': ('.track', 'GPX'), 'Track': ('.track', 'Track'), 'Segment': ('.track', 'Segment'),
+         'stravaAtHome': ('.stravaAtHome', 'stravaAtHome')}
+
+__all__ = list(_lazy)
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError("module %r has no attribute %r"%(__name__, name))
+    moduleName, attribute = _lazy[name]
+    value = importlib.import_module(moduleName, __name__)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy))
@@ -0,0 +1,220 @@
+### Index of a GPX archive by area and time
+### Which rides went through this area last spring?  Answered from an SQLite
+### database instead of by reading every GPX file again.
+
+# Every track segment of every ingested file gets a row with its time range
+# (B-tree indices on start and end) and its bounding box (R-tree), plus a
+# pointer back to the source: file, track number and segment number.  For
+# polygon queries, a simplified copy of the segment's line (float32 lon/lat
+# pairs) is stored as well; candidates from the R-tree are then checked
+# against the polygon exactly.
+# Ingest is incremental: files whose size and modification time haven't
+# changed since they were indexed are skipped.
+
+import contextlib
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapely
+import shapely.geometry as sgeom
+
+from . import gpxStream
+from .simplify import localXY, rdpMask
+
+def defaultIndexFile():
+    """ $GPXTOOLS_ARCHIVE_INDEX, or archive.sqlite in ~/.cache/GPXtools """
+    return os.environ.get('GPXTOOLS_ARCHIVE_INDEX',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'GPXtools', 'archive.sqlite'))
+
+def toMicroseconds(t):
+    """ Integer microseconds since 1970 from datetime, ISO string or datetime64; None for None / NaT """
+    if t is None:
+        return None
+    t = np.datetime64(t, 'us')
+    return None if np.isnat(t) else int(t.astype('int64'))
+
+def segmentRows(fileName, readGpx=gpxStream.readGpx, tolerance=10.):
+    """
+    Rows (track, segment, points, start, end, minLat, maxLat, minLon, maxLon, geometry)
+    for all non-empty segments in fileName; geometry is simplified with tolerance (m)
+    """
+    rows = []
+    for iTrack, track in enumerate(readGpx(fileName).tracks):
+        for iSeg, seg in enumerate(track.segments):
+            if len(seg) == 0:
+                continue
+            first, last = seg.timeRange()
+            keep = rdpMask(*localXY(seg.lat, seg.lon), tolerance) if len(seg) > 2 else np.ones(len(seg), dtype=bool)
+            geometry = np.column_stack((seg.lon[keep], seg.lat[keep])).astype(np.float32).tobytes()
+            rows.append((iTrack, iSeg, len(seg), toMicroseconds(first), toMicroseconds(last),
+                         float(seg.lat.min()), float(seg.lat.max()), float(seg.lon.min()), float(seg.lon.max()),
+                         geometry))
+    return rows
+
+def _indexFile(args):
+    fileName, readGpx, tolerance = args
+    try:
+        return fileName, segmentRows(fileName, readGpx, tolerance), None
+    except Exception as e:
+        return fileName, None, "%s: %s"%(e.__class__.__name__, e)
+
+class queryResult(list):
+    """
+    List of matching files (sorted by time of their first matching segment),
+    so it can be passed to plotTracks, mergeTracks, ... directly.
+    segments: list of (fileName, track, segment, start, end) of all matching segments
+    """
+    def __init__(self, segments):
+        self.segments = segments
+        super().__init__(dict.fromkeys(s[0] for s in segments))
+
+class archiveIndex:
+    """
+    SQLite index (file fileName) of track segments by bounding box and time range.
+    readGpx(fileName): track.GPX from file, e.g. gpxTools.readGpx (track cache)
+    tolerance: simplification (m) of the lines stored for polygon queries
+    """
+    def __init__(self, fileName=None, readGpx=gpxStream.readGpx, tolerance=10.):
+        self.fileName = defaultIndexFile() if fileName is None else fileName
+        self.readGpx = readGpx
+        self.tolerance = tolerance
+        dirName = os.path.dirname(self.fileName)
+        if dirName:
+            os.makedirs(dirName, exist_ok=True)
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime INTEGER)')
+            db.execute('CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY, file INTEGER, track INTEGER, '
+                       'segment INTEGER, points INTEGER, startTime INTEGER, endTime INTEGER, geometry BLOB)')
+            db.execute('CREATE INDEX IF NOT EXISTS segmentStart ON segments (startTime)')
+            db.execute('CREATE INDEX IF NOT EXISTS segmentEnd ON segments (endTime)')
+            db.execute('CREATE INDEX IF NOT EXISTS segmentFile ON segments (file)')
+            db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS segmentBox USING rtree(id, minLat, maxLat, minLon, maxLon)')
+        return
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """ Connection to the database file, in a transaction (committed unless there's an exception), then closed """
+        db = sqlite3.connect(self.fileName, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _stat(fileName):
+        st = os.stat(gpxStream.splitArchivePath(fileName)[0])
+        return st.st_size, st.st_mtime_ns
+
+    def _remove(self, db, fileId):
+        db.execute('DELETE FROM segmentBox WHERE id IN (SELECT id FROM segments WHERE file=?)', (fileId,))
+        db.execute('DELETE FROM segments WHERE file=?', (fileId,))
+
+    def ingest(self, fileNames, workers=1):
+        """
+        Index files (list; see gpxTools.expandInputs for directories / patterns),
+        skipping files unchanged since they were last indexed; parse in 'workers' processes.
+        Returns (number indexed, number unchanged, list of (fileName, error message)).
+        """
+        fileNames = [os.path.abspath(fn) for fn in fileNames]
+        with self._connect() as db:
+            known = {path: (fileId, size, mtime) for fileId, path, size, mtime in
+                     db.execute('SELECT id, path, size, mtime FROM files')}
+        todo, errors = [], []
+        for fn in fileNames:
+            try:
+                if fn not in known or known[fn][1:] != self._stat(fn):
+                    todo.append(fn)
+            except OSError as e:
+                errors.append((fn, "%s: %s"%(e.__class__.__name__, e)))
+        jobs = [(fn, self.readGpx, self.tolerance) for fn in todo]
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(_indexFile, jobs, chunksize=max(1, len(jobs)//(4*workers)))
+                failed = self._store(results, known)
+        else:
+            failed = self._store(map(_indexFile, jobs), known)
+        return len(todo)-len(failed), len(fileNames)-len(todo)-len(errors), errors+failed
+
+    def _store(self, results, known):
+        errors = []
+        with self._connect() as db:
+            for fn, rows, error in results:
+                if error is not None:
+                    errors.append((fn, error))
+                    continue
+                size, mtime = self._stat(fn)
+                if fn in known:
+                    fileId = known[fn][0]
+                    self._remove(db, fileId)
+                    db.execute('UPDATE files SET size=?, mtime=? WHERE id=?', (size, mtime, fileId))
+                else:
+                    fileId = db.execute('INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)', (fn, size, mtime)).lastrowid
+                for row in rows:
+                    segId = db.execute('INSERT INTO segments (file, track, segment, points, startTime, endTime, geometry) '
+                                       'VALUES (?, ?, ?, ?, ?, ?, ?)', (fileId,)+row[:5]+row[9:]).lastrowid
+                    db.execute('INSERT INTO segmentBox VALUES (?, ?, ?, ?, ?)', (segId,)+row[5:9])
+        return errors
+
+    def prune(self):
+        """ Remove entries of files that no longer exist; returns their number """
+        with self._connect() as db:
+            gone = [(fileId, path) for fileId, path in db.execute('SELECT id, path FROM files')
+                    if not os.path.exists(gpxStream.splitArchivePath(path)[0])]
+            for fileId, path in gone:
+                self._remove(db, fileId)
+                db.execute('DELETE FROM files WHERE id=?', (fileId,))
+        return len(gone)
+
+    def __len__(self):
+        """ Number of indexed files """
+        with self._connect() as db:
+            return db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def query(self, bbox=None, polygon=None, start=None, end=None):
+        """
+        Segments passing through bbox [minLon, maxLon, minLat, maxLat] and / or
+        polygon (shapely geometry or list of (lon, lat)), with points between
+        start and end (datetime, ISO string or datetime64; None: open-ended).
+        Returns queryResult: list of files, details in its 'segments' attribute.
+        """
+        if polygon is not None and not isinstance(polygon, shapely.Geometry):
+            polygon = sgeom.Polygon(polygon)
+        if polygon is not None:
+            minLon, minLat, maxLon, maxLat = polygon.bounds
+            if bbox is not None:
+                minLon, maxLon = max(minLon, bbox[0]), min(maxLon, bbox[1])
+                minLat, maxLat = max(minLat, bbox[2]), min(maxLat, bbox[3])
+            bbox = [minLon, maxLon, minLat, maxLat]
+            shapely.prepare(polygon)
+        conditions, parameters = [], []
+        if bbox is not None:
+            tables = 'segmentBox b JOIN segments s ON s.id=b.id JOIN files f ON f.id=s.file'
+            conditions.append('b.minLon<=? AND b.maxLon>=? AND b.minLat<=? AND b.maxLat>=?')
+            parameters.extend([bbox[1], bbox[0], bbox[3], bbox[2]])
+        else:
+            tables = 'segments s JOIN files f ON f.id=s.file'
+        if end is not None:
+            conditions.append('s.startTime<=?')
+            parameters.append(toMicroseconds(end))
+        if start is not None:
+            conditions.append('s.endTime>=?')
+            parameters.append(toMicroseconds(start))
+        sql = 'SELECT f.path, s.track, s.segment, s.startTime, s.endTime, s.geometry FROM '+tables
+        if conditions:
+            sql += ' WHERE '+' AND '.join(conditions)
+        sql += ' ORDER BY s.startTime, f.path, s.track, s.segment'
+        segments = []
+        with self._connect() as db:
+            for path, track, segment, first, last, geometry in db.execute(sql, parameters):
+                if polygon is not None:
+                    coords = np.frombuffer(geometry, dtype=np.float32).reshape(-1, 2).astype(float)
+                    line = sgeom.Point(coords[0]) if len(coords) == 1 else sgeom.LineString(coords)
+                    if not polygon.intersects(line):
+                        continue
+                segments.append((path, track, segment,
+                                 None if first is None else np.datetime64(first, 'us'),
+                                 None if last is None else np.datetime64(last, 'us')))
+        return queryResult(segments)
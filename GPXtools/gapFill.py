@@ -0,0 +1,167 @@
+### Filling gaps in tracks from filler tracks
+### Where a (primary) recording has a gap in time, e.g. a Tahuna dropout,
+### splice in the points another recording (Strava, bike computer, ...) has
+### for that time.
+
+# fillerIndex holds the time ranges of a library of filler files, sorted by
+# start time together with the running maximum of their end times, so that
+# the fillers overlapping a gap are found by two binary searches, without
+# looking at other files.  Filler files are only read when they are needed
+# for a gap (and kept for a few more gaps).
+# gapFiller is applied to the segment chunks of a track as they stream by:
+# gaps are found between consecutive points (also across chunk boundaries)
+# and filler points strictly inside the gap are inserted, sliced out of the
+# filler's time-sorted arrays with searchsorted; optionally, they are
+# interpolated to a uniform cadence.
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .track import Segment
+from . import gpxStream
+
+class fillerIndex:
+    """
+    Interval index of filler files by time range.
+    readGpx(fileName): track.GPX from file (e.g. gpxTools.readGpx, using the track cache)
+    maxLoaded: number of filler files kept in memory
+    """
+    def __init__(self, fileNames, readGpx=gpxStream.readGpx, workers=1, maxLoaded=16):
+        self.readGpx = readGpx
+        self.maxLoaded = maxLoaded
+        self.loaded = OrderedDict()
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                ranges = list(executor.map(gpxStream.probeTimeRange, fileNames, chunksize=max(1, len(fileNames)//(4*workers))))
+        else:
+            ranges = [gpxStream.probeTimeRange(fn) for fn in fileNames]
+        timed = [i for i, (first, last) in enumerate(ranges) if not np.isnat(first)]
+        starts = np.array([ranges[i][0] for i in timed], dtype='datetime64[us]')
+        order = np.argsort(starts, kind='stable')
+        self.fileNames = [fileNames[timed[i]] for i in order]
+        self.starts = starts[order]
+        self.ends = np.array([ranges[timed[i]][1] for i in order], dtype='datetime64[us]')
+        # fillers before k all end before maxEnds[k-1]: monotonic, so it can be searched
+        self.maxEnds = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+    def __len__(self):
+        return len(self.fileNames)
+
+    def overlapping(self, t0, t1):
+        """ Indices of fillers with points between t0 and t1, most overlap first """
+        lo = np.searchsorted(self.maxEnds, t0, side='right')
+        hi = np.searchsorted(self.starts, t1, side='left')
+        if hi <= lo:
+            return []
+        idx = np.arange(lo, hi)
+        idx = idx[self.ends[idx] > t0]
+        overlap = np.minimum(self.ends[idx], t1)-np.maximum(self.starts[idx], t0)
+        return idx[np.argsort(-overlap.astype('int64'), kind='stable')].tolist()
+
+    def points(self, i):
+        """ All timed points of filler i as one Segment, sorted by time """
+        if i in self.loaded:
+            self.loaded.move_to_end(i)
+            return self.loaded[i]
+        doc = self.readGpx(self.fileNames[i])
+        seg = Segment.concatenate([s for track in doc.tracks for s in track.segments])
+        seg = seg[~np.isnat(seg.time)]
+        seg = seg[np.argsort(seg.time, kind='stable')]
+        self.loaded[i] = seg
+        if len(self.loaded) > self.maxLoaded:
+            self.loaded.popitem(last=False)
+        return seg
+
+    def window(self, i, t0, t1, margin=0):
+        """ Points of filler i with t0 < time < t1 (plus margin points on each side) """
+        seg = self.points(i)
+        lo = np.searchsorted(seg.time, t0, side='right')
+        hi = np.searchsorted(seg.time, t1, side='left')
+        return seg[max(lo-margin, 0):hi+margin]
+
+def resample(seg, times):
+    """ Segment at times (datetime64 array), linearly interpolated from seg (sorted by time) """
+    t = seg.time.astype('int64').astype(float)
+    ti = times.astype('int64').astype(float)
+    valid = ~np.isnan(seg.ele)
+    ele = np.interp(ti, t[valid], seg.ele[valid]) if valid.any() else None
+    return Segment(np.interp(ti, t, seg.lat), np.interp(ti, t, seg.lon), ele, times)
+
+class gapFiller:
+    """
+    Callable filling gaps longer than minGap (seconds) in segment chunks
+    with points from the fillers in 'index' (fillerIndex).
+    cadence: None: insert filler points as they are; seconds: interpolate
+      filler points to one point every cadence seconds
+    Call startSegment() at the start of each segment (gaps between segments aren't filled).
+    Counts gaps found (nGaps), filled (nFilled) and points inserted (nPoints).
+    """
+    def __init__(self, index, minGap=60, cadence=None):
+        self.index = index
+        self.minGap = np.timedelta64(int(minGap*1e6), 'us')
+        self.cadence = None if cadence is None else np.timedelta64(int(cadence*1e6), 'us')
+        self.nGaps = self.nFilled = self.nPoints = 0
+        self.startSegment()
+
+    def startSegment(self):
+        self.lastTime = np.datetime64('NaT', 'us')
+
+    def fill(self, t0, t1):
+        """ Segment of filler points strictly between times t0 and t1 (possibly empty) """
+        pieces = []
+        covered = []
+        for i in self.index.overlapping(t0, t1):
+            if self.cadence is None:
+                piece = self.index.window(i, t0, t1)
+            else:
+                source = self.index.window(i, t0, t1, margin=1)
+                if len(source) < 2:
+                    continue
+                times = t0+self.cadence*np.arange(1, (t1-t0)//self.cadence+1)
+                times = times[(times < t1) & (times >= source.time[0]) & (times <= source.time[-1])]
+                piece = resample(source, times)
+            # parts of the gap already filled by a better filler are skipped
+            for a, b in covered:
+                piece = piece[(piece.time < a) | (piece.time > b)]
+            if len(piece):
+                pieces.append(piece)
+                covered.append((piece.time[0], piece.time[-1]))
+        if not pieces:
+            return Segment([], [])
+        seg = Segment.concatenate(pieces)
+        return seg[np.argsort(seg.time, kind='stable')]
+
+    def __call__(self, seg):
+        # gaps are between timed points (untimed points are skipped over);
+        # position: index in seg of each time, -1 for the last time of the previous chunk
+        position = np.flatnonzero(~np.isnat(seg.time))
+        if len(position) == 0:
+            return seg
+        time = seg.time[position]
+        if not np.isnat(self.lastTime):
+            time = np.concatenate(([self.lastTime], time))
+            position = np.concatenate(([-1], position))
+        self.lastTime = time[-1]
+        gaps = np.flatnonzero(np.diff(time) > self.minGap)
+        if len(gaps) == 0:
+            return seg
+        pieces = []
+        start = 0
+        for g in gaps:
+            self.nGaps += 1
+            filler = self.fill(time[g], time[g+1])
+            if len(filler) == 0:
+                continue
+            self.nFilled += 1
+            self.nPoints += len(filler)
+            # filler goes right before the timed point after the gap
+            split = position[g+1]
+            pieces.extend((seg[start:split], filler))
+            start = split
+        pieces.append(seg[start:])
+        return Segment.concatenate(pieces)
+
+    def report(self):
+        print("Filled %i of %i gaps with %i points from %i filler files"%(self.nFilled, self.nGaps, self.nPoints, len(self.index)))
@@ -0,0 +1,120 @@
+### Cache for geocoding results
+### Keeps results of address <-> coordinates look-ups in memory (LRU)
+### and on disk (SQLite), so the same addresses aren't resolved over and over.
+
+import contextlib
+import sqlite3
+import json
+import time
+import os
+from collections import OrderedDict
+from threading import Lock
+
+def locationToJson(loc):
+    return json.dumps({'address': loc.address, 'latitude': loc.latitude,
+                       'longitude': loc.longitude, 'altitude': loc.altitude, 'raw': loc.raw})
+
+def locationFromJson(text):
+    from geopy.location import Location
+    d = json.loads(text)
+    return Location(d['address'], (d['latitude'], d['longitude'], d['altitude']), d['raw'])
+
+class geocodeCache:
+    """
+    Two-level cache for geocoding results (geopy Locations):
+    an in-memory LRU of up to memoryEntries entries, backed by
+    SQLite file fileName (None: memory only) holding up to maxEntries entries.
+    Entries expire after ttl seconds; when the file is full, the least
+    recently used entries are evicted.
+    Only successful look-ups are cached.
+    """
+    def __init__(self, fileName=None, ttl=30*24*3600, maxEntries=10000, memoryEntries=256):
+        self.fileName = fileName
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.memoryEntries = memoryEntries
+        self.memory = OrderedDict() # (kind, query) -> (expiry time, Location)
+        self.lock = Lock()
+        if fileName is not None:
+            dirName = os.path.dirname(fileName)
+            if dirName:
+                os.makedirs(dirName, exist_ok=True)
+            with self._connect() as db:
+                db.execute('CREATE TABLE IF NOT EXISTS geocode (kind TEXT, query TEXT, result TEXT, '
+                           'expires REAL, used REAL, PRIMARY KEY (kind, query))')
+        return
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """ Connection to the database file, in a transaction (committed unless there's an exception), then closed """
+        db = sqlite3.connect(self.fileName, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def lookup(self, kind, query, resolve):
+        """
+        Cached result of look-up 'kind' ('geocode' or 'reverse') of query;
+        resolve() is called (and its result stored) on a cache miss.
+        """
+        key = (kind, query)
+        now = time.time()
+        with self.lock:
+            if key in self.memory:
+                expires, loc = self.memory[key]
+                if expires > now:
+                    self.memory.move_to_end(key)
+                    return loc
+                del self.memory[key]
+        if self.fileName is not None:
+            with self._connect() as db:
+                row = db.execute('SELECT result, expires FROM geocode WHERE kind=? AND query=?', key).fetchone()
+                if row is not None and row[1] > now:
+                    db.execute('UPDATE geocode SET used=? WHERE kind=? AND query=?', (now, kind, query))
+                    loc = locationFromJson(row[0])
+                    self._remember(key, row[1], loc)
+                    return loc
+        loc = resolve()
+        if loc is not None:
+            self.store(kind, query, loc)
+        return loc
+
+    def store(self, kind, query, loc):
+        """ Store Location loc as result of look-up 'kind' of query """
+        now = time.time()
+        expires = now+self.ttl
+        self._remember((kind, query), expires, loc)
+        if self.fileName is None:
+            return
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)',
+                       (kind, query, locationToJson(loc), expires, now))
+            db.execute('DELETE FROM geocode WHERE expires <= ?', (now,))
+            n = db.execute('SELECT COUNT(*) FROM geocode').fetchone()[0]
+            if n > self.maxEntries:
+                db.execute('DELETE FROM geocode WHERE rowid IN (SELECT rowid FROM geocode ORDER BY used LIMIT ?)',
+                           (n-self.maxEntries,))
+        return
+
+    def _remember(self, key, expires, loc):
+        with self.lock:
+            self.memory[key] = (expires, loc)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memoryEntries:
+                self.memory.popitem(last=False)
+
+    def clear(self):
+        """ Remove all entries, in memory and on disk """
+        with self.lock:
+            self.memory.clear()
+        if self.fileName is not None:
+            with self._connect() as db:
+                db.execute('DELETE FROM geocode')
+        return
+
+def defaultCacheFile():
+    """ $GPXTOOLS_GEOCODE_CACHE, or geocode.sqlite in ~/.cache/GPXtools """
+    return os.environ.get('GPXTOOLS_GEOCODE_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'GPXtools', 'geocode.sqlite'))
@@ -0,0 +1,659 @@
+### Streaming GPX I/O
+### Read GPX files incrementally and write them back out chunk by chunk,
+### so that memory use doesn't grow with the size of the file.
+
+# Reading is based on xml.etree.ElementTree.iterparse: gpxReader turns the
+# document into a stream of (kind, element) events.  Completed elements are
+# detached from the tree as soon as they are handed out, so the parser never
+# holds more than the element currently being read.
+# iterEvents converts these into a stream of track.Segment chunks (see there);
+# Input may be compressed (gzip, bzip2; detected from the first bytes, not the
+# file name) or a member of a zip archive, addressed as archive.zip/member.gpx;
+# see openInput.  It is decompressed while being parsed, never to disk.
+# gpxWriter consumes that stream and writes it straight to a file handle,
+# one string per chunk of points (openOutput: optionally gzip-compressed).
+
+import xml.etree.ElementTree as ET
+import re
+import os
+import gzip
+import bz2
+import zipfile
+import numpy as np
+
+from .track import Segment, Track, GPX, timeUnit, timeRangeOf
+from .stats import trackStats
+from . import metrics
+
+_magic = ((b'\x1f\x8b', 'gzip'), (b'BZh', 'bzip2'), (b'PK\x03\x04', 'zip'))
+
+def splitArchivePath(fileName):
+    """
+    (archive, member) for fileName 'archive.zip/member.gpx' (archive is
+    an existing file, fileName isn't), (fileName, None) otherwise
+    """
+    if os.path.exists(fileName):
+        return fileName, None
+    path = fileName
+    while True:
+        parent = os.path.dirname(path)
+        if not parent or parent == path:
+            return fileName, None
+        path = parent
+        if os.path.isfile(path):
+            return path, fileName[len(path):].lstrip('/'+os.sep).replace(os.sep, '/')
+
+def compression(fileName):
+    """ 'gzip', 'bzip2', 'zip' (archive or archive member) or None (plain file), from the file content """
+    archive, member = splitArchivePath(fileName)
+    with open(archive, 'rb') as f:
+        head = f.read(4)
+    return next((kind for magic, kind in _magic if head.startswith(magic)), None)
+
+def archiveMembers(fileName):
+    """ Names 'archive.zip/member.gpx' of all GPX files in zip archive fileName """
+    with zipfile.ZipFile(fileName) as zf:
+        return [fileName+'/'+info.filename for info in zf.infolist()
+                if not info.is_dir() and info.filename.lower().endswith('.gpx')]
+
+def openInput(fileName):
+    """
+    Binary file object reading GPX file fileName, decompressing on the fly if
+    it is gzip or bzip2 compressed.  Members of zip archives are read as
+    'archive.zip/member.gpx', or as 'archive.zip' if that holds a single GPX file.
+    """
+    archive, member = splitArchivePath(fileName)
+    kind = compression(archive)
+    if kind == 'zip':
+        zf = zipfile.ZipFile(archive)
+        try:
+            if member is None:
+                members = [m[len(archive)+1:] for m in archiveMembers(archive)]
+                if len(members) != 1:
+                    raise ValueError("gpxStream.openInput: %s holds %i GPX files, use %s/<member> (see archiveMembers)"%(archive, len(members), archive))
+                member = members[0]
+            try:
+                return zf.open(member)
+            except KeyError:
+                raise FileNotFoundError("gpxStream.openInput: no such file: %s"%fileName)
+        finally:
+            # the member stays readable until it is closed
+            zf.close()
+    if member is not None:
+        raise FileNotFoundError("gpxStream.openInput: no such file: %s"%fileName)
+    if kind == 'gzip':
+        return gzip.open(fileName, 'rb')
+    if kind == 'bzip2':
+        return bz2.open(fileName, 'rb')
+    return open(fileName, 'rb')
+
+def localName(tag):
+    """ Strip namespace from element tag: '{uri}trkpt' -> 'trkpt' """
+    return tag.rsplit('}', 1)[-1]
+
+class gpxReader:
+    """
+    Incremental GPX reader.  Iterating over an instance yields (kind, element)
+    events:
+      * 'gpx': start of root element (attributes only)
+      * 'head': complete child of <gpx> before the first track (metadata, wpt, rte)
+      * 'trk': start of a track
+      * 'trkinfo': complete child of <trk> other than <trkseg> (name, type, ...)
+      * 'trkseg': start of a track segment
+      * 'trkpt': complete track point
+      * 'endseg', 'endtrk': end of segment / track
+      * 'tail': complete child of <gpx> after the first track (extensions)
+    Complete elements are detached from the tree before they are handed out;
+    hold on to them only as long as needed.
+    Namespaces declared in the file are collected in self.namespaces (prefix: uri).
+    """
+    def __init__(self, source):
+        """ source: file name (possibly compressed, see openInput) or binary file object """
+        self.source = source
+        self.namespaces = {}
+
+    def __iter__(self):
+        if not isinstance(self.source, str):
+            yield from self._events(self.source)
+            return
+        with openInput(self.source) as f:
+            yield from self._events(f)
+            if metrics.enabled:
+                metrics.count('bytes.read', f.tell())
+
+    def _events(self, source):
+        stack = []
+        seenTrack = False
+        for event, item in ET.iterparse(source, events=('start', 'end', 'start-ns')):
+            if event == 'start-ns':
+                prefix, uri = item
+                self.namespaces.setdefault(prefix, uri)
+                continue
+            name = localName(item.tag)
+            depth = len(stack)
+            if event == 'start':
+                stack.append(item)
+                if depth == 0:
+                    yield 'gpx', item
+                elif depth == 1 and name == 'trk':
+                    seenTrack = True
+                    yield 'trk', item
+                elif depth == 2 and name == 'trkseg' and localName(stack[-2].tag) == 'trk':
+                    yield 'trkseg', item
+                continue
+            # event == 'end'
+            stack.pop()
+            depth -= 1
+            if depth == 0:
+                continue
+            parent = stack[-1]
+            if depth == 1:
+                kind = 'endtrk' if name == 'trk' else ('tail' if seenTrack else 'head')
+            elif depth == 2 and localName(parent.tag) == 'trk':
+                kind = 'endseg' if name == 'trkseg' else 'trkinfo'
+            elif depth == 3 and name == 'trkpt' and localName(parent.tag) == 'trkseg':
+                kind = 'trkpt'
+            else:
+                # deeper element, will be handed out with its ancestor
+                continue
+            parent.remove(item)
+            yield kind, item
+        return
+
+def qualifiedName(tag, scope, namespaces, newDecls):
+    """
+    Prefixed name for tag '{uri}local'.  scope: {uri: prefix} already declared;
+    undeclared namespaces get a prefix (from namespaces {prefix: uri} if
+    possible), are added to scope, and their uris appended to newDecls.
+    """
+    if tag[0] != '{':
+        return tag
+    uri, local = tag[1:].split('}', 1)
+    if uri not in scope:
+        prefix = next((p for p, u in namespaces.items() if u == uri), None)
+        if prefix is None or prefix in scope.values():
+            prefix = 'ns%i'%len(scope)
+        scope[uri] = prefix
+        newDecls.append(uri)
+    prefix = scope[uri]
+    return prefix+':'+local if prefix else local
+
+def escape(text, entities={}):
+    """ Like xml.sax.saxutils.escape (which imports urllib, slowly) """
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    for key, value in entities.items():
+        text = text.replace(key, value)
+    return text
+
+def quote(value):
+    return '"%s"'%escape(value, {'"': '&quot;'})
+
+def namespaceDeclarations(uris, scope):
+    return ''.join(' %s=%s'%('xmlns:'+scope[uri] if scope[uri] else 'xmlns', quote(uri)) for uri in uris)
+
+def serialize(elem, scope, namespaces={}):
+    """
+    XML string of complete element elem (ignoring its tail).
+    scope: {uri: prefix} of namespaces declared in the enclosing document;
+    others are declared on the elements using them.
+    """
+    parts = []
+    _serialize(elem, dict(scope), namespaces, parts.append)
+    return ''.join(parts)
+
+def _serialize(elem, scope, namespaces, write):
+    newDecls = []
+    tag = qualifiedName(elem.tag, scope, namespaces, newDecls)
+    attrs = ''.join(' %s=%s'%(qualifiedName(k, scope, namespaces, newDecls), quote(v)) for k, v in elem.attrib.items())
+    decls = namespaceDeclarations(newDecls, scope)
+    if elem.text is None and len(elem) == 0:
+        write('<%s%s%s/>'%(tag, decls, attrs))
+        return
+    write('<%s%s%s>'%(tag, decls, attrs))
+    if elem.text:
+        write(escape(elem.text))
+    for child in elem:
+        _serialize(child, dict(scope), namespaces, write)
+        if child.tail:
+            write(escape(child.tail))
+    write('</%s>'%tag)
+
+def parseTimes(strings):
+    """ datetime64[us] array (UTC) from list of GPX time strings (None: NaT) """
+    converted = []
+    for t in strings:
+        if t is None:
+            converted.append('NaT')
+        elif t.endswith('Z'):
+            converted.append(t[:-1])
+        else:
+            from gpxpy.gpxfield import parse_time
+            dt = parse_time(t)
+            if dt.tzinfo is not None:
+                dt = dt - dt.utcoffset()
+            converted.append(dt.replace(tzinfo=None).isoformat())
+    return np.array(converted, dtype=timeUnit)
+
+def formatTimes(times):
+    """ GPX time strings (UTC) from datetime64 array; fractional seconds only where needed """
+    strings = np.char.add(np.datetime_as_string(times, unit='s'), 'Z')
+    fractional = (times - times.astype('datetime64[s]')) != np.timedelta64(0, 'us')
+    if fractional.any():
+        strings = strings.astype(object)
+        strings[fractional] = [t+'Z' for t in np.datetime_as_string(times[fractional], unit='us')]
+    return strings
+
+class _pointBuffer:
+    """ Collects track point elements, turns them into a Segment """
+    def __init__(self, namespaces):
+        self.namespaces = namespaces
+        self.clear()
+
+    def clear(self):
+        self.lat, self.lon, self.ele, self.time, self.extra = [], [], [], [], []
+        self.hasExtra = False
+
+    def __len__(self):
+        return len(self.lat)
+
+    def append(self, elem):
+        self.lat.append(float(elem.get('lat')))
+        self.lon.append(float(elem.get('lon')))
+        ele = t = None
+        others = []
+        for child in elem:
+            name = localName(child.tag)
+            if name == 'ele' and ele is None and child.text and child.text.strip():
+                ele = float(child.text)
+            elif name == 'time' and t is None and child.text and child.text.strip():
+                t = child.text.strip()
+            else:
+                others.append(child)
+        self.ele.append(np.nan if ele is None else ele)
+        self.time.append(t)
+        if others:
+            # Self-contained fragment: only the GPX namespace of the point is assumed
+            scope = {elem.tag[1:].split('}')[0]: ''} if elem.tag[0] == '{' else {}
+            self.extra.append(''.join(serialize(c, scope, self.namespaces) for c in others))
+            self.hasExtra = True
+        else:
+            self.extra.append(None)
+
+    def segment(self):
+        seg = Segment(self.lat, self.lon, self.ele, parseTimes(self.time),
+                      self.extra if self.hasExtra else None)
+        self.clear()
+        return seg
+
+def iterEvents(source, chunkSize=None):
+    """
+    Read GPX file source (file name, possibly compressed, or file object) incrementally.
+    Yields (kind, item) events:
+      * 'gpx', GPX document header (no tracks; tail not yet known)
+      * 'trk', Track without segments (start of new track)
+      * 'trkseg', None (start of new segment)
+      * 'trkpts', Segment: points of the current segment; if chunkSize is set,
+        segments are split into chunks of at most chunkSize points
+      * 'end', GPX document header including tail
+    """
+    reader = gpxReader(source)
+    doc = track = None
+    started = False
+    points = None
+    for kind, elem in reader:
+        if kind == 'gpx':
+            doc = GPX(elem.tag, dict(elem.attrib), dict(reader.namespaces))
+            rootScope = {uri: prefix for prefix, uri in doc.namespaces.items()}
+            points = _pointBuffer(reader.namespaces)
+        elif kind == 'head':
+            doc.head.append(serialize(elem, rootScope, reader.namespaces))
+        elif kind == 'trk':
+            if not started:
+                started = True
+                yield 'gpx', doc
+            track = Track()
+            trackScope = {elem.tag[1:].split('}')[0]: ''} if elem.tag[0] == '{' else {}
+        elif kind == 'trkinfo':
+            track.info.append(serialize(elem, trackScope, reader.namespaces))
+        elif kind == 'trkseg':
+            if track is not None:
+                yield 'trk', track
+                track = None
+            yield 'trkseg', None
+        elif kind == 'trkpt':
+            points.append(elem)
+            if chunkSize is not None and len(points) >= chunkSize:
+                yield 'trkpts', points.segment()
+        elif kind == 'endseg':
+            if len(points):
+                yield 'trkpts', points.segment()
+        elif kind == 'endtrk':
+            if track is not None:
+                # track without segments
+                yield 'trk', track
+                track = None
+        elif kind == 'tail':
+            doc.tail.append(serialize(elem, rootScope, reader.namespaces))
+    if not started:
+        yield 'gpx', doc
+    yield 'end', doc
+    return
+
+def readGpx(source):
+    """ Read complete GPX file into a track.GPX document """
+    doc = None
+    chunks = None
+    def finishSegment():
+        if chunks is not None:
+            doc.tracks[-1].segments.append(Segment.concatenate(chunks))
+    for kind, item in iterEvents(source):
+        if kind == 'gpx':
+            doc = item
+        elif kind == 'trk':
+            finishSegment()
+            chunks = None
+            doc.tracks.append(item)
+        elif kind == 'trkseg':
+            finishSegment()
+            chunks = []
+        elif kind == 'trkpts':
+            chunks.append(item)
+        elif kind == 'end':
+            finishSegment()
+    return doc
+
+def openOutput(fileName, compressLevel=6, compress=None):
+    """
+    Text file object for writing GPX to fileName: gzip-compressed if compress,
+    or (compress None) if fileName ends in .gz (e.g. track.gpx.gz), otherwise
+    plain with a large buffer
+    """
+    if compress is None:
+        compress = fileName.endswith('.gz')
+    if compress:
+        return gzip.open(fileName, 'wt', encoding='utf-8', compresslevel=compressLevel)
+    return open(fileName, 'w', encoding='utf-8', buffering=1<<20)
+
+gpx11 = 'http://www.topografix.com/GPX/1/1'
+summaryNamespace = 'urn:gpxtools:summary'
+_metadataStart = re.compile(r'^<((?:[\w.-]+:)?)metadata\b([^>]*?)(/?)>')
+_metadataEnd = re.compile(r'</(?:[\w.-]+:)?metadata>\s*$')
+_boundsElement = re.compile(r'\s*<(?:[\w.-]+:)?bounds\b[^>]*?(?:/>|>\s*</(?:[\w.-]+:)?bounds>)')
+_extensionsStart = re.compile(r'<((?:[\w.-]+:)?)extensions\b[^>]*?(/?)>')
+
+def summaryFragment(stats, prefix, extensionsTag=None):
+    """
+    <bounds> and <extensions> with a summary of stats (trackStats) for GPX 1.1 <metadata>;
+    prefix: namespace prefix of metadata children ('' or 'gpx:');
+    extensionsTag: start tag of the existing <extensions> of the metadata, if any
+    """
+    parts = []
+    bounds = stats.bounds()
+    if bounds is not None:
+        parts.append('<%sbounds minlat="%.7f" minlon="%.7f" maxlat="%.7f" maxlon="%.7f"/>'%((prefix,)+bounds))
+    summary = stats.summary()
+    parts.append('<gpxtools:summary xmlns:gpxtools="%s" points="%i" distance="%.1f" movingTime="%.0f" totalTime="%.0f" '
+                 'movingSpeed="%.2f" maxSpeed="%.2f" uphill="%.0f" downhill="%.0f"/>'
+                 %(summaryNamespace, summary['points'], summary['distance'], summary['movingTime'], summary['totalTime'],
+                   summary['movingSpeed'], summary['maxSpeed'], summary['uphill'], summary['downhill']))
+    if extensionsTag is None:
+        parts.insert(-1, '<%sextensions>'%prefix)
+        parts.append('</%sextensions>'%prefix)
+    elif extensionsTag.endswith('/>'):
+        parts.insert(-1, extensionsTag[:-2].rstrip()+'>')
+        parts.append('</%sextensions>'%_extensionsStart.match(extensionsTag).group(1))
+    else:
+        parts.insert(-1, extensionsTag)
+    return ''.join(parts)
+
+class _widestStats:
+    """ Stand-in for stats.trackStats with the widest values expected, to size the space reserved for the summary """
+    def bounds(self):
+        return (-90., -180., -90., -180.)
+    def summary(self):
+        return {'points': 10**10-1, 'distance': 1e10-1, 'movingTime': 1e10-1, 'totalTime': 1e10-1,
+                'movingSpeed': -1e4+1, 'maxSpeed': -1e4+1, 'uphill': 1e8-1, 'downhill': 1e8-1}
+
+def canRewrite(out):
+    """ True if text file object out can seek back to fill in the header (not gzip, pipes, ...) """
+    if isinstance(getattr(out, 'buffer', out), gzip.GzipFile):
+        # seekable, but only forward while writing
+        return False
+    try:
+        return out.seekable()
+    except (OSError, ValueError):
+        return False
+
+class gpxWriter:
+    """
+    Write GPX event stream (see iterEvents) to text file object 'out'.
+    precision: None: coordinates and elevations are written exactly
+      (shortest representation); otherwise number of decimals for
+      latitude and longitude (7: about 1 cm), elevations get eleDigits decimals.
+    summary: refresh <bounds> in the <metadata> of GPX 1.1 files and add
+      a summary (distance, times, speeds, elevation gain; see stats.trackStats)
+      of the points written.  As these are only known at the end, space is
+      reserved in the header (as much as the widest summary could take) and
+      filled in by seeking back; if out can't seek back (gzip, pipes; see
+      canRewrite), there is no summary and outdated bounds are just dropped.
+    """
+    indent = '  '
+    eleDigits = 2
+    def __init__(self, out, precision=None, summary=False):
+        self.out = out
+        self.precision = precision
+        self.stats = trackStats() if summary else None
+        self.placeholder = None
+        self.inTrack = self.inSegment = False
+
+    def write(self, kind, item):
+        """ Write one event """
+        if kind == 'gpx':
+            self.startGpx(item)
+        elif kind == 'trk':
+            self.closeTrack()
+            self.out.write(self.indent+'<%s>\n'%self.trkTag)
+            for info in item.info:
+                self.out.write(2*self.indent+info+'\n')
+            self.inTrack = True
+        elif kind == 'trkseg':
+            self.closeSegment()
+            self.out.write(2*self.indent+'<%s>\n'%self.trksegTag)
+            self.inSegment = True
+            if self.stats is not None:
+                self.stats.startSegment()
+        elif kind == 'trkpts':
+            with metrics.timer('serialize'):
+                self.writePoints(item)
+            metrics.count('points.written', len(item))
+            if self.stats is not None:
+                self.stats.add(item)
+        elif kind == 'end':
+            self.closeTrack()
+            for tail in item.tail:
+                self.out.write(self.indent+tail+'\n')
+            self.out.write('</%s>\n'%self.gpxTag)
+            if self.placeholder is not None:
+                self.fillPlaceholder()
+        else:
+            raise ValueError("gpxWriter.write: unknown event kind %s"%kind)
+
+    def writeAll(self, events):
+        """ Write all events from iterable 'events' """
+        for kind, item in events:
+            self.write(kind, item)
+
+    def startGpx(self, doc):
+        scope = {uri: prefix for prefix, uri in doc.namespaces.items()}
+        newDecls = []
+        self.gpxTag = qualifiedName(doc.tag, scope, doc.namespaces, newDecls)
+        # Tracks are written in the namespace of the root element
+        ns = doc.tag[:doc.tag.index('}')+1] if doc.tag[0] == '{' else ''
+        self.trkTag = qualifiedName(ns+'trk', scope, doc.namespaces, newDecls)
+        self.trksegTag = qualifiedName(ns+'trkseg', scope, doc.namespaces, newDecls)
+        trkptTag = qualifiedName(ns+'trkpt', scope, doc.namespaces, newDecls)
+        eleTag = qualifiedName(ns+'ele', scope, doc.namespaces, newDecls)
+        timeTag = qualifiedName(ns+'time', scope, doc.namespaces, newDecls)
+        metadataTag = qualifiedName(ns+'metadata', scope, doc.namespaces, newDecls)
+        # One format per point: coordinates, then (possibly empty) ele, time and extra lines
+        ind, ind2 = 3*self.indent, 4*self.indent
+        coord = '%r' if self.precision is None else '%%.%if'%self.precision
+        ele = '%r' if self.precision is None else '%%.%if'%self.eleDigits
+        start = '%s<%s lat="%s" lon="%s">\n'%(ind, trkptTag, coord, coord)
+        end = '%s</%s>\n'%(ind, trkptTag)
+        self.eleFormat = '%s<%s>%s</%s>\n'%(ind2, eleTag, ele, eleTag)
+        self.timeFormat = '%s<%s>%%s</%s>\n'%(ind2, timeTag, timeTag)
+        self.extraFormat = ind2+'%s\n'
+        self.pointFormat = start+'%s%s%s'+end
+        # Common case: every point has elevation and time, and nothing else
+        self.denseFormat = start+self.eleFormat+self.timeFormat+end
+        attrs = ''.join(' %s=%s'%(qualifiedName(k, scope, doc.namespaces, newDecls), quote(v)) for k, v in doc.attrib.items())
+        decls = namespaceDeclarations(list(doc.namespaces.values())+newDecls, scope)
+        self.out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.out.write('<%s%s%s>\n'%(self.gpxTag, decls, attrs))
+        head = doc.head
+        if self.stats is not None and ns == '{%s}'%gpx11:
+            metadata = [i for i, h in enumerate(head) if _metadataStart.match(h)]
+            if metadata:
+                i = metadata[0]
+            else:
+                # metadata comes first
+                head = ['<%s></%s>'%(metadataTag, metadataTag)]+list(head)
+                i = 0
+            for h in head[:i]:
+                self.out.write(self.indent+h+'\n')
+            self.startMetadata(head[i])
+            head = head[i+1:]
+        for h in head:
+            self.out.write(self.indent+h+'\n')
+
+    def startMetadata(self, fragment):
+        """ Write <metadata> fragment without its bounds, reserving space for new ones (see fillPlaceholder) """
+        m = _metadataStart.match(fragment)
+        prefix = m.group(1)
+        if m.group(3):
+            # <metadata/>
+            fragment = '<%smetadata%s></%smetadata>'%(prefix, m.group(2), prefix)
+        fragment = _boundsElement.sub('', fragment)
+        ext = _extensionsStart.search(fragment)
+        if ext is not None:
+            before, extensionsTag, after = fragment[:ext.start()], ext.group(0), fragment[ext.end():]
+        else:
+            end = _metadataEnd.search(fragment)
+            before, extensionsTag, after = fragment[:end.start()], None, fragment[end.start():]
+        self.out.write(self.indent+before)
+        width = 0
+        if canRewrite(self.out):
+            # Until filled in, the reserved space holds the original extensions tag (if any) and blanks
+            width = len(summaryFragment(_widestStats(), prefix, extensionsTag))
+            self.placeholder = self.out.tell(), width, prefix, extensionsTag
+        self.out.write((extensionsTag or '').ljust(width))
+        self.out.write(after+'\n')
+
+    def fillPlaceholder(self):
+        """ Write bounds and summary into the space reserved in the header """
+        position, width, prefix, extensionsTag = self.placeholder
+        fragment = summaryFragment(self.stats, prefix, extensionsTag)
+        if len(fragment) > width:
+            # wider than expected: leave the blanks
+            return
+        self.out.seek(position)
+        self.out.write(fragment.ljust(width))
+        self.out.seek(0, os.SEEK_END)
+
+    def closeSegment(self):
+        if self.inSegment:
+            self.out.write(2*self.indent+'</%s>\n'%self.trksegTag)
+            self.inSegment = False
+
+    def closeTrack(self):
+        self.closeSegment()
+        if self.inTrack:
+            self.out.write(self.indent+'</%s>\n'%self.trkTag)
+            self.inTrack = False
+
+    def writePoints(self, seg):
+        """ Write all points of Segment seg with a single write """
+        n = len(seg)
+        lats, lons = seg.lat.tolist(), seg.lon.tolist()
+        if seg.extra is None and not np.isnan(seg.ele).any() and not np.isnat(seg.time).any():
+            denseFormat = self.denseFormat
+            self.out.write(''.join([denseFormat%point for point in
+                                    zip(lats, lons, seg.ele.tolist(), formatTimes(seg.time).tolist())]))
+            return
+        eleFormat, timeFormat, extraFormat = self.eleFormat, self.timeFormat, self.extraFormat
+        eles = [eleFormat%x if x == x else '' for x in seg.ele.tolist()]
+        if np.isnat(seg.time).all():
+            times = ['']*n
+        else:
+            times = [timeFormat%t if t != 'NaTZ' else '' for t in formatTimes(seg.time).tolist()]
+        extras = ['']*n if seg.extra is None else [extraFormat%x if x is not None else '' for x in seg.extra]
+        pointFormat = self.pointFormat
+        self.out.write(''.join([pointFormat%point for point in zip(lats, lons, eles, times, extras)]))
+
+def writeGpx(doc, out, precision=None):
+    """
+    Write track.GPX document to out: file name (gzip-compressed if it
+    ends in .gz, see openOutput) or text file object.
+    precision: see gpxWriter
+    """
+    if isinstance(out, str):
+        with openOutput(out) as f:
+            gpxWriter(f, precision).writeAll(doc.events())
+    else:
+        gpxWriter(out, precision).writeAll(doc.events())
+    return
+
+def timeRange(source):
+    """
+    (first, last) time stamps (datetime64) of the track points in source,
+    streaming through the file.  NaT if no time stamps are present.
+    """
+    return timeRangeOf(seg.timeRange() for kind, seg in iterEvents(source, chunkSize=10000) if kind == 'trkpts')
+
+_trkptStart = re.compile(rb'<(?:[\w.-]+:)?trkpt[\s>/]')
+_timeElement = re.compile(rb'<(?:[\w.-]+:)?time>\s*([^<\s]+)\s*</')
+
+def probeTimeRange(fileName, blockSize=1<<16):
+    """
+    (first, last) time stamps (datetime64) of the track points in GPX file
+    fileName, like timeRange, but without parsing the whole file:
+    the first time stamp is taken from the first track point that has one,
+    the last one is searched for in blocks read backwards from the end of the file.
+    Falls back to timeRange if the end of the file can't be made sense of,
+    and for compressed files (which can't be read backwards).
+    """
+    if compression(fileName) is not None:
+        return timeRange(fileName)
+    first = None
+    with open(fileName, 'rb') as f:
+        for kind, elem in gpxReader(f):
+            if kind != 'trkpt':
+                continue
+            for child in elem:
+                if localName(child.tag) == 'time' and child.text and child.text.strip():
+                    first = child.text.strip()
+                    break
+            if first is not None:
+                break
+        if first is None:
+            # no time stamps at all
+            return np.datetime64('NaT', 'us'), np.datetime64('NaT', 'us')
+        last = None
+        size = f.seek(0, os.SEEK_END)
+        start = size
+        while start > 0 and last is None:
+            start = max(0, start-blockSize)
+            blockSize *= 2
+            f.seek(start)
+            tail = f.read(size-start)
+            starts = [m.start() for m in _trkptStart.finditer(tail)] + [len(tail)]
+            # search points back to front; each one extends up to the next one
+            for i in range(len(starts)-2, -1, -1):
+                m = _timeElement.search(tail, starts[i], starts[i+1])
+                if m is not None:
+                    last = m.group(1).decode()
+                    break
+    if last is None:
+        return timeRange(fileName)
+    return tuple(parseTimes([first, last]))
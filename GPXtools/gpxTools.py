@@ -3,246 +3,935 @@
 
 # Tools to view, merge, and manipulate GPX tracks from bike apps.
 
-# TODO: 
-# * Develop tool to fill time gaps (think: in Tahuna coverage) with 'filler' file (think: Strava file or files)
-# * Overload privacyZone and stravaUpload so as to work from files in memory (ASCII lists?) rather than on the disk.  Parm fileOutput=True or something.
-# * in merge / privacyZone: correct bounding box / trip length (Strava keeps correcting them)
+# Several steps (merge, privacy zone, time shift, upload) can be chained in
+# memory, without intermediate files: see pipeline.pipeline.
 
 
-import matplotlib.pyplot as plt
+# Plotting (matplotlib, cartopy, shapely), geocoding (geopy), the archive
+# index, map tiles and downloads (requests) are imported by the functions
+# using them, so that importing this module for time shifts, privacy zones
+# and merging stays fast.
 
-import gpxpy.parser as gpxParser
 import numpy as np
 from units import unit
+from units.predefined import define_units
+define_units() # so that non-SI radii (e.g. 'mi') can be converted to meter
 import glob
-import gpxpy
-import fiona
-import sys
-
-import cartopy.crs as ccrs
-from cartopy.io.img_tiles import OSM
-from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
-import shapely.geometry as sgeom
 
 import os.path
-import requests
+import argparse
+import re
+import sqlite3
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from . import gpxStream
+from . import metrics
+from .trackCache import trackCache
+from .simplify import segmentSimplifier
+from .stats import trackStats, ONE_DEGREE, EARTH_RADIUS
+from . import gapFill
+from .overlap import sweep, resolveOverlaps, policies as overlapPolicies
+from .track import GPX
+
+# ### Reading GPX files: through the binary track cache (see trackCache), if enabled
+# using setTrackCache() or environment variable GPXTOOLS_TRACK_CACHE (cache directory)
+
+_trackCache=None
+if os.environ.get('GPXTOOLS_TRACK_CACHE'):
+    _trackCache=trackCache(os.environ['GPXTOOLS_TRACK_CACHE'])
+
+def setTrackCache(cache):
+    """ Use trackCache instance cache for all reads; None: no caching """
+    global _trackCache
+    _trackCache=cache
+def getTrackCache():
+    return _trackCache
+
+def simplifier(simplify):
+    """
+    segmentSimplifier from option 'simplify': None (no simplification),
+    tolerance (m or units quantity; Ramer-Douglas-Peucker), or segmentSimplifier
+    """
+    if simplify is None or isinstance(simplify, segmentSimplifier):
+        return simplify
+    return segmentSimplifier(simplify)
+
+def simplifyWhole(simp, seg):
+    """ Segment seg simplified as a whole by segmentSimplifier simp """
+    simp.startSegment()
+    return simp(seg)
+
+_gpxExtension=re.compile(r'\.gpx(\.gz|\.bz2)?$|\.(gz|bz2|zip)$', re.IGNORECASE)
+
+def outputName(inFileName, suffix, outDir=None):
+    """
+    Default output file name for inFileName: track.gpx (or track.gpx.gz, ...) -> track<suffix>.gpx,
+    in outDir, or next to the input file (for members of zip archives: next to the archive)
+    """
+    archive, member=gpxStream.splitArchivePath(inFileName)
+    base=os.path.basename(inFileName if member is None else member)
+    base=_gpxExtension.sub('', base)+suffix+'.gpx'
+    return os.path.join(os.path.dirname(archive) if outDir is None else outDir, base)
+
+def gapFiller(fillers, workers=1):
+    """
+    gapFill.gapFiller from option 'fillers': None or empty (no gap filling),
+    filler files (list of file names, directory or glob pattern; see expandInputs),
+    or gapFill.gapFiller
+    """
+    if fillers is None or isinstance(fillers, gapFill.gapFiller):
+        return fillers
+    fillers=expandInputs(fillers)
+    if len(fillers) == 0:
+        return None
+    return gapFill.gapFiller(gapFill.fillerIndex(fillers, readGpx, workers))
+
+def readGpx(fileName):
+    """ track.GPX document from fileName, via the track cache if enabled """
+    with metrics.timer('parse'):
+        if _trackCache is not None:
+            return _trackCache.load(fileName)
+        return gpxStream.readGpx(fileName)
+def readEvents(fileName, chunkSize=None):
+    """ Event stream (see gpxStream.iterEvents) from fileName, via the track cache if enabled """
+    if _trackCache is not None:
+        return metrics.timed('parse', _trackCache.load(fileName).events())
+    return metrics.timed('parse', gpxStream.iterEvents(fileName, chunkSize))
+
+# ### Map tiles for plotTracks: through a local tile cache (see tileCache) in directory
+# $GPXTOOLS_TILE_CACHE (default ~/.cache/GPXtools/tiles); set GPXTOOLS_TILES_OFFLINE=1
+# to never access the tile server (tiles not in the cache are drawn blank)
+
+_tileSource=None
+
+def getTileSource():
+    """ Shared tileCache.cachedOSM used by plotTracks """
+    global _tileSource
+    if _tileSource is None:
+        from .tileCache import tileStore, cachedOSM, defaultTileDir
+        _tileSource=cachedOSM(tileStore(defaultTileDir()), offline=os.environ.get('GPXTOOLS_TILES_OFFLINE', '') not in ('', '0'))
+    return _tileSource
+def setTileSource(tiles):
+    """ Use tiles (tileCache.cachedOSM or any cartopy tile source) in plotTracks; None: default """
+    global _tileSource
+    _tileSource=tiles
 
 class gpxTools:
     plotColors=['black', 'red', 'green', 'blue', 'yellow', 'orange']
 
-    def plotTracks(self, files, osmZoomLevel=10, padding=0.1):
-        # ToDo: adapt OSM zoom level automatically
-        # Make plot interactive, allow user to zoom, scroll, pan; adapt map bg accordingly
-        # Padding: add padding on all four sides so tracks don't end at edge of map.  0.1: 10% padding on all sides.
+    def prepareTracks(self, files, padding=0.1, simplify=None):
+        """
+        Shapes and map extent for plotTracks: list of MultiLineStrings
+        (one per track, one line per segment) and [minLon, maxLon, minLat, maxLat]
+        including padding.
+        simplify: tolerance (m) or simplify.segmentSimplifier, see simplifier()
+        files may be compressed; zip archives stand for all GPX files in them (see expandInputs).
+        """
+        files=expandInputs(files)
         if len(files) == 0:
             raise ValueError("gpxTools.plotTracks: need at least one file to work with!")
         if padding < 0:
             raise ValueError("gpxTools.plotTracks: padding value is %f; needs to be non-negative."%padding)
-        # Open with fiona:
-        # Straightforward to generate shapes, but doesn't retain time information.
+        import shapely.geometry as sgeom
+        simp=simplifier(simplify)
         trackShapes=[]
         # extent: bounding box for map plot: minLon, maxLon, minLat, maxLat
-        extent=[sys.float_info.max, sys.float_info.min, sys.float_info.max, sys.float_info.min]
+        extent=[np.inf, -np.inf, np.inf, -np.inf]
         for fn in files:
-            tracks=fiona.open(fn, layer='tracks')
-            for track in tracks:
-                coords=track['geometry']['coordinates']
-                shp=sgeom.MultiLineString(coords)
-                # shp.bounds has different order than extent...
-                if shp.bounds[0]<extent[0]:
-                    extent[0] = shp.bounds[0] 
-                if shp.bounds[2] > extent[1]:
-                    extent[1]=shp.bounds[2]
-                if shp.bounds[1] < extent[2]:
-                    extent[2] = shp.bounds[1]
-                if shp.bounds[3] > extent[3]:
-                    extent[3] = shp.bounds[3]
-                trackShapes.append(shp)
-            # Add padding:
-            lonShift=padding*(extent[1]-extent[0])
-            extent[0]=extent[0]-lonShift
-            extent[1]=extent[1]+lonShift
-            latShift=padding*(extent[3]-extent[2])
-            extent[2]=extent[2]-latShift
-            extent[3]=extent[3]+latShift
-            # Start plotting
-            osm=OSM()
-            # Following https://ocefpaf.github.io/python4oceanographers/blog/2015/08/03/fiona_gpx/
-            ax = plt.axes(projection=osm.crs)
-            gl=ax.gridlines(draw_labels=True)
-            gl.xlabels_top = gl.ylabels_right = False
-            gl.xformatter = LONGITUDE_FORMATTER
-            gl.yformatter = LATITUDE_FORMATTER
-            ax.set_extent(extent)
-            ax.add_image(osm,osmZoomLevel) 
-            ## Fiona
-            for i, track in enumerate(trackShapes):
-                ax.add_geometries(track, crs=ccrs.PlateCarree(), edgecolor=self.plotColors[i % len(self.plotColors)], linewidth=2, facecolor='none')
-            plt.tight_layout()
-            plt.show()
-            return
+            for track in readGpx(fn).tracks:
+                segs=track.segments if simp is None else [simplifyWhole(simp, seg) for seg in track.segments]
+                segs=[seg for seg in segs if len(seg) > 1]
+                if len(segs) == 0:
+                    continue
+                extent[0]=min(extent[0], min(seg.lon.min() for seg in segs))
+                extent[1]=max(extent[1], max(seg.lon.max() for seg in segs))
+                extent[2]=min(extent[2], min(seg.lat.min() for seg in segs))
+                extent[3]=max(extent[3], max(seg.lat.max() for seg in segs))
+                trackShapes.append(sgeom.MultiLineString([np.column_stack((seg.lon, seg.lat)) for seg in segs]))
+        if len(trackShapes) == 0:
+            raise ValueError("gpxTools.plotTracks: no track points found in input files!")
+        # Add padding:
+        lonShift=padding*(extent[1]-extent[0])
+        extent[0]=extent[0]-lonShift
+        extent[1]=extent[1]+lonShift
+        latShift=padding*(extent[3]-extent[2])
+        extent[2]=extent[2]-latShift
+        extent[3]=extent[3]+latShift
+        if simp is not None:
+            simp.report()
+        return trackShapes, extent
+
+    def plotTracks(self, files, osmZoomLevel=None, padding=0.1, simplify=None, tiles=None):
+        # osmZoomLevel: None: chosen such that the map is about 1000 pixels across
+        # tiles: map tile source, default getTileSource() (cached OSM tiles, see tileCache)
+        # Make plot interactive, allow user to zoom, scroll, pan; adapt map bg accordingly
+        # Padding: add padding on all four sides so tracks don't end at edge of map.  0.1: 10% padding on all sides.
+        # simplify: tolerance (m) or simplify.segmentSimplifier; fewer points are faster to draw
+        import matplotlib.pyplot as plt
+        import cartopy.crs as ccrs
+        from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
+        from . import heatmap
+        trackShapes, extent=self.prepareTracks(files, padding, simplify)
+        # Start plotting
+        osm=getTileSource() if tiles is None else tiles
+        # Following https://ocefpaf.github.io/python4oceanographers/blog/2015/08/03/fiona_gpx/
+        ax = plt.axes(projection=osm.crs)
+        gl=ax.gridlines(draw_labels=True)
+        gl.top_labels = gl.right_labels = False
+        gl.xformatter = LONGITUDE_FORMATTER
+        gl.yformatter = LATITUDE_FORMATTER
+        ax.set_extent(extent)
+        if osmZoomLevel is None:
+            osmZoomLevel=heatmap.autoZoom(extent)
+        if hasattr(osm, 'prefetch'):
+            osm.prefetch(extent, osmZoomLevel)
+        ax.add_image(osm,osmZoomLevel) 
+        for i, track in enumerate(trackShapes):
+            ax.add_geometries(track, crs=ccrs.PlateCarree(), edgecolor=self.plotColors[i % len(self.plotColors)], linewidth=2, facecolor='none')
+        plt.tight_layout()
+        plt.show()
+        return
+
+    def plotHeatmap(self, files, outFileName, width=2048, extent=None, padding=0.05, lineDensity=True, cmap='inferno'):
+        """
+        Headless alternative to plotTracks for many tracks: bin all points
+        of all files (list, directory, or glob pattern) into a Web Mercator
+        raster width pixels wide, save as PNG file outFileName (transparent
+        where there are no tracks).  See heatmap.renderHeatmap.
+        Returns extent [minLon, maxLon, minLat, maxLat] and matching OSM zoom level.
+        """
+        from . import heatmap
+        files=expandInputs(files)
+        if len(files) == 0:
+            raise ValueError("gpxTools.plotHeatmap: need at least one file to work with!")
+        hm=heatmap.renderHeatmap(files, outFileName, lambda fn: readEvents(fn, 100000), width=width, extent=extent,
+                                 padding=padding, lineDensity=lineDensity, cmap=cmap)
+        zoom=heatmap.autoZoom(hm.extent, width)
+        print("Heatmap of %i points from %i files written to %s (%i x %i pixels, zoom level %i)"%(
+            hm.nPoints, len(files), outFileName, hm.width, hm.height, zoom))
+        return hm.extent, zoom
 
     ###
     ### Add: check that segments don't overlap in time (not tracks)
     ### Append segments, not tracks
     ### Check if time gaps can be filled using fillers
-    def mergeTracks(self, fileNames, outFileName, fillers=[]):
-        # Read in files
-        gpxes=[]
-        for fn in fileNames:
-            with open(fn, 'r') as f:
-                parser=gpxParser.GPXParser(f)
-                parser.parse()
-                gpx=parser.gpx
-                gpxes.append(gpx)
-                print ("Done reading in ", fn)
-        # Sort by time
+    def mergeTracks(self, fileNames, outFileName, fillers=[], chunkSize=10000, workers=1, simplify=None, precision=None,
+                    overlap='density', prefer=None):
+        # fillers: files (list, directory or glob pattern) or gapFill.gapFiller; gaps of more than a
+        #   minute within segments are filled with the points these files have for that time
+        # overlap, prefer: what to do with files overlapping in time, see mergedEvents
+        # simplify: tolerance (m) or simplify.segmentSimplifier, see simplifier()
+        # precision: decimals of coordinates in output (None: exact), see gpxStream.gpxWriter;
+        # outFileName ending in .gz (e.g. merged.gpx.gz) gives gzip-compressed output
+        # <bounds> and summary (length, ...) of the output are refreshed by the writer
+        from .pipeline import pipeline
+        pipe=pipeline(self.mergedEvents(fileNames, chunkSize, workers, overlap, prefer))
+        pipe.fill(fillers, workers).simplify(simplify).write(outFileName, precision)
+
+    def mergedEvents(self, fileNames, chunkSize=10000, workers=1, overlap='density', prefer=None):
+        """
+        Event stream (see gpxStream.iterEvents) of all tracks in fileNames, in time order;
+        header and tail (metadata etc.) are taken from the earliest file.
+        overlap: what to do with files overlapping in time (e.g. two devices recording the same ride):
+          'error': refuse to merge (ValueError); otherwise overlapping segments are merged,
+          see overlap.resolveOverlaps: 'density' (more points per second wins), 'prefer'
+          (devices matching patterns in list prefer, by file name or GPX creator, win) or
+          'interleave' (all points in time order)
+        Time ranges are probed from the first track point and the end of each file
+        (in parallel if workers > 1), and checked, right away; files that don't overlap with
+        others are then streamed one at a time, groups of overlapping files are read and
+        resolved together, as the stream is consumed.
+        Input files may be compressed; zip archives stand for all GPX files in them (see expandInputs).
+        """
+        if overlap != 'error' and overlap not in overlapPolicies:
+            raise ValueError("gpxTools.mergeTracks: unknown overlap policy %s"%overlap)
+        fileNames=expandInputs(fileNames)
         startTimes=[]
         endTimes=[]
-        for gpx in gpxes:
-            startTimes.append(gpx.tracks[0].segments[0].points[0].time)
-            endTimes.append(gpx.tracks[-1].segments[-1].points[-1].time)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                ranges=list(executor.map(gpxStream.probeTimeRange, fileNames, chunksize=max(1, len(fileNames)//(4*workers))))
+        else:
+            ranges=map(gpxStream.probeTimeRange, fileNames)
+        for fn, (first, last) in zip(fileNames, ranges):
+            startTimes.append(first)
+            endTimes.append(last)
+            print ("Done probing ", fn)
+        # Sort by time
         idx=np.argsort(startTimes)
-        gpxesSorted=np.array(gpxes)[idx]
         fnSorted=np.array(fileNames)[idx]
         startTimesSorted=np.array(startTimes)[idx]
         endTimesSorted=np.array(endTimes)[idx]
-
-        # Make sure there's no time overlap between files
-        for i in range(len(startTimesSorted)-1):
-            if not startTimesSorted[i+1] > endTimesSorted[i]:
-                print("Time overlap between files %i and %i"%(i,i+1))
-                print(fnSorted[i], fnSorted[i+1])
-                print("Endtime of first: ", endTimesSorted[i])
-                print("StartTime of second:", startTimesSorted[i+1])
-                assert False
         for fn, start, end in zip(fnSorted, startTimesSorted, endTimesSorted):
             print (fn, start, end)
 
-        out=gpxesSorted[0]
-        for gpx in gpxesSorted[1:]:
-            for track in gpx.tracks:
-                out.tracks.append(track)
-        output=out.to_xml()
-        with open(outFileName, 'w') as out:
-            out.write(output)
+        # Groups of files overlapping in time (sort-and-sweep; sorted already)
+        groups=sweep(startTimesSorted, endTimesSorted)
+        if overlap == 'error':
+            for i in range(len(groups)-1):
+                if groups[i+1] == groups[i]:
+                    print("Time overlap between files %i and %i"%(i,i+1))
+                    print(fnSorted[i], fnSorted[i+1])
+                    print("Endtime of first: ", endTimesSorted[i])
+                    print("StartTime of second:", startTimesSorted[i+1])
+                    raise ValueError("gpxTools.mergeTracks: time overlap between %s and %s"%(fnSorted[i], fnSorted[i+1]))
+        return self._mergedStream(fnSorted, groups, chunkSize, overlap, prefer)
+
+    def _mergedStream(self, fnSorted, groups, chunkSize, overlap, prefer):
+        nOverlaps=0
+        firstDoc=None
+        for group in np.split(fnSorted, np.flatnonzero(np.diff(groups))+1):
+            group=list(group)
+            if len(group) == 1:
+                for kind, item in readEvents(group[0], chunkSize):
+                    if kind == 'gpx' and firstDoc is None:
+                        yield kind, item
+                    elif kind == 'end' and firstDoc is None:
+                        firstDoc=item
+                    elif kind in ('trk', 'trkseg', 'trkpts'):
+                        yield kind, item
+                continue
+            print("Resolving time overlap between", ', '.join(group))
+            docs=[readGpx(fn) for fn in group]
+            if firstDoc is None:
+                firstDoc=docs[0]
+                yield 'gpx', firstDoc.header()
+            tracks, n=resolveOverlaps(docs, group, overlap, prefer)
+            nOverlaps+=n
+            for kind, item in GPX(tracks=tracks).events():
+                if kind in ('trk', 'trkseg', 'trkpts'):
+                    yield kind, item
+        if nOverlaps:
+            print("Merged %i groups of overlapping segments (policy %s)"%(nOverlaps, overlap))
+        yield 'end', firstDoc
 
 # ### Geocoding: get coords matching address and vice-versa.
 # Get coords of addresses using geopy: https://pypi.python.org/pypi/geopy  -- maybe make that geocoder, instead (actively developed as of Feb 2018)
 
-from geopy.geocoders import Nominatim
-def getCoordsFromAddress(address):
-    geolocator=Nominatim()
-    return geolocator.geocode(address)
-def getAddressFromCoords(coordString):
-    geolocator=Nominatim()
-    return geolocator.reverse(coordString)
+from .geoCache import geocodeCache, defaultCacheFile
+
+# Look-ups go through a geocodeCache (in memory + SQLite file geocodeCacheFile,
+# None: memory only), so that the same addresses aren't resolved over and over.
+# The geolocator (default: Nominatim) is created once and reused;
+# setGeolocator() allows plugging in a different (e.g., offline stub) geocoder.
+geocodeCacheFile=defaultCacheFile()
+_geocodeCache=None
+_geolocator=None
+
+def getGeocodeCache():
+    global _geocodeCache
+    if _geocodeCache is None:
+        try:
+            _geocodeCache=geocodeCache(geocodeCacheFile)
+        except (OSError, sqlite3.Error) as e:
+            print("Can't use geocoding cache file %s (%s), caching in memory only"%(geocodeCacheFile, e))
+            _geocodeCache=geocodeCache(None)
+    return _geocodeCache
+def setGeocodeCache(cache):
+    global _geocodeCache
+    _geocodeCache=cache
+def getGeolocator():
+    global _geolocator
+    if _geolocator is None:
+        from geopy.geocoders import Nominatim
+        _geolocator=Nominatim(user_agent='GPXtools')
+    return _geolocator
+def setGeolocator(geolocator):
+    global _geolocator
+    _geolocator=geolocator
+
+def _geocode(method, query):
+    """ geolocator.method(query), timed as 'geocode' (cache misses only) """
+    with metrics.timer('geocode'):
+        return getattr(getGeolocator(), method)(query)
+def getCoordsFromAddress(address, useCache=True):
+    metrics.count('geocode.lookups')
+    if not useCache:
+        return _geocode('geocode', address)
+    return getGeocodeCache().lookup('geocode', address.strip(), lambda: _geocode('geocode', address))
+def getAddressFromCoords(coordString, useCache=True):
+    metrics.count('geocode.lookups')
+    if not useCache:
+        return _geocode('reverse', coordString)
+    query=','.join(x.strip() for x in coordString.split(','))
+    return getGeocodeCache().lookup('reverse', query, lambda: _geocode('reverse', coordString))
 
 #geolocator.geocode('Voorstraat 80, 8715JC ')
 #geolocator.reverse('52, 15')
 #geolocator.geocode('Kassel')
 #geolocator.geocode('Hilo').latitude
 
-def shiftTimes(inFileName, nHours, outFileName=None):
+def shiftTimes(inFileName, nHours, outFileName=None, chunkSize=10000, precision=None):
     """
     add nHours hours to all times given in inFileName (waypoints)
-    outFileName defaults to inFile_timewarp.gpx
+    outFileName defaults to inFile_timewarp.gpx; gzip-compressed if it ends in .gz
+    precision: decimals of coordinates in output (None: exact), see gpxStream.gpxWriter
     """
-    from datetime import timedelta
+    from .pipeline import pipeline
     if outFileName is None:
-        outFileName=inFileName[:inFileName.index('.gpx')]+'_timewarp.gpx'
-    timeShift=timedelta(hours=nHours)
-    with open(inFileName, 'r') as f:
-        parser=gpxParser.GPXParser(f)
-        parser.parse()
-        gpx=parser.gpx
-    for track in gpx.tracks:
-        for seg in track.segments:
-            for point in seg.points:
-                point.time = point.time+timeShift
-    with open(outFileName, 'w') as out:
-        out.write(gpx.to_xml())
+        outFileName=outputName(inFileName, '_timewarp')
+    pipeline(inFileName, chunkSize).shift(nHours).write(outFileName, precision, summary=False)
     return    
 
+def statistics(fileName, eleThreshold=5., movingSpeed=1/3.6):
+    """
+    Statistics of all tracks in fileName (see stats.trackStats): dictionary with
+    points, distance (m), movingDistance (m), movingTime (s), totalTime (s),
+    movingSpeed (m/s), maxSpeed (m/s), uphill (m), downhill (m), start, end, and
+    bounds (minLat, minLon, maxLat, maxLon)
+    eleThreshold: hysteresis (m) for elevation gain; movingSpeed: slower is stopped (m/s)
+    """
+    return trackStats(eleThreshold, movingSpeed).addEvents(readEvents(fileName, 10000)).summary()
+
+def distances2d(lats, lons, zoneLat, zoneLon):
+    """
+    Vectorized version of gpxpy.geo.distance (2D, in meters) between
+    points (lats, lons) and a reference point or points (zoneLat, zoneLon);
+    arguments are broadcast against each other.
+    Like gpxpy, use the flat-earth approximation for points less than
+    0.2 degrees apart and the haversine formula otherwise.
+    """
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    dLat = lats - zoneLat
+    dLon = lons - zoneLon
+    coef = np.cos(np.radians(lats))
+    flat = np.hypot(dLat, dLon*coef) * ONE_DEGREE
+    far = (np.abs(dLat) > .2) | (np.abs(dLon) > .2)
+    if not far.any():
+        return flat
+    a = np.sin(np.radians(dLat)/2)**2 + \
+        np.sin(np.radians(dLon)/2)**2 * coef * np.cos(np.radians(zoneLat))
+    haversine = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    return np.where(far, haversine, flat)
+
+def loadZones(fileName):
+    """
+    Polygonal privacy zones (shapely geometries, lon/lat) from the features of a
+    GeoJSON file, shapefile or anything else fiona can read (in lon/lat, WGS84)
+    """
+    import fiona
+    import shapely.geometry as sgeom
+    with fiona.open(fileName) as src:
+        epsg = src.crs.to_epsg() if src.crs else None
+        if epsg not in (None, 4326):
+            raise ValueError("gpxTools.loadZones: %s is in EPSG:%s, need longitude / latitude (EPSG:4326)"%(fileName, epsg))
+        zones = [sgeom.shape(feature.geometry) for feature in src if feature.geometry is not None]
+    for zone in zones:
+        if zone.geom_type not in ('Polygon', 'MultiPolygon'):
+            raise ValueError("gpxTools.loadZones: %s has a %s; use coordinates and radii for zones around points"
+                             %(fileName, zone.geom_type))
+    return zones
+
 class privacyZone:
-    def __init__(self, addresses, radii):
+    """
+    Privacy zones: circles (addresses or coordinates, and radii) and / or
+    polygons (shapely geometries in lon/lat, or files of them, see loadZones).
+    """
+    # Zones are indexed on a lat/lon grid with cells of at least this size (deg)
+    minCellSize = 0.01
+    def __init__(self, addresses=(), radii=(), polygons=()):
+        if radii is None:
+            radii = ()
         self.radii = [unit('m')(r).num for r in radii] # convert to meter
         if len(addresses) != len(radii):
             print("Please provide one radius per address / coordinate!")
             print(len(addresses), "addresses / coordinates were passes,")
             print(len(radii), "radii.")
             raise ValueError("gpxTools:privacyZone: nAddresses != nRadii")
-        try:
-            addresses[0].latitude
-            self.coords=addresses # assume coordinates were passed instead of addresses; no need to call Nominatim
+        # Coordinates (anything with a latitude) are used as they are, no need to call Nominatim;
+        # everything else is assumed to be an address
+        self.coords=[add if hasattr(add, 'latitude') else getCoordsFromAddress(add) for add in addresses]
+        for add, coo in zip(addresses, self.coords):
+            if coo is None:
+                raise ValueError("gpxTools:privacyZone: couldn't resolve address %s"%add)
+        self.buildIndex()
+        if isinstance(polygons, str):
+            polygons = [polygons]
+        self.polygons = []
+        for polygon in polygons:
+            if isinstance(polygon, str):
+                self.polygons.extend(loadZones(polygon))
+            else:
+                self.polygons.append(polygon)
+        self.buildPolygonIndex()
+        return
+
+    def buildPolygonIndex(self):
+        """
+        Prepare polygons and put them into an STRtree; points are looked up
+        in the tree by bounding box, and only the candidates are tested exactly.
+        """
+        self.tree = None
+        if not self.polygons:
             return
-        except AttributeError:
-            pass # assume addresses were passes
-        self.coords=[getCoordsFromAddress(add) for add in addresses]
+        import shapely
+        self.polygonArray = np.array(self.polygons, dtype=object)
+        shapely.prepare(self.polygonArray)
+        self.tree = shapely.STRtree(self.polygonArray)
+        return
+
+    def __getstate__(self):
+        # for worker processes; geometries arrive unprepared, so the index is rebuilt there
+        state = self.__dict__.copy()
+        state.pop('tree', None)
+        state.pop('polygonArray', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.buildPolygonIndex()
+
+    def buildIndex(self):
+        """
+        Store zone centers and radii in arrays and sort zones into
+        grid cells covering their (conservative) lat/lon bounding boxes.
+        """
+        self.lats = np.array([coo.latitude for coo in self.coords], dtype=float)
+        self.lons = np.array([coo.longitude for coo in self.coords], dtype=float)
+        self.radiiArray = np.array(self.radii, dtype=float)
+        # Half-widths of bounding boxes in degrees, padded by 1%.
+        # Longitude: use cosine of the highest latitude reachable within the box
+        dLat = 1.01*self.radiiArray/ONE_DEGREE
+        maxLat = np.minimum(np.abs(self.lats)+dLat, 90.)
+        cosMax = np.cos(np.radians(maxLat))
+        dLon = np.full_like(dLat, 360.)
+        ok = cosMax > dLat/180.
+        dLon[ok] = dLat[ok]/cosMax[ok]
+        self.cellSize = max(2*dLat.max(initial=0.), self.minCellSize)
+        self.cells = {}
+        self.globalZones = []
+        for i in range(len(self.lats)):
+            if dLon[i] >= 180.:
+                self.globalZones.append(i)
+                continue
+            iRange = range(self._cell(self.lats[i]-dLat[i]), self._cell(self.lats[i]+dLat[i])+1)
+            jRange = range(self._cell(self.lons[i]-dLon[i]), self._cell(self.lons[i]+dLon[i])+1)
+            for ci in iRange:
+                for cj in jRange:
+                    self.cells.setdefault((ci, cj), []).append(i)
         return
+
+    def _cell(self, deg):
+        return int(np.floor(deg/self.cellSize))
+
+    def pointsTooClose(self, lats, lons):
+        """
+        Boolean mask, True for all points (arrays lats, lons)
+        that lie within any privacy zone.
+        Only circles registered in the grid cell of a point, and
+        polygons whose bounding box contains it, are checked.
+        """
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        mask = np.zeros(lats.shape, dtype=bool)
+        if len(lats) == 0:
+            return mask
+        if self.tree is not None:
+            import shapely
+            points = shapely.points(lons, lats)
+            iPoint, iPolygon = self.tree.query(points)
+            inside = shapely.intersects(self.polygonArray[iPolygon], points[iPoint])
+            mask[iPoint[inside]] = True
+        if self.globalZones:
+            zones = np.array(self.globalZones)
+            d = distances2d(lats[:,None], lons[:,None], self.lats[zones], self.lons[zones])
+            mask |= (d < self.radiiArray[zones]).any(axis=1)
+        if not self.cells:
+            return mask
+        ci = np.floor(lats/self.cellSize).astype(np.int64)
+        cj = np.floor(lons/self.cellSize).astype(np.int64)
+        cellIds, inverse = np.unique(np.stack((ci, cj)), axis=1, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(cellIds.shape[1]+1))
+        for k in range(cellIds.shape[1]):
+            zones = self.cells.get((cellIds[0,k], cellIds[1,k]))
+            if zones is None:
+                continue
+            idx = order[bounds[k]:bounds[k+1]]
+            zones = np.array(zones)
+            d = distances2d(lats[idx,None], lons[idx,None], self.lats[zones], self.lons[zones])
+            mask[idx] |= (d < self.radiiArray[zones]).any(axis=1)
+        return mask
+
     def isPointTooClose(self, p):
-        for coo, r in zip(self.coords, self.radii):
-            if p.distance_2d(coo) < r:
-                return True
-        return False
+        return bool(self.pointsTooClose([p.latitude], [p.longitude])[0])
     
-def applyPrivacyZone(inFileName, coordsAddresses, radii, outFileName=None):
+def applyPrivacyZone(inFileName, coordsAddresses, radii=None, outFileName=None, chunkSize=10000, simplify=None, precision=None):
     """
     Copy GPX track from inFileName into outFileName, rejecting all waypoints
     within a "privacy zone" defined in arrays (of equal length!)
     "coordsAddresses" (GPS coordinates or uniquely resolvable addresses)
     and "radii" (as units.quantity Quantities).
-    outFileName defaults to inFile_pz.gpx 
+    Alternatively, coordsAddresses can be a privacyZone instance (radii are ignored);
+    use that to avoid geocoding the same addresses for each file.
+    simplify: simplify the remaining track (tolerance in m or
+    simplify.segmentSimplifier, see simplifier())
+    <bounds> and summary in the metadata are refreshed (see gpxStream.gpxWriter).
+    precision: decimals of coordinates in output (None: exact), see gpxStream.gpxWriter
+    outFileName defaults to inFile_pz.gpx; gzip-compressed if it ends in .gz
     """
+    from .pipeline import pipeline
     if outFileName is None:
-        outFileName=inFileName[:inFileName.index('.gpx')]+'_pz.gpx'
-    pz = privacyZone(coordsAddresses, radii)
-    with open(inFileName, 'r') as f:
-        parser=gpxParser.GPXParser(f)
-        parser.parse()
-        gpx=parser.gpx
-    # Delete points within privacyZone
-    for track in gpx.tracks:
-        for seg in track.segments:
-            ### Watch out: can't pop from a list while iterating (forward!) over it
-            ###   (it's not syntactically forbidden, but it messes with indexing)
-            ### So, iterating backward.
-            for i in range(len(seg.points)-1, -1, -1):
-                if pz.isPointTooClose(seg.points[i]):
-                    seg.points.pop(i)
-    with open(outFileName, 'w') as out:
-        out.write(gpx.to_xml())
+        outFileName=outputName(inFileName, '_pz')
+    # Delete points within privacyZone: compute mask for chunks of points at once
+    pipeline(inFileName, chunkSize).privacy(coordsAddresses, radii).simplify(simplify).write(outFileName, precision)
     return
 
+def simplifyTrack(inFileName, tolerance, outFileName=None, method='rdp', monotonicTimes=False, chunkSize=None, precision=None):
+    """
+    Copy GPX track from inFileName into outFileName, dropping points that
+    deviate less than tolerance (m or units quantity) from the simplified track.
+    method: 'rdp' (Ramer-Douglas-Peucker) or 'vw' (Visvalingam-Whyatt)
+    monotonicTimes: also drop points with time stamps out of order
+    Segments are simplified as a whole unless chunkSize is set.
+    precision: decimals of coordinates in output (None: exact), see gpxStream.gpxWriter
+    outFileName defaults to inFile_simple.gpx; gzip-compressed if it ends in .gz
+    Returns number of points removed.
+    """
+    if outFileName is None:
+        outFileName=outputName(inFileName, '_simple')
+    from .pipeline import pipeline
+    simp=segmentSimplifier(tolerance, method, monotonicTimes)
+    pipeline(inFileName, chunkSize).simplify(simp).write(outFileName, precision, summary=False)
+    return simp.nIn-simp.nOut
+
 def getGpxFromTahuna(linkFileName, outFileName='track.gpx'):
     """
     linkFileName = link to GPX track page generated by Tahuna app
-    Download GPX track to file outFileName.
+    Download GPX track to file outFileName (see tahuna.tahunaDownloader).
     M.Mueller@astro.rug.nl, 2018/02/19
     """
     if not os.path.isfile(linkFileName):
         raise ValueError("Can't open "+linkFileName)
     if os.path.isfile(outFileName):
         raise ValueError("Output file "+outFileName+" already exists!")
-    url1 = open(linkFileName).read().strip()
-    trackUrl=None
-    with requests.get(url1) as r:
-        lines=r.text.split('\n')
-        for line in lines:
-            # Extract download URL from first line containing href and ?uniqueid
-            if ('?uniqueid' in line) and ('href' in line):
-                # URL sits between ""
-                trackUrl=line.split('"')[1]
-                break
-    if trackUrl is None:
-        raise ValueError("Couldn't find URL pointing to track in file linked from %s"%linkFileName)
-    out=open(outFileName, 'w')
-    # requests.get takes care of uncompressing content:
-    with requests.get(trackUrl) as r: 
-        for line in r:
-            out.write(line.decode())
+    from . import tahuna
+    tahuna.tahunaDownloader(workers=1).get(linkFileName, outFileName)
     return
-    
 
+def downloadFromTahuna(linkFileNames, outDir=None, manifest=None, workers=4):
+    """
+    Download the tracks of many Tahuna link files (list or glob pattern) concurrently,
+    resuming interrupted downloads and skipping tracks downloaded before (listed in
+    manifest, default tahuna.json in outDir); see tahuna.tahunaDownloader.
+    Returns list of (linkFileName, outFileName, downloaded, error message or None).
+    """
+    from . import tahuna
+    if isinstance(linkFileNames, str):
+        linkFileNames=sorted(glob.glob(linkFileNames))
+    results=tahuna.tahunaDownloader(outDir, manifest, workers).download(linkFileNames)
+    nFailed=0
+    for fn, outFileName, downloaded, error in results:
+        if error is not None:
+            nFailed+=1
+            print("Failed: %s (%s)"%(fn, error))
+    print("Downloaded %i tracks, %i already there, %i failed"%(
+        sum(r[2] for r in results), sum(r[3] is None and not r[2] for r in results), nFailed))
+    return results
+
+
+# ### Batch mode: run an operation over many files in parallel
+
+gpxPatterns=('*.gpx', '*.gpx.gz', '*.gpx.bz2', '*.zip')
+
+def expandInputs(inputs):
+    """
+    List of GPX files from a directory (all GPX files in it, compressed or not),
+    a glob pattern, or a list of file names.  Zip archives (listed, in the
+    directory or matching the pattern) are replaced by the GPX files they
+    contain (archive.zip/member.gpx).
+    """
+    if not isinstance(inputs, str):
+        files=list(inputs)
+    elif os.path.isdir(inputs):
+        files=sorted(fn for pattern in gpxPatterns for fn in glob.glob(os.path.join(inputs, pattern)))
+    else:
+        files=sorted(glob.glob(inputs))
+    expanded=[]
+    for fn in files:
+        if os.path.isfile(fn) and zipfile.is_zipfile(fn):
+            expanded.extend(gpxStream.archiveMembers(fn))
+        else:
+            expanded.append(fn)
+    return expanded
+
+def openArchive(fileName=None):
+    """
+    archiveIndex.archiveIndex in SQLite file fileName (default: $GPXTOOLS_ARCHIVE_INDEX
+    or ~/.cache/GPXtools/archive.sqlite), reading GPX files through the track cache if enabled.
+    Query results are lists of files and can be passed to plotTracks, mergeTracks, ...
+    """
+    from .archiveIndex import archiveIndex
+    return archiveIndex(fileName, readGpx)
+
+# Set in each worker process by _initBatchWorker, so that large arguments
+# (privacy zones) are sent to every worker only once
+_batchArgs={}
+
+def _initBatchWorker(args):
+    _batchArgs.clear()
+    _batchArgs.update(args)
+
+def _batchWorker(fn):
+    """ Process one file; return (fileName, outFileName, error message or None) """
+    outFileName=outputName(fn, _batchArgs['suffix'], _batchArgs['outDir'])
+    existed=os.path.exists(outFileName)
+    try:
+        if _batchArgs['operation'] == 'privacy':
+            applyPrivacyZone(fn, _batchArgs['zone'], outFileName=outFileName)
+        else:
+            shiftTimes(fn, _batchArgs['nHours'], outFileName)
+    except Exception as e:
+        # don't leave partial output behind
+        if not existed and os.path.exists(outFileName):
+            os.remove(outFileName)
+        return fn, None, "%s: %s"%(e.__class__.__name__, e)
+    return fn, outFileName, None
+
+def batchProcess(inputs, operation, zone=None, nHours=None, outDir=None, workers=None, chunkSize=None):
+    """
+    Apply operation to all files in inputs (directory, glob pattern, or list of file names)
+    using a pool of 'workers' processes (default: number of CPUs; 1: no pool).
+    operation:
+      * 'privacy': applyPrivacyZone, zone is a privacyZone instance
+        (constructed, and geocoded, once by the caller)
+      * 'shift': shiftTimes by nHours hours
+    Output files are written to outDir (default: next to input files).
+    Files are handed to workers in chunks of chunkSize files (default: chosen
+    from number of files and workers).
+    Errors are reported per file without stopping the batch; files whose output
+    names coincide (e.g. track.gpx and track.gpx.gz) are not processed, but reported.
+    Returns list of (fileName, outFileName, error message or None).
+    """
+    files=expandInputs(inputs)
+    if operation == 'privacy':
+        if not isinstance(zone, privacyZone):
+            raise ValueError("gpxTools.batchProcess: operation 'privacy' needs a privacyZone instance")
+        suffix='_pz'
+    elif operation == 'shift':
+        if nHours is None:
+            raise ValueError("gpxTools.batchProcess: operation 'shift' needs nHours")
+        suffix='_timewarp'
+    else:
+        raise ValueError("gpxTools.batchProcess: unknown operation %s"%operation)
+    if outDir is not None:
+        os.makedirs(outDir, exist_ok=True)
+    # Files with the same output name (x.gpx and x.gpx.gz, or zip members a/x.gpx
+    # and b/x.gpx) would overwrite each other's output: none of them is processed
+    sameOutput={}
+    for fn in files:
+        sameOutput.setdefault(os.path.abspath(outputName(fn, suffix, outDir)), []).append(fn)
+    clashes={fn: (name, others) for name, others in sameOutput.items() if len(others) > 1 for fn in others}
+    todo=[fn for fn in files if fn not in clashes]
+    args={'operation': operation, 'zone': zone, 'nHours': nHours, 'outDir': outDir, 'suffix': suffix}
+    if workers is None:
+        workers=os.cpu_count() or 1
+    if workers <= 1 or len(todo) <= 1:
+        _initBatchWorker(args)
+        done=[_batchWorker(fn) for fn in todo]
+    else:
+        if chunkSize is None:
+            chunkSize=max(1, len(todo)//(4*workers))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initBatchWorker, initargs=(args,)) as executor:
+            done=list(executor.map(_batchWorker, todo, chunksize=chunkSize))
+    done={result[0]: result for result in done}
+    results=[]
+    for fn in files:
+        if fn in clashes:
+            name, others=clashes[fn]
+            results.append((fn, None, "ValueError: output file %s would also be written for %s"%(
+                name, ', '.join(other for other in others if other != fn))))
+        else:
+            results.append(done[fn])
+    nFailed=0
+    for fn, outFileName, error in results:
+        if error is not None:
+            nFailed+=1
+            print("Failed: %s (%s)"%(fn, error))
+    print("Processed %i files, %i failed"%(len(results), nFailed))
+    return results
+
+def parseZone(coordsAddress, radius):
+    """
+    Parse command-line privacy zone: 'lat,lon' or address, and radius
+    as number with optional unit (default: m), e.g. '100', '0.2mi'
+    """
+    m=re.match(r'^\s*([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)\s*([A-Za-z]*)\s*$', radius)
+    if m is None:
+        raise ValueError("gpxTools.parseZone: can't parse radius %s"%radius)
+    from gpxpy.geo import Location
+    r=unit(m.group(2) or 'm')(float(m.group(1)))
+    try:
+        lat, lon=[float(x) for x in coordsAddress.split(',')]
+        return Location(lat, lon), r
+    except ValueError:
+        return coordsAddress, r
+
+def zoneFromArgs(args):
+    """ privacyZone from command-line arguments --zone and --zonefile; None if there are none """
+    if not args.zone and not args.zonefile:
+        return None
+    coords, radii=zip(*[parseZone(c, r) for c, r in args.zone]) if args.zone else ((), ())
+    return privacyZone(list(coords), list(radii), args.zonefile)
+
+def runPipeline(args):
+    """ 'run' command: pipeline.pipeline from parsed command-line arguments """
+    from .pipeline import pipeline
+    workers=args.workers if args.workers is not None else 1
+    pipe=pipeline(args.inputs[0] if len(args.inputs) == 1 else args.inputs, workers=workers)
+    if args.fill is not None:
+        pipe.fill(args.fill, workers)
+    zone=zoneFromArgs(args)
+    if zone is not None:
+        pipe.privacy(zone)
+    if args.shift is not None:
+        pipe.shift(args.shift)
+    pipe.simplify(args.simplify)
+    if args.upload is None:
+        pipe.write(args.output, args.precision)
+        return 0
+    from .stravaAtHome import stravaAtHome
+    strava=stravaAtHome(args.upload, batchmode=True)
+    if args.output is None:
+        ok=pipe.upload(strava, args.type, args.name, args.commute, precision=args.precision)
+    else:
+        # upload the file just written
+        ok=strava.uploadFile(pipe.write(args.output, args.precision), args.type, args.name, args.commute)
+    return 0 if ok else 1
+
+def runWatch(args):
+    """ 'watch' command: watchFolder.folderWatcher from parsed command-line arguments """
+    import signal
+    from .watchFolder import folderWatcher
+    zone=zoneFromArgs(args)
+    strava=None
+    if args.upload is not None:
+        from .stravaAtHome import stravaAtHome
+        strava=stravaAtHome(args.upload, batchmode=True)
+    watcher=folderWatcher(args.folder, zone, strava, args.outdir, args.manifest, args.type,
+                          settle=args.settle, interval=args.interval, poll=args.poll)
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    try:
+        watcher.run(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def main(argv=None):
+    """ Command-line interface (gpxtools): batch processing (see batchProcess), pipelines, downloads and the archive index """
+    parser=argparse.ArgumentParser(description='Batch processing of GPX files')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--chunksize', type=int, default=None, help='number of files handed to a worker at a time')
+    parser.add_argument('--metrics', default=None, metavar='FILE',
+                        help="append timers (JSON lines) and a summary to FILE ('-': print summary); see metrics")
+    sub=parser.add_subparsers(dest='operation', required=True)
+    p=sub.add_parser('privacy', help='apply privacy zones')
+    p.add_argument('inputs', help='directory or (quoted) glob pattern')
+    p.add_argument('--zone', nargs=2, action='append', default=[], metavar=('LATLON_OR_ADDRESS', 'RADIUS'),
+                   help="zone center ('lat,lon' or address) and radius (e.g. 100, 100m, 0.2mi); repeat for several zones")
+    p.add_argument('--zonefile', action='append', default=[],
+                   help='polygonal zones (GeoJSON, shapefile, ... in lon/lat); repeat for several files')
+    p.add_argument('--outdir', default=None, help='output directory (default: next to input files)')
+    p=sub.add_parser('shift', help='shift times')
+    p.add_argument('inputs', help='directory or (quoted) glob pattern')
+    p.add_argument('hours', type=float, help='hours to add')
+    p.add_argument('--outdir', default=None, help='output directory (default: next to input files)')
+    p=sub.add_parser('merge', help='merge all files into one')
+    p.add_argument('inputs', help='directory or (quoted) glob pattern')
+    p.add_argument('output', help='output file')
+    p=sub.add_parser('index', help='add files to the archive index (only new or changed ones)')
+    p.add_argument('inputs', help='directory or (quoted) glob pattern')
+    p.add_argument('--db', default=None, help='index file (default: $GPXTOOLS_ARCHIVE_INDEX or ~/.cache/GPXtools/archive.sqlite)')
+    p=sub.add_parser('query', help='list indexed files by area and time')
+    p.add_argument('--bbox', nargs=4, type=float, default=None, metavar=('MINLON', 'MAXLON', 'MINLAT', 'MAXLAT'))
+    p.add_argument('--start', default=None, help='earliest time (ISO, e.g. 2019-03-21)')
+    p.add_argument('--end', default=None, help='latest time (ISO)')
+    p.add_argument('--db', default=None, help='index file')
+    p=sub.add_parser('run', help='chain steps in one pass: read / merge, fill, privacy, shift, simplify, then write or upload')
+    p.add_argument('inputs', nargs='+', help='GPX file(s); several files, a directory or a (quoted) glob pattern are merged')
+    p.add_argument('--fill', default=None, help='fill gaps from these files (directory or quoted glob pattern)')
+    p.add_argument('--zone', nargs=2, action='append', default=[], metavar=('LATLON_OR_ADDRESS', 'RADIUS'),
+                   help='privacy zone, as for privacy; repeat for several zones')
+    p.add_argument('--zonefile', action='append', default=[], help='polygonal privacy zones, as for privacy')
+    p.add_argument('--shift', type=float, default=None, help='hours to add')
+    p.add_argument('--simplify', type=float, default=None, help='simplification tolerance (m)')
+    p.add_argument('--precision', type=int, default=None, help='decimals of coordinates in output')
+    p.add_argument('-o', '--output', default=None, help='output file (.gz: compressed)')
+    p.add_argument('--upload', default=None, metavar='PARMFILE', help='upload to Strava (stravaAtHome parameter file)')
+    p.add_argument('--type', default=None, help='Strava activity type (e.g. ride)')
+    p.add_argument('--name', default=None, help='Strava activity name')
+    p.add_argument('--commute', action='store_true', default=None, help='mark Strava activity as commute')
+    p=sub.add_parser('tahuna', help='download tracks from Tahuna link files')
+    p.add_argument('inputs', nargs='+', help='link files (or quoted glob pattern)')
+    p.add_argument('--outdir', default=None, help='output directory (default: next to link files)')
+    p.add_argument('--manifest', default=None, help='manifest of finished downloads (default: tahuna.json in output directory)')
+    p=sub.add_parser('watch', help='privacy zones and Strava upload for new files in a folder, each once')
+    p.add_argument('folder', help='folder to watch (not its subfolders)')
+    p.add_argument('--zone', nargs=2, action='append', default=[], metavar=('LATLON_OR_ADDRESS', 'RADIUS'),
+                   help='privacy zone, as for privacy; repeat for several zones')
+    p.add_argument('--zonefile', action='append', default=[], help='polygonal privacy zones, as for privacy')
+    p.add_argument('--outdir', default=None, help='output directory (default: subfolder processed)')
+    p.add_argument('--upload', default=None, metavar='PARMFILE', help='upload to Strava (stravaAtHome parameter file)')
+    p.add_argument('--type', default=None, help='Strava activity type (e.g. ride)')
+    p.add_argument('--manifest', default=None, help='processing state (default: .gpxwatch.json in folder)')
+    p.add_argument('--settle', type=float, default=5., help='seconds a file must be unchanged before it is processed')
+    p.add_argument('--interval', type=float, default=10., help='seconds between folder listings when polling')
+    p.add_argument('--poll', action='store_true', help='poll even if inotify is available')
+    p.add_argument('--once', action='store_true', help='process the files there are now, then exit')
+    args=parser.parse_args(argv)
+    if args.operation == 'run' and args.output is None and args.upload is None:
+        parser.error("run needs --output and / or --upload")
+    if args.operation == 'privacy' and not args.zone and not args.zonefile:
+        parser.error("privacy needs --zone and / or --zonefile")
+    if args.operation == 'watch' and not args.zone and not args.zonefile and args.upload is None:
+        parser.error("watch needs --zone, --zonefile and / or --upload")
+    if args.metrics is None:
+        return runCommand(args)
+    metrics.enable(None if args.metrics == '-' else args.metrics)
+    try:
+        return runCommand(args)
+    finally:
+        if args.metrics == '-':
+            metrics.report()
+        metrics.disable()
 
+def runCommand(args):
+    """ Run the command-line operation in args (see main) """
+    if args.operation == 'merge':
+        workers=args.workers if args.workers is not None else (os.cpu_count() or 1)
+        gpxTools().mergeTracks(expandInputs(args.inputs), args.output, workers=workers)
+        return 0
+    if args.operation == 'index':
+        workers=args.workers if args.workers is not None else (os.cpu_count() or 1)
+        nIndexed, nUnchanged, errors=openArchive(args.db).ingest(expandInputs(args.inputs), workers)
+        for fn, error in errors:
+            print("%s: %s"%(fn, error))
+        print("Indexed %i files, %i unchanged, %i failed"%(nIndexed, nUnchanged, len(errors)))
+        return 1 if errors else 0
+    if args.operation == 'run':
+        return runPipeline(args)
+    if args.operation == 'watch':
+        return runWatch(args)
+    if args.operation == 'tahuna':
+        inputs=args.inputs[0] if len(args.inputs) == 1 else args.inputs
+        results=downloadFromTahuna(inputs, args.outdir, args.manifest, args.workers or 4)
+        return 1 if any(r[3] is not None for r in results) else 0
+    if args.operation == 'query':
+        for fn in openArchive(args.db).query(args.bbox, start=args.start, end=args.end):
+            print(fn)
+        return 0
+    zone=None
+    if args.operation == 'privacy':
+        # Geocode (and load zone files) once, here, rather than in every worker
+        zone=zoneFromArgs(args)
+    nHours=getattr(args, 'hours', None)
+    results=batchProcess(args.inputs, args.operation, zone=zone, nHours=nHours, outDir=args.outdir,
+                         workers=args.workers, chunkSize=args.chunksize)
+    return 1 if any(error is not None for fn, out, error in results) else 0
 
+if __name__ == '__main__':
+    # Run main() from the package module (not __main__), so that
+    # objects sent to worker processes refer to GPXtools.gpxTools
+    from GPXtools import gpxTools as _gpxTools
+    raise SystemExit(_gpxTools.main())
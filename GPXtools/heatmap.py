@@ -0,0 +1,134 @@
+### Headless heatmap of many tracks
+### Bin all track points into a 2D histogram in Web Mercator coordinates
+### and write it out as a PNG image; no figure or display needed.
+
+# Files are streamed twice: once to find the extent (skipped if given),
+# once to accumulate the histogram, so memory use doesn't depend on the
+# number of tracks.  With lineDensity, segments are densified (linear
+# interpolation) so that consecutive points are at most one pixel apart;
+# the image then shows how often tracks cross each pixel rather than
+# how many points were recorded there.
+
+import numpy as np
+import matplotlib.image
+from matplotlib import colormaps
+
+earthRadius = 6378137. # m, Web Mercator sphere
+maxLatitude = 85.05112878 # edge of Web Mercator map
+tileSize = 256 # pixels
+
+def webMercator(lat, lon):
+    """ Web Mercator (EPSG:3857) x, y in m from lat, lon (degrees) """
+    lat = np.clip(lat, -maxLatitude, maxLatitude)
+    x = earthRadius*np.radians(lon)
+    y = earthRadius*np.log(np.tan(np.pi/4+np.radians(lat)/2))
+    return x, y
+
+def autoZoom(extent, widthPixels=1024):
+    """
+    OSM zoom level at which extent [minLon, maxLon, minLat, maxLat]
+    fits into widthPixels pixels (horizontally and vertically), between 0 and 19
+    """
+    x0, y0 = webMercator(extent[2], extent[0])
+    x1, y1 = webMercator(extent[3], extent[1])
+    size = max(x1-x0, y1-y0, 1.)
+    zoom = int(np.floor(np.log2(widthPixels*2*np.pi*earthRadius/(tileSize*size))))
+    return min(max(zoom, 0), 19)
+
+def trackExtent(events, extent=None):
+    """ Update extent [minLon, maxLon, minLat, maxLat] with all points in event stream """
+    if extent is None:
+        extent = [np.inf, -np.inf, np.inf, -np.inf]
+    for kind, seg in events:
+        if kind != 'trkpts' or len(seg) == 0:
+            continue
+        extent = [min(extent[0], seg.lon.min()), max(extent[1], seg.lon.max()),
+                  min(extent[2], seg.lat.min()), max(extent[3], seg.lat.max())]
+    return extent
+
+def densify(x, y, step):
+    """ Insert points (linear interpolation) so that consecutive points are at most step apart """
+    if len(x) < 2:
+        return x, y
+    n = np.maximum(np.ceil(np.hypot(np.diff(x), np.diff(y))/step).astype(int), 1)
+    # point j of piece i: start of piece + j/n[i] of its length
+    start = np.repeat(np.arange(len(n)), n)
+    frac = np.arange(n.sum())-np.repeat(np.cumsum(n)-n, n)
+    frac = frac/np.repeat(n, n)
+    xs = np.concatenate((x[start]+frac*(x[start+1]-x[start]), x[-1:]))
+    ys = np.concatenate((y[start]+frac*(y[start+1]-y[start]), y[-1:]))
+    return xs, ys
+
+class heatmap:
+    """
+    Histogram of track points on a Web Mercator grid covering
+    extent [minLon, maxLon, minLat, maxLat], width pixels wide.
+    Add segments using add(), write PNG using save().
+    """
+    def __init__(self, extent, width=2048, lineDensity=True):
+        self.extent = extent
+        self.x0, self.y0 = webMercator(extent[2], extent[0])
+        self.x1, self.y1 = webMercator(extent[3], extent[1])
+        self.pixel = max(self.x1-self.x0, 1.)/width
+        self.width = width
+        self.height = max(int(np.ceil((self.y1-self.y0)/self.pixel)), 1)
+        self.lineDensity = lineDensity
+        self.counts = np.zeros((self.width, self.height))
+        self.nPoints = 0
+
+    def add(self, seg):
+        """ Add points of track.Segment seg """
+        x, y = webMercator(seg.lat, seg.lon)
+        if self.lineDensity:
+            x, y = densify(x, y, self.pixel)
+        # pixel indices, binned straight into the raster (cost grows with the points, not the raster);
+        # points on the far edge count in the last pixel, points outside the grid not at all
+        ix = np.floor((x-self.x0)/self.pixel)
+        iy = np.floor((y-self.y0)/self.pixel)
+        inside = (ix >= 0) & (ix <= self.width) & (iy >= 0) & (iy <= self.height)
+        inside &= (x <= self.x0+self.width*self.pixel) & (y <= self.y0+self.height*self.pixel)
+        ix = np.minimum(ix[inside].astype(np.intp), self.width-1)
+        iy = np.minimum(iy[inside].astype(np.intp), self.height-1)
+        np.add.at(self.counts, (ix, iy), 1)
+        self.nPoints += len(seg)
+
+    def addEvents(self, events):
+        """ Add all points in event stream (see gpxStream.iterEvents) """
+        for kind, seg in events:
+            if kind == 'trkpts':
+                self.add(seg)
+
+    def image(self, cmap='inferno'):
+        """ RGBA image (rows from north to south), log-scaled; empty pixels are transparent """
+        counts = self.counts.T[::-1]
+        scaled = np.log1p(counts)/max(np.log1p(counts.max()), 1e-12)
+        rgba = colormaps[cmap](scaled)
+        rgba[counts == 0, 3] = 0
+        return rgba
+
+    def save(self, fileName, cmap='inferno'):
+        """ Write image as PNG """
+        matplotlib.image.imsave(fileName, self.image(cmap), format='png')
+
+def renderHeatmap(files, outFileName, readEvents, width=2048, extent=None, padding=0.05, lineDensity=True, cmap='inferno'):
+    """
+    Heatmap of all tracks in files, written to PNG file outFileName.
+    readEvents(fileName): event stream of a file (e.g. gpxTools.readEvents)
+    extent: [minLon, maxLon, minLat, maxLat]; determined from the tracks
+    (with padding, fraction of width / height on each side) if None.
+    Returns heatmap instance.
+    """
+    if extent is None:
+        extent = None
+        for fn in files:
+            extent = trackExtent(readEvents(fn), extent)
+        if extent is None or not np.isfinite(extent).all():
+            raise ValueError("heatmap.renderHeatmap: no track points found in input files!")
+        lonShift = padding*(extent[1]-extent[0])
+        latShift = padding*(extent[3]-extent[2])
+        extent = [extent[0]-lonShift, extent[1]+lonShift, extent[2]-latShift, extent[3]+latShift]
+    hm = heatmap(extent, width, lineDensity)
+    for fn in files:
+        hm.addEvents(readEvents(fn))
+    hm.save(outFileName, cmap)
+    return hm
@@ -0,0 +1,136 @@
+### Timers and counters
+### Where does the time go: parsing, transforming, writing, geocoding,
+### uploading, waiting for Strava?  Off unless enabled.
+
+# Code is instrumented with
+#   with metrics.timer('parse'): ...     (or metrics.timed('parse', iterator))
+#   metrics.count('points.in', len(seg))
+# While disabled (the default), timer() returns one shared no-op context
+# manager, timed() returns the iterator itself and count() returns at once,
+# so instrumentation costs a function call per chunk of points, not per point.
+# Enabled (enable(), or environment variable GPXTOOLS_METRICS=file), timers
+# and counters are summed per name (stats(), report()); with an output file,
+# every timer also writes a JSON line {"time", "name", "seconds"}, and a
+# summary line {"time", "stats"} is written by disable() (at exit for
+# GPXTOOLS_METRICS).
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+
+enabled = False
+_lock = threading.Lock()
+_timers = {}   # name -> [count, total seconds, max seconds]
+_counters = {} # name -> total
+_out = None
+_ownOut = False
+_null = contextlib.nullcontext()
+
+def enable(out=None):
+    """ Start collecting; out: None (stats only), file name (JSON lines appended) or text file object """
+    global enabled, _out, _ownOut
+    disable()
+    if isinstance(out, str):
+        _out, _ownOut = open(out, 'a', buffering=1), True
+    else:
+        _out, _ownOut = out, False
+    enabled = True
+
+def disable():
+    """ Stop collecting; write summary line to the output (if any) and close it if opened by enable() """
+    global enabled, _out, _ownOut
+    if enabled and _out is not None:
+        _write({'time': time.time(), 'stats': stats()})
+        if _ownOut:
+            _out.close()
+    enabled = False
+    _out, _ownOut = None, False
+
+def reset():
+    """ Forget all timers and counters """
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+def _write(record):
+    with _lock:
+        _out.write(json.dumps(record)+'\n')
+
+def add(name, seconds):
+    """ Add a measured time (s) to timer name """
+    if not enabled:
+        return
+    with _lock:
+        t = _timers.get(name)
+        if t is None:
+            _timers[name] = [1, seconds, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+            t[2] = max(t[2], seconds)
+    if _out is not None:
+        _write({'time': time.time(), 'name': name, 'seconds': seconds})
+
+def count(name, n=1):
+    """ Add n to counter name """
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0)+n
+
+class _timer:
+    __slots__ = ('name', 'start')
+    def __init__(self, name):
+        self.name = name
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        add(self.name, time.perf_counter()-self.start)
+        return False
+
+def timer(name):
+    """ Context manager timing its block as name """
+    return _timer(name) if enabled else _null
+
+def timed(name, iterable):
+    """ Iterator over iterable, timing (as name) the time spent producing its items """
+    if not enabled:
+        return iterable
+    return _timedIter(name, iter(iterable))
+
+def _timedIter(name, it):
+    total = 0.
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                break
+            finally:
+                total += time.perf_counter()-start
+            yield item
+    finally:
+        add(name, total)
+
+def stats():
+    """ {'timers': {name: {'count', 'seconds', 'max'}}, 'counters': {name: total}} """
+    with _lock:
+        return {'timers': {name: {'count': c, 'seconds': s, 'max': m} for name, (c, s, m) in sorted(_timers.items())},
+                'counters': dict(sorted(_counters.items()))}
+
+def report():
+    """ Print timers and counters """
+    s = stats()
+    for name, t in s['timers'].items():
+        print('%-24s %9.3f s  (%i, max %.3f s)'%(name, t['seconds'], t['count'], t['max']))
+    for name, n in s['counters'].items():
+        print('%-24s %12s'%(name, n))
+
+if os.environ.get('GPXTOOLS_METRICS'):
+    enable(os.environ['GPXTOOLS_METRICS'])
+    atexit.register(disable)
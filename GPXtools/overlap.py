@@ -0,0 +1,149 @@
+### Resolving time overlaps between recordings
+### Two devices recording the same ride give tracks that overlap in time;
+### merge them into one instead of giving up.
+
+# Segments are grouped by a sort-and-sweep over their time intervals: sorted
+# by start time, a segment belongs to the current group if it starts before
+# the latest end time seen so far in the group.  Groups of one are kept as
+# they are; overlapping segments are merged according to a policy:
+#   * 'density': recordings with more points per second come first
+#   * 'prefer': recordings from preferred devices (patterns matched against
+#     file name and GPX creator) come first, then by density
+#   * 'interleave': all points of all recordings, in time order
+# With 'density' and 'prefer', a recording only contributes points outside
+# the time spans covered by the recordings before it.  Exact duplicates
+# (same time, latitude and longitude) are dropped.
+
+import numpy as np
+
+from .track import Segment, Track
+
+policies = ('density', 'prefer', 'interleave')
+
+def sweep(starts, ends):
+    """
+    Group intervals [starts, ends] (arrays) that overlap (directly or through
+    other intervals).  Returns group number of each interval; groups are
+    numbered in order of their start.  Intervals with NaT are groups of their own, last.
+    """
+    starts, ends = np.asarray(starts), np.asarray(ends)
+    if len(starts) == 0:
+        return np.zeros(0, dtype=int)
+    order = np.argsort(starts, kind='stable')
+    s, e = starts[order], ends[order]
+    undefined = np.isnat(s) | np.isnat(e) if np.issubdtype(s.dtype, np.datetime64) else np.zeros(len(s), dtype=bool)
+    order = np.concatenate((order[~undefined], order[undefined]))
+    s, e = starts[order], ends[order]
+    nValid = len(s)-undefined.sum()
+    maxEnd = np.maximum.accumulate(e[:nValid])
+    newGroup = np.ones(len(s), dtype=bool)
+    newGroup[1:nValid] = s[1:nValid] > maxEnd[:-1]
+    groups = np.empty(len(starts), dtype=int)
+    groups[order] = np.cumsum(newGroup)-1
+    return groups
+
+def dedupMask(seg):
+    """ Boolean mask keeping the first of each set of points with identical time, latitude and longitude """
+    n = len(seg)
+    if n < 2:
+        return np.ones(n, dtype=bool)
+    keys = (seg.lon.view(np.int64), seg.lat.view(np.int64), seg.time.view(np.int64))
+    order = np.lexsort(keys)
+    same = np.ones(n-1, dtype=bool)
+    for k in keys:
+        sk = k[order]
+        same &= sk[1:] == sk[:-1]
+    keep = np.ones(n, dtype=bool)
+    keep[order[1:][same]] = False
+    return keep
+
+def density(seg):
+    """ Points per second (of time covered) of Segment seg """
+    first, last = seg.timeRange()
+    span = (last-first)/np.timedelta64(1, 's') if not np.isnat(first) else 0.
+    return len(seg)/max(span, 1.)
+
+def deviceRank(fileName, creator, prefer):
+    """ Index of first pattern in prefer found in fileName or creator; len(prefer) if none """
+    for i, pattern in enumerate(prefer or []):
+        if pattern.lower() in fileName.lower() or pattern.lower() in (creator or '').lower():
+            return i
+    return len(prefer or [])
+
+def mergeSegments(segments, ranks=None):
+    """
+    One Segment from overlapping segments.  ranks: None: interleave all points;
+    otherwise lower rank comes first, and segments only add points outside
+    the time spans of the segments ranked before them.
+    """
+    if ranks is None:
+        pieces = segments
+    else:
+        pieces, covered = [], []
+        for i in sorted(range(len(segments)), key=lambda i: ranks[i]):
+            seg = segments[i]
+            timed = ~np.isnat(seg.time)
+            keep = timed.copy()
+            for a, b in covered:
+                keep &= (seg.time < a) | (seg.time > b)
+            if keep.any():
+                pieces.append(seg[keep])
+            first, last = seg.timeRange()
+            if not np.isnat(first):
+                covered.append((first, last))
+    seg = Segment.concatenate(pieces)
+    seg = seg[np.argsort(seg.time, kind='stable')]
+    return seg[dedupMask(seg)]
+
+def resolveOverlaps(docs, fileNames, policy='density', prefer=None):
+    """
+    Tracks from GPX documents docs (read from fileNames) with overlapping
+    segments merged according to policy (see above), in time order.
+    Merged segments count as part of the track of the earliest segment of their group;
+    consecutive segments from the same source track share a <trk> (with its info),
+    a new one is started whenever the source changes.  Segments without time
+    stamps are kept as they are, at the end.
+    Returns (list of Tracks, number of groups of overlapping segments).
+    """
+    if policy not in policies:
+        raise ValueError("overlap.resolveOverlaps: unknown policy %s (use one of %s)"%(policy, ', '.join(policies)))
+    entries, untimed = [], []
+    for iDoc, doc in enumerate(docs):
+        for iTrack, track in enumerate(doc.tracks):
+            for seg in track.segments:
+                first, last = seg.timeRange()
+                if np.isnat(first):
+                    untimed.append(((iDoc, iTrack), seg))
+                else:
+                    entries.append((first, last, (iDoc, iTrack), seg))
+    groups = sweep(np.array([e[0] for e in entries], dtype='datetime64[us]'),
+                   np.array([e[1] for e in entries], dtype='datetime64[us]'))
+    kept = []
+    nOverlaps = 0
+    order = np.argsort(groups, kind='stable')
+    bounds = np.searchsorted(groups[order], np.arange(groups.max()+2 if len(groups) else 1))
+    for g in range(len(bounds)-1):
+        members = [entries[i] for i in order[bounds[g]:bounds[g+1]]]
+        members.sort(key=lambda e: e[0])
+        key = members[0][2]
+        if len(members) == 1:
+            seg = members[0][3]
+        else:
+            nOverlaps += 1
+            segments = [e[3] for e in members]
+            if policy == 'interleave':
+                ranks = None
+            elif policy == 'density':
+                ranks = [-density(s) for s in segments]
+            else:
+                ranks = [(deviceRank(fileNames[e[2][0]], docs[e[2][0]].attrib.get('creator'), prefer), -density(e[3])) for e in members]
+            seg = mergeSegments(segments, ranks)
+        kept.append((members[0][0], key, seg))
+    kept.sort(key=lambda k: k[0])
+    tracks, lastKey = [], None
+    for key, seg in [k[1:] for k in kept]+untimed:
+        if key != lastKey:
+            tracks.append(Track(info=docs[key[0]].tracks[key[1]].info))
+            lastKey = key
+        tracks[-1].segments.append(seg)
+    return tracks, nOverlaps
@@ -0,0 +1,170 @@
+### Processing pipelines
+### Merge, privacy zones, time shifts, gap filling and simplification as
+### stages over one stream of track points, written (or uploaded) once.
+
+# A pipeline reads its source once, as an event stream (see
+# gpxStream.iterEvents), and passes every chunk of track points through its
+# stages in order before it is written: no intermediate files (_pz.gpx,
+# _timewarp.gpx, ...) are written and parsed again.  The output can go to a
+# file, to an in-memory buffer, or straight to Strava (see
+# stravaAtHome.uploadFile).  Stages are plain callables on track.Segment
+# chunks; stages that need to know where segments start (gap filling) also
+# get a startSegment callback.
+
+import glob
+import gzip
+import io
+import os
+from datetime import timedelta
+
+from . import gpxStream
+from . import gpxTools
+from . import metrics
+from .track import GPX
+
+class pipeline:
+    """
+    Chain of stages over the track points of source:
+      * file name: one GPX file (possibly compressed / in a zip archive)
+      * list of file names, directory or glob pattern: all tracks in them,
+        merged in time order (see gpxTools.gpxTools.mergedEvents; overlap, prefer)
+      * track.GPX document, or event stream (see gpxStream.iterEvents)
+    Stages are added by the methods below (each returns the pipeline, so calls
+    can be chained) and run when the result is written (write, buffer, upload,
+    or iterating over events()).  A pipeline can only be run once.
+    """
+    def __init__(self, source, chunkSize=10000, workers=1, overlap='density', prefer=None):
+        if isinstance(source, GPX):
+            source = source.events()
+        elif isinstance(source, str) and not (os.path.isdir(source) or glob.has_magic(source)):
+            source = gpxTools.readEvents(source, chunkSize)
+        elif isinstance(source, (str, list, tuple)):
+            source = gpxTools.gpxTools().mergedEvents(source, chunkSize, workers, overlap, prefer)
+        self.source = source
+        self.stages = []
+        return
+
+    def apply(self, func, startSegment=None, report=None, name=None):
+        """
+        Add stage func: Segment chunk -> Segment; startSegment() is called at the
+        start of each segment, report() after the output is written.
+        name: for timers and counters (see metrics; default: name of func)
+        """
+        if name is None:
+            name = getattr(func, '__name__', func.__class__.__name__)
+        self.stages.append((func, startSegment, report, name))
+        return self
+
+    def privacy(self, zone, radii=None):
+        """ Drop points in privacy zone (gpxTools.privacyZone, or addresses / coordinates and radii) """
+        if not isinstance(zone, gpxTools.privacyZone):
+            zone = gpxTools.privacyZone(zone, radii)
+        def dropPoints(seg):
+            keep = ~zone.pointsTooClose(seg.lat, seg.lon)
+            metrics.count('privacy.dropped', len(seg)-keep.sum())
+            return seg[keep]
+        return self.apply(dropPoints, name='privacy')
+
+    def shift(self, nHours):
+        """ Add nHours hours to all times """
+        timeShift = timedelta(hours=nHours)
+        def shiftChunk(seg):
+            seg.shiftTimes(timeShift)
+            return seg
+        return self.apply(shiftChunk, name='shift')
+
+    def simplify(self, simplify):
+        """ Simplify: tolerance (m) or simplify.segmentSimplifier, see gpxTools.simplifier; None: no stage """
+        simp = gpxTools.simplifier(simplify)
+        if simp is None:
+            return self
+        return self.apply(simp, simp.startSegment, simp.report, name='simplify')
+
+    def fill(self, fillers, workers=1):
+        """ Fill gaps from fillers (files or gapFill.gapFiller, see gpxTools.gapFiller); None / []: no stage """
+        filler = gpxTools.gapFiller(fillers, workers)
+        if filler is None:
+            return self
+        return self.apply(filler, filler.startSegment, filler.report, name='fill')
+
+    def events(self):
+        """
+        Event stream of the source, with all stages applied; chunks left empty are dropped.
+        Times each stage as 'transform.<name>' and counts points in and out (see metrics).
+        """
+        for kind, item in self.source:
+            if kind == 'trkseg':
+                for func, startSegment, report, name in self.stages:
+                    if startSegment is not None:
+                        startSegment()
+            elif kind == 'trkpts':
+                metrics.count('points.in', len(item))
+                for func, startSegment, report, name in self.stages:
+                    if metrics.enabled:
+                        with metrics.timer('transform.'+name):
+                            item = func(item)
+                    else:
+                        item = func(item)
+                    if len(item) == 0:
+                        break
+                if len(item) == 0:
+                    continue
+                metrics.count('points.out', len(item))
+            yield kind, item
+
+    def report(self):
+        for func, startSegment, report, name in self.stages:
+            if report is not None:
+                report()
+
+    def write(self, out, precision=None, summary=True):
+        """
+        Run the pipeline, writing GPX to out: file name (gzip-compressed if it ends
+        in .gz) or text file object.  Files are written to out.tmp first and renamed
+        when complete, so that a failed run leaves no partial output behind.
+        precision, summary (refresh bounds and summary in the metadata): see gpxStream.gpxWriter
+        """
+        if isinstance(out, str):
+            tmpName = out+'.tmp'
+            try:
+                with gpxStream.openOutput(tmpName, compress=out.endswith('.gz')) as f:
+                    gpxStream.gpxWriter(f, precision, summary).writeAll(self.events())
+                os.replace(tmpName, out)
+            except BaseException:
+                if os.path.exists(tmpName):
+                    os.remove(tmpName)
+                raise
+            if metrics.enabled:
+                metrics.count('bytes.written', os.path.getsize(out))
+        else:
+            gpxStream.gpxWriter(out, precision, summary).writeAll(self.events())
+        self.report()
+        return out
+
+    def buffer(self, precision=None, compress=True):
+        """
+        Run the pipeline, writing GPX into memory: io.BytesIO (gzip-compressed
+        unless compress is False), positioned at its start, with attribute
+        name ('track.gpx.gz' / 'track.gpx') for the file format.
+        The GPX is compressed once complete, so that bounds and summary can be filled in.
+        """
+        buf = io.BytesIO()
+        out = io.TextIOWrapper(buf, encoding='utf-8')
+        self.write(out, precision)
+        out.flush()
+        out.detach()
+        buf.name = 'track.gpx'
+        if compress:
+            buf = io.BytesIO(gzip.compress(buf.getbuffer(), compresslevel=6))
+            buf.seek(0, os.SEEK_END)
+            buf.name = 'track.gpx.gz'
+        metrics.count('bytes.written', buf.tell())
+        buf.seek(0)
+        return buf
+
+    def upload(self, strava, activityType=None, activityName=None, commute=None, private=None, precision=None):
+        """
+        Run the pipeline and upload the result to Strava, from memory (gzip-compressed GPX);
+        strava: stravaAtHome instance with access.  Returns True if successful, see stravaAtHome.uploadFile.
+        """
+        return strava.uploadFile(self.buffer(precision), activityType, activityName, commute, private, fileFormat='gpx.gz')
@@ -0,0 +1,149 @@
+### Track simplification
+### Remove points that hardly change the shape of a track
+### (think: 1 Hz points along a straight road).
+
+# Two algorithms, both working on segment arrays (see track.Segment), with
+# coordinates projected onto a local plane (meters):
+# * Ramer-Douglas-Peucker ('rdp'): keep the point farthest from the line
+#   between two kept points if it's more than tolerance away, recursively.
+# * Visvalingam-Whyatt ('vw'): repeatedly drop the points spanning the
+#   smallest triangles with their neighbors, as long as the triangle area is
+#   below tolerance**2 (m**2: e.g. a point tolerance off the line between
+#   neighbors 2*tolerance apart).  All non-adjacent local minima are dropped
+#   at once; in a run of equal areas (stops, straight stretches) every other
+#   point is, so such runs shrink by half in every pass.
+
+import numpy as np
+from units import unit
+from .stats import ONE_DEGREE
+
+def localXY(lat, lon):
+    """ Equirectangular projection (meters) around mean latitude """
+    coef = np.cos(np.radians(np.mean(lat)))
+    return (lon-lon[0])*coef*ONE_DEGREE, (lat-lat[0])*ONE_DEGREE
+
+def rdpMask(x, y, tolerance):
+    """ Boolean mask of points kept by Ramer-Douglas-Peucker with tolerance (same units as x, y) """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, n-1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i+1:
+            continue
+        dx, dy = x[j]-x[i], y[j]-y[i]
+        px, py = x[i+1:j]-x[i], y[i+1:j]-y[i]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            d = np.hypot(px, py)
+        else:
+            d = np.abs(px*dy-py*dx)/length
+        k = np.argmax(d)
+        if d[k] > tolerance:
+            m = i+1+k
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+    return keep
+
+def visvalingamMask(x, y, tolerance):
+    """
+    Boolean mask of points kept by Visvalingam-Whyatt with area threshold tolerance**2
+    (tolerance in the units of x, y: the area of the triangle of a point tolerance away
+    from the line between its neighbors, which are 2*tolerance apart)
+    """
+    n = len(x)
+    idx = np.arange(n)
+    threshold = tolerance**2
+    while len(idx) > 2:
+        x0, x1, x2 = x[idx[:-2]], x[idx[1:-1]], x[idx[2:]]
+        y0, y1, y2 = y[idx[:-2]], y[idx[1:-1]], y[idx[2:]]
+        area = 0.5*np.abs((x1-x0)*(y2-y0)-(x2-x0)*(y1-y0))
+        small = area < threshold
+        if not small.any():
+            break
+        # non-adjacent local minima can be dropped together; runs of equal
+        # minima: every other point, starting from the first of the run
+        left = np.concatenate(([np.inf], area[:-1]))
+        right = np.concatenate((area[1:], [np.inf]))
+        minimum = small & (area <= left) & (area <= right)
+        pos = np.arange(len(area))
+        runStart = np.maximum.accumulate(np.where(minimum & ~np.concatenate(([False], minimum[:-1])), pos, 0))
+        drop = minimum & ((pos-runStart) % 2 == 0)
+        idx = np.concatenate((idx[:1], idx[1:-1][~drop], idx[-1:]))
+    keep = np.zeros(n, dtype=bool)
+    keep[idx] = True
+    return keep
+
+methods = {'rdp': rdpMask, 'vw': visvalingamMask}
+
+def monotonicMask(time, previous=None):
+    """
+    Boolean mask dropping points whose time stamp isn't later than that of all earlier
+    points (NaT is kept); previous: latest time stamp before time[0] (e.g. in the
+    previous chunk of the segment), None / NaT if there is none
+    """
+    t = time.astype('int64')
+    valid = ~np.isnat(time)
+    if not valid.any():
+        return np.ones(len(time), dtype=bool)
+    latest = np.maximum.accumulate(np.where(valid, t, np.iinfo('int64').min))
+    before = np.empty_like(latest)
+    before[0] = np.iinfo('int64').min if previous is None or np.isnat(previous) else \
+        np.datetime64(previous, 'us').astype('int64')
+    before[1:] = np.maximum(latest[:-1], before[0])
+    return ~valid | (t > before)
+
+def simplifySegment(seg, tolerance, method='rdp', monotonicTimes=False, previousTime=None):
+    """
+    Simplified copy of track.Segment seg.
+    tolerance: meters (number or units quantity); for 'vw', triangles smaller than
+      tolerance**2 square meters are dropped (see visvalingamMask)
+    method: 'rdp' (Ramer-Douglas-Peucker) or 'vw' (Visvalingam-Whyatt)
+    monotonicTimes: also drop points whose time stamp isn't later than
+      those of the points before them (and previousTime, see monotonicMask)
+    """
+    if method not in methods:
+        raise ValueError("simplify.simplifySegment: unknown method %s (use one of %s)"%(method, ', '.join(methods)))
+    tolerance = unit('m')(tolerance).num
+    if len(seg) < 3:
+        keep = np.ones(len(seg), dtype=bool)
+    else:
+        keep = methods[method](*localXY(seg.lat, seg.lon), tolerance)
+    if monotonicTimes:
+        keep &= monotonicMask(seg.time, previousTime)
+    return seg[keep]
+
+class segmentSimplifier:
+    """
+    Callable simplifying segments (see simplifySegment) and counting points
+    before (nIn) and after (nOut).  When used on a stream of segment chunks,
+    chunk boundaries are always kept; startSegment() must be called at the
+    start of every segment, as time stamps are compared across chunks.
+    """
+    def __init__(self, tolerance, method='rdp', monotonicTimes=False):
+        self.tolerance = tolerance
+        self.method = method
+        self.monotonicTimes = monotonicTimes
+        self.nIn = self.nOut = 0
+        self.startSegment()
+
+    def startSegment(self):
+        # latest time stamp in the current segment so far
+        self.lastTime = None
+
+    def __call__(self, seg):
+        out = simplifySegment(seg, self.tolerance, self.method, self.monotonicTimes, self.lastTime)
+        if self.monotonicTimes:
+            times = seg.time[~np.isnat(seg.time)]
+            if len(times) and (self.lastTime is None or times.max() > self.lastTime):
+                self.lastTime = times.max()
+        self.nIn += len(seg)
+        self.nOut += len(out)
+        return out
+
+    def report(self):
+        print("Simplification removed %i of %i points"%(self.nIn-self.nOut, self.nIn))
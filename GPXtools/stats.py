@@ -0,0 +1,146 @@
+### Track statistics
+### Distance, moving time, speeds, elevation gain and bounds of tracks,
+### computed from the segment arrays (see track.Segment) a chunk at a time.
+
+# Distances between consecutive points use the haversine formula; speeds
+# come from time deltas, and time between points counts as moving time if
+# the speed is above movingSpeed.  Elevation gain / loss use hysteresis:
+# a change is only counted once elevation has moved more than eleThreshold
+# away from the last counted elevation, so that GPS noise doesn't add up.
+# Segment chunks (as streamed by gpxStream.iterEvents) can be added one at a
+# time: the last point of a chunk is carried over to the next one.
+
+import math
+
+import numpy as np
+
+# Same values as gpxpy.geo (importing gpxpy for two constants is slow)
+EARTH_RADIUS = 6378.137 * 1000 # m
+ONE_DEGREE = 2*math.pi*EARTH_RADIUS / 360 # m
+
+def haversine(lat1, lon1, lat2, lon2):
+    """ Great-circle distance (m) between points (arrays, degrees) """
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2-lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2-lon1)/2)**2
+    return 2*EARTH_RADIUS*np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def firstOutside(x, start, ref, threshold, window=64):
+    """ Index of first x[i] (i >= start) more than threshold away from ref, None if there is none """
+    n = len(x)
+    while start < n:
+        stop = min(n, start+window)
+        outside = np.flatnonzero(np.abs(x[start:stop]-ref) > threshold)
+        if len(outside):
+            return start+outside[0]
+        start = stop
+        window *= 2
+    return None
+
+class trackStats:
+    """
+    Statistics of track points, accumulated over segments (startSegment)
+    and chunks of segments (add).
+      * eleThreshold: hysteresis for elevation gain / loss (m)
+      * movingSpeed: slowest speed counted as moving (m/s; default 1 km/h, like gpxpy)
+    """
+    def __init__(self, eleThreshold=5., movingSpeed=1/3.6):
+        self.eleThreshold = eleThreshold
+        self.movingSpeed = movingSpeed
+        self.nPoints = 0
+        self.distance = self.movingDistance = 0.
+        self.movingTime = 0.
+        self.maxSpeed = 0.
+        self.uphill = self.downhill = 0.
+        self.minLat = self.minLon = np.inf
+        self.maxLat = self.maxLon = -np.inf
+        self.start = self.end = np.datetime64('NaT', 'us')
+        self.startSegment()
+
+    def startSegment(self):
+        """ Following points are a new segment (no distance or elevation change from the previous point) """
+        self.last = None
+        self.eleRef = None
+
+    def add(self, seg):
+        """ Add track.Segment seg (or the next chunk of the current segment) """
+        if len(seg) == 0:
+            return
+        self.nPoints += len(seg)
+        self.minLat = min(self.minLat, seg.lat.min())
+        self.maxLat = max(self.maxLat, seg.lat.max())
+        self.minLon = min(self.minLon, seg.lon.min())
+        self.maxLon = max(self.maxLon, seg.lon.max())
+        first, last = seg.timeRange()
+        if not np.isnat(first):
+            if np.isnat(self.start):
+                self.start = first
+            self.end = last
+        lat, lon, time = seg.lat, seg.lon, seg.time
+        if self.last is not None:
+            lat = np.concatenate(([self.last[0]], lat))
+            lon = np.concatenate(([self.last[1]], lon))
+            time = np.concatenate(([self.last[2]], time))
+        self.last = (seg.lat[-1], seg.lon[-1], seg.time[-1])
+        d = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        self.distance += d.sum()
+        dt = np.diff(time)
+        timed = ~np.isnat(dt)
+        dt = dt[timed].astype('timedelta64[us]').astype(float)/1e6
+        d = d[timed]
+        d, dt = d[dt > 0], dt[dt > 0]
+        if len(dt):
+            speed = d/dt
+            moving = speed > self.movingSpeed
+            self.movingTime += dt[moving].sum()
+            self.movingDistance += d[moving].sum()
+            self.maxSpeed = max(self.maxSpeed, speed.max())
+        self._elevation(seg.ele[~np.isnan(seg.ele)])
+
+    def _elevation(self, ele):
+        if len(ele) == 0:
+            return
+        if self.eleRef is None:
+            self.eleRef = ele[0]
+        i = 0
+        while True:
+            i = firstOutside(ele, i, self.eleRef, self.eleThreshold)
+            if i is None:
+                break
+            if ele[i] > self.eleRef:
+                self.uphill += ele[i]-self.eleRef
+            else:
+                self.downhill += self.eleRef-ele[i]
+            self.eleRef = ele[i]
+            i += 1
+
+    def addEvents(self, events):
+        """ Add all points in event stream (see gpxStream.iterEvents); returns self """
+        for kind, item in events:
+            if kind == 'trkseg':
+                self.startSegment()
+            elif kind == 'trkpts':
+                self.add(item)
+        return self
+
+    def totalTime(self):
+        """ Time (s) from first to last time stamp, 0 if there are none """
+        if np.isnat(self.start):
+            return 0.
+        return (self.end-self.start)/np.timedelta64(1, 's')
+
+    def bounds(self):
+        """ (minLat, minLon, maxLat, maxLon), None if there are no points """
+        if self.nPoints == 0:
+            return None
+        return self.minLat, self.minLon, self.maxLat, self.maxLon
+
+    def summary(self):
+        """ Dictionary of all statistics (m, s, m/s) """
+        bounds = self.bounds()
+        return {'points': self.nPoints, 'distance': float(self.distance),
+                'movingDistance': float(self.movingDistance), 'movingTime': float(self.movingTime),
+                'totalTime': float(self.totalTime()),
+                'movingSpeed': float(self.movingDistance/self.movingTime) if self.movingTime > 0 else 0.,
+                'maxSpeed': float(self.maxSpeed), 'uphill': float(self.uphill), 'downhill': float(self.downhill),
+                'start': self.start, 'end': self.end,
+                'bounds': None if bounds is None else tuple(float(x) for x in bounds)}
@@ -20,9 +20,109 @@ from http.server import BaseHTTPRequestHandler, HTTPServer
 import urllib.parse as urlparse
 import os
 import time
+import calendar
 import yaml
-#import datetime # for downloads from Strava
-#from lxml import etree # for extensions (sensors etc.)
+import json
+from datetime import datetime, timezone
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .track import Segment, Track, GPX
+from . import gpxStream
+from . import metrics
+
+class stravaRateLimiter:
+    """
+    Token-bucket scheduler for Strava's rate limits: one bucket per limit
+    window (15 minutes, aligned to the quarter hour; one day, UTC).
+    Buckets are filled from the X-RateLimit-Limit / X-RateLimit-Usage headers
+    of every response (stravalib calls instances of this class with the
+    response headers, pass it as rate_limiter to stravalib.Client) and
+    refilled completely when their window ends.
+    Call acquire() before each request; it blocks while any bucket is empty.
+    Thread-safe.  Unlimited until the first response headers are seen.
+    """
+    windows = ( 15*60, 24*3600 )
+    def __init__( self ) :
+        self.lock = Lock()
+        self.limits = None  # per window
+        self.tokens = None  # per window
+        self.windowEnds = [ self.windowEnd( w ) for w in self.windows ]
+        return
+
+    @staticmethod
+    def windowEnd( window, now=None ) :
+        """ End of current rate-limit window (seconds since epoch) """
+        if now is None :
+            now = time.time()
+        return ( now//window + 1 )*window
+
+    def __call__( self, headers, method=None ) :
+        """ Update buckets from response headers (dict-like) """
+        limit = headers.get( 'X-RateLimit-Limit' )
+        usage = headers.get( 'X-RateLimit-Usage' )
+        if limit is None or usage is None :
+            return
+        try :
+            limits = [ int(x) for x in limit.split(',') ]
+            usages = [ int(x) for x in usage.split(',') ]
+        except ValueError :
+            return
+        with self.lock :
+            self._refill()
+            self.limits = limits
+            self.tokens = [ max( l-u, 0 ) for l, u in zip( limits, usages ) ]
+        return
+
+    def _refill( self ) :
+        now = time.time()
+        for i, w in enumerate( self.windows ) :
+            if now >= self.windowEnds[i] :
+                self.windowEnds[i] = self.windowEnd( w, now )
+                if self.tokens is not None :
+                    self.tokens[i] = self.limits[i]
+        return
+
+    def acquire( self ) :
+        """ Take one token from each bucket, waiting for empty buckets to refill """
+        while True :
+            with self.lock :
+                self._refill()
+                if self.tokens is None :
+                    return
+                empty = [ i for i, t in enumerate( self.tokens ) if t <= 0 ]
+                if not empty :
+                    self.tokens = [ t-1 for t in self.tokens ]
+                    return
+                wait = max( self.windowEnds[i] for i in empty ) - time.time()
+            print( "Strava rate limit reached, waiting %i s"%wait )
+            time.sleep( max( wait, 0 ) + 1 )
+
+
+def activityToGpx( activity, streams ) :
+    """
+    track.GPX from Strava activity (summary) and its streams (dict: type -> stream
+    with attribute data; latlng, time in s since start, altitude);
+    None if there's no GPS data (manual or indoor activities)
+    """
+    if 'latlng' not in streams or not streams['latlng'].data :
+        return None
+    latlng = np.array( streams['latlng'].data, dtype=float )
+    start = activity.start_date
+    if start.tzinfo is not None :
+        start = start.astimezone( timezone.utc ).replace( tzinfo=None )
+    times = None
+    if 'time' in streams :
+        seconds = np.asarray( streams['time'].data, dtype=float )
+        times = np.datetime64( start, 'us' ) + ( seconds*1e6 ).astype( 'timedelta64[us]' )
+    ele = streams['altitude'].data if 'altitude' in streams else None
+    info = [ '<name>%s</name>'%gpxStream.escape( activity.name or '' ) ]
+    activityType = getattr( activity.type, 'root', activity.type ) # stravalib >= 1 wraps it
+    if activityType :
+        info.append( '<type>%s</type>'%gpxStream.escape( str( activityType ) ) )
+    return GPX( attrib={ 'version': '1.1', 'creator': 'GPXtools stravaAtHome' },
+                tracks=[ Track( [ Segment( latlng[:,0], latlng[:,1], ele, times ) ], info ) ] )
+
 
 class stravaAtHome( Client ):
     """ 
@@ -32,8 +132,9 @@ class stravaAtHome( Client ):
     proceed at your own risk, and never use this tool for sensitive data!
     Methods:
       * checkScopes (did user grant all 'scopes' requested?)
-      * uploadGPX
-      * downloadGPX (to be implemented)
+      * uploadFile
+      * uploadMany (several uploads in flight, rate-limited)
+      * downloadGPX (incremental sync of activities with GPS data into GPX files)
 
     Authentication partly based on code from
     https://github.com/ryanbaumann/Strava-Stream-to-CSV/blob/master/strava-to-csv.py
@@ -123,9 +224,10 @@ class stravaAtHome( Client ):
             # No refresh token provided in file, yet can get here (e.g.: user declined authorization)
             return
         # retrieve from Strava
-        response = self.refresh_access_token( \
-            client_id=self.cl_id, client_secret=self.cl_secret, \
-            refresh_token=self.refresh_token )
+        with metrics.timer( 'strava.tokenRefresh' ) :
+            response = self.refresh_access_token( \
+                client_id=self.cl_id, client_secret=self.cl_secret, \
+                refresh_token=self.refresh_token )
         # update in client
         self.updateTokens( response )
         return
@@ -272,6 +374,9 @@ class stravaAtHome( Client ):
         self.cl_id,self.cl_secret=open(
              self.clientIDfile).read().strip().split(',')
         ## Initializations
+        ## Rate limits are tracked by our own limiter (unless the user provides one)
+        self.rateLimiter = stravaRateLimiter()
+        keywords.setdefault( 'rate_limiter', self.rateLimiter )
         super().__init__( **keywords )  # any extra keywords are passed on to stravalib.Client
         self.access_token=None # will overwrite any access token the user may have provided (that's not how this class is intended to be used, anyway)
         self.expires_at = 0
@@ -314,34 +419,29 @@ class stravaAtHome( Client ):
     def uploadFile( self, inputFileName, activityType=None, activityName=None, commute=None, private=None, fileFormat=None ) :
         """
         Uploads GPS file to Strava, return True if successful.
+        inputFileName: file name, or binary file object (e.g. io.BytesIO,
+          see pipeline.pipeline.upload) to upload from memory
         activityType, case-insensitive type of activity. Possible values: 
           ride, run, swim, workout, hike, walk, nordicski, alpineski, 
           backcountryski, iceskate, inlineskate, kitesurf, rollerski, windsurf,
           workout, snowboard, snowshoe 
           Type detected from file overrides, 
           uses athlete’s default type if not specified
-        fileFormat: will be determined from filename extension if None, 
+        fileFormat: will be determined from filename extension (file objects:
+          from their name attribute, if any; otherwise gpx) if None, 
           otherwise set to one of 
           fit, fit.gz, tcx, tcx.gz, gpx, gpx.gz
         If not self.batchmode, show uploaded activity in web browser.
         """
         # self.ensureAccess( thoroughCheck ) ## Leave it to user to ensure access!
+        if isinstance( inputFileName, str ) :
+            try:
+                open(inputFileName,'rb').close()
+            except:
+                print( "Input file %s couldn't be opened for reading"%inputFileName )
+                return False
         try:
-            fileObject=open(inputFileName,'r')
-        except:
-            print( "Input file %s couldn't be opened for reading"%inputFileName )
-            return False
-        if fileFormat is None :
-            fileFormat = os.path.splitext( inputFileName )[1].lower()
-            fileFormat = fileFormat[1:] # strip leading dot
-        try:
-            returnValue=self.upload_activity(fileObject, data_type=fileFormat, activity_type=activityType, private=True)
-            ## set to private first, change later if requested
-            print("Track uploaded to Strava, processing")
-            while not returnValue.is_complete:
-                print('.')
-                time.sleep(1)
-                returnValue.poll()
+            activityID = self._upload( inputFileName, activityType, fileFormat, verbose=True )
         except ActivityUploadFailed as e:
             print( "Strava upload failed:" )
             print( e )
@@ -350,11 +450,10 @@ class stravaAtHome( Client ):
             print( e )
             print( e.__class__ )  
             raise
-        if returnValue.is_error:
+        if activityID is None:
             print ('Upload failed!') # Can we ever get here?
             return False
         print('Upload succeeded!')
-        activityID = returnValue.activity_id
         ## Now set activity details
         self.update_activity(activityID, name=activityName,
                              commute=commute, private=private)
@@ -362,3 +461,178 @@ class stravaAtHome( Client ):
             webbrowser.open('https://www.strava.com/activities/%i'%activityID)
         return True
 
+
+    @staticmethod
+    def fileFormatFromName( inputFileName ) :
+        """ Strava data type from file name extension, e.g. gpx, gpx.gz; gpx for file objects without name """
+        if not isinstance( inputFileName, str ) :
+            inputFileName = getattr( inputFileName, 'name', None )
+            if not isinstance( inputFileName, str ) :
+                return 'gpx'
+        base, ext = os.path.splitext( inputFileName )
+        ext = ext.lower()
+        if ext == '.gz' :
+            ext = os.path.splitext( base )[1].lower() + ext
+        return ext[1:] # strip leading dot
+
+
+    def _upload( self, inputFileName, activityType=None, fileFormat=None, verbose=False,
+                 firstPoll=1., maxPoll=30., backoff=2. ) :
+        """
+        Upload file (name or binary file object; as private activity), wait for Strava to process it;
+        return activity ID (None if Strava reports an error).
+        Processing is polled with exponential backoff, starting after firstPoll
+        seconds, multiplying the interval by backoff, up to maxPoll seconds.
+        Raises ActivityUploadFailed, OSError.
+        """
+        if fileFormat is None :
+            fileFormat = self.fileFormatFromName( inputFileName )
+        if isinstance( inputFileName, str ) :
+            with open( inputFileName, 'rb' ) as fileObject :
+                self.rateLimiter.acquire()
+                ## set to private first, change later if requested
+                with metrics.timer( 'strava.upload' ) :
+                    returnValue=self.upload_activity(fileObject, data_type=fileFormat, activity_type=activityType, private=True)
+        else :
+            self.rateLimiter.acquire()
+            with metrics.timer( 'strava.upload' ) :
+                returnValue=self.upload_activity(inputFileName, data_type=fileFormat, activity_type=activityType, private=True)
+        if verbose :
+            print("Track uploaded to Strava, processing")
+        ## time from upload until Strava is done processing
+        uploaded = time.perf_counter()
+        delay = firstPoll
+        while not returnValue.is_complete:
+            if verbose :
+                print('.')
+            time.sleep( delay )
+            delay = min( delay*backoff, maxPoll )
+            self.rateLimiter.acquire()
+            with metrics.timer( 'strava.poll' ) :
+                returnValue.poll()
+        metrics.add( 'strava.uploadWait', time.perf_counter()-uploaded )
+        if returnValue.is_error:
+            return None
+        return returnValue.activity_id
+
+
+    def uploadMany( self, inputFileNames, activityType=None, activityNames=None, commute=None, private=None,
+                    maxInFlight=4, **pollParameters ) :
+        """
+        Upload several files, keeping up to maxInFlight uploads in flight
+        (each upload spends most of its time waiting for Strava to process it).
+        activityNames: None, one name for all, or list with one name per file.
+        Other parameters as in uploadFile; pollParameters (firstPoll, maxPoll, backoff)
+        control how processing is polled.  Requests are scheduled such that Strava's
+        rate limits (see stravaRateLimiter) are respected.
+        Activity details (name, commute, private) are set once all uploads are done.
+        Activities are never shown in the web browser.
+        Returns dictionary {inputFileName: activity ID, or None if upload failed}
+        """
+        if activityNames is None or isinstance( activityNames, str ) :
+            activityNames = [ activityNames ]*len( inputFileNames )
+        if len( activityNames ) != len( inputFileNames ) :
+            raise ValueError( "stravaAtHome.uploadMany: need one activity name per file" )
+        if not self.ensureAccess() :
+            raise RuntimeError( "stravaAtHome.uploadMany: no Strava access" )
+        def upload( fn ) :
+            try :
+                return self._upload( fn, activityType, **pollParameters )
+            except ( ActivityUploadFailed, OSError ) as e :
+                print( "Upload of %s failed: %s"%( fn, e ) )
+                return None
+        with ThreadPoolExecutor( max_workers=maxInFlight ) as executor :
+            activityIDs = list( executor.map( upload, inputFileNames ) )
+            ## Batch of activity updates, only where there's anything to update
+            def update( job ) :
+                activityID, name = job
+                self.rateLimiter.acquire()
+                self.update_activity( activityID, name=name, commute=commute, private=private )
+            updates = [ ( a, n ) for a, n in zip( activityIDs, activityNames )
+                        if a is not None and ( n is not None or commute is not None or private is not None ) ]
+            list( executor.map( update, updates ) )
+        results = dict( zip( inputFileNames, activityIDs ) )
+        nFailed = sum( a is None for a in activityIDs )
+        print( "Uploaded %i files, %i failed"%( len( results )-nFailed, nFailed ) )
+        return results
+
+
+    def downloadGPX( self, outDir, stateFile=None, after=None, workers=4, resolution=None, compress=True ) :
+        """
+        Incremental sync: download all activities started after the high-water mark
+        stored in stateFile (JSON, default outDir/strava.json; or after, datetime or
+        ISO string, on the first run) into GPX files outDir/<start>_<id>.gpx(.gz).
+        Activities are listed page by page, then their streams (latlng, time,
+        altitude; resolution: None (all points), 'low', 'medium', 'high') are
+        fetched by 'workers' threads within Strava's rate limits (see stravaRateLimiter).
+        The high-water mark only moves past activities that were saved (or have
+        no GPS data), so failed downloads are retried on the next run, and
+        activities that were already saved are never fetched again.
+        Returns list of new GPX files.
+        """
+        if stateFile is None :
+            stateFile = os.path.join( outDir, 'strava.json' )
+        state = { 'highWaterMark': None, 'activities': {} }
+        if os.path.isfile( stateFile ) :
+            with open( stateFile ) as f :
+                state = json.load( f )
+        if state['highWaterMark'] is not None :
+            after = state['highWaterMark']
+        if isinstance( after, str ) :
+            after = datetime.fromisoformat( after )
+        if not self.ensureAccess() :
+            raise RuntimeError( "stravaAtHome.downloadGPX: no Strava access" )
+        os.makedirs( outDir, exist_ok=True )
+        def saveState() :
+            tmpName = stateFile+'.tmp'
+            with open( tmpName, 'w' ) as f :
+                json.dump( state, f, indent=1 )
+            os.replace( tmpName, stateFile )
+        ## one request per page of the listing: each takes a token
+        pages = self.get_activities( after=after )
+        fetchPage = pages.result_fetcher
+        def rateLimitedFetch( **keywords ) :
+            self.rateLimiter.acquire()
+            return fetchPage( **keywords )
+        pages.result_fetcher = rateLimitedFetch
+        activities = [ a for a in pages if str( a.id ) not in state['activities'] ]
+        activities.sort( key=lambda a: a.start_date )
+        print( "%i new activities on Strava"%len( activities ) )
+        def download( activity ) :
+            try :
+                self.rateLimiter.acquire()
+                with metrics.timer( 'strava.streams' ) :
+                    streams = self.get_activity_streams( activity.id, types=[ 'latlng', 'time', 'altitude' ],
+                                                         resolution=resolution )
+                doc = activityToGpx( activity, streams or {} )
+                if doc is None :
+                    return None, None
+                base = '%s_%i.gpx%s'%( activity.start_date.strftime( '%Y%m%dT%H%M%S' ), activity.id, '.gz' if compress else '' )
+                ## write under a temporary name, so there are never partial files
+                tmpName = os.path.join( outDir, '.'+base )
+                gpxStream.writeGpx( doc, tmpName )
+                os.replace( tmpName, os.path.join( outDir, base ) )
+                return base, None
+            except Exception as e :
+                return None, "%s: %s"%( e.__class__.__name__, e )
+        newFiles = []
+        nFailed = 0
+        contiguous = True # all activities so far saved: high-water mark may move
+        with ThreadPoolExecutor( max_workers=workers ) as executor :
+            for i, ( activity, ( base, error ) ) in enumerate( zip( activities, executor.map( download, activities ) ) ) :
+                if error is not None :
+                    print( "Download of activity %i failed: %s"%( activity.id, error ) )
+                    nFailed += 1
+                    contiguous = False
+                    continue
+                state['activities'][str( activity.id )] = base
+                if base is not None :
+                    newFiles.append( os.path.join( outDir, base ) )
+                if contiguous :
+                    state['highWaterMark'] = activity.start_date.isoformat()
+                if i % 50 == 49 :
+                    saveState()
+        saveState()
+        print( "Downloaded %i activities, %i without GPS data, %i failed"%(
+            len( newFiles ), len( activities )-len( newFiles )-nFailed, nFailed ) )
+        return newFiles
@@ -0,0 +1,188 @@
+### Downloading tracks from Tahuna
+### A Tahuna link file holds the URL of a track page, which links to the GPX
+### file (?uniqueid=...).  Many link files are fetched at once here.
+
+# All downloads share one requests.Session, so connections to the Tahuna
+# server are kept open and reused; pages and tracks are fetched by a pool of
+# threads.  Tracks are streamed to disk in large chunks, into file.part, and
+# renamed when complete; an interrupted download is resumed from the end of
+# its .part file with a Range request (if the server doesn't honour it, the
+# download starts over).  A manifest (JSON, next to the output files by
+# default) records URL, size and SHA-256 of every finished download, so that
+# running the same link files again skips tracks that are already there.
+
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+# Download URL: first href containing ?uniqueid
+_trackLink = re.compile(r'''href\s*=\s*["']([^"']*\?uniqueid[^"']*)["']''', re.IGNORECASE)
+
+def trackUrl(html):
+    """ URL of the GPX file linked from Tahuna track page html, None if there is none """
+    m = _trackLink.search(html)
+    return None if m is None else m.group(1).replace('&amp;', '&')
+
+def fileHash(fileName, chunkSize=1<<20, h=None):
+    """ hashlib object (default SHA-256) updated with the contents of fileName """
+    if h is None:
+        h = hashlib.sha256()
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            h.update(chunk)
+    return h
+
+def pooledSession(workers=4):
+    """ requests.Session keeping up to 'workers' connections per host open """
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
+
+def fetch(s, url, outFileName, chunkSize=1<<20, timeout=30):
+    """
+    Stream url to outFileName using requests.Session s, resuming from outFileName.part
+    if it exists.  Returns (size, SHA-256 hex digest) of the file.
+    """
+    partName = outFileName+'.part'
+    offset = os.path.getsize(partName) if os.path.isfile(partName) else 0
+    # identity encoding: byte ranges refer to the file as stored
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = 'bytes=%i-'%offset
+    with metrics.timer('tahuna.fetch'), s.get(url, headers=headers, stream=True, timeout=timeout) as r:
+        if r.status_code == 416 and offset:
+            # range not satisfiable: .part is stale or complete; start over
+            os.remove(partName)
+            return fetch(s, url, outFileName, chunkSize, timeout)
+        r.raise_for_status()
+        if r.status_code == 206:
+            h = fileHash(partName, chunkSize)
+            mode = 'ab'
+        else:
+            h = hashlib.sha256()
+            offset = 0
+            mode = 'wb'
+        with open(partName, mode) as out:
+            for chunk in r.iter_content(chunkSize):
+                out.write(chunk)
+                h.update(chunk)
+                offset += len(chunk)
+                metrics.count('bytes.downloaded', len(chunk))
+    os.replace(partName, outFileName)
+    return offset, h.hexdigest()
+
+class downloadManifest:
+    """
+    Finished downloads in JSON file fileName: output file name (relative to the
+    manifest's directory) -> {'url', 'size', 'sha256'}; saved after every change.
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.isfile(fileName):
+            with open(fileName) as f:
+                self.entries = json.load(f)
+        return
+
+    def _key(self, outFileName):
+        return os.path.relpath(os.path.abspath(outFileName), os.path.dirname(os.path.abspath(self.fileName)))
+
+    def done(self, outFileName, url=None, verify=True):
+        """ True if outFileName was downloaded (from url, if given) and is still complete and unchanged """
+        entry = self.entries.get(self._key(outFileName))
+        if entry is None or (url is not None and entry['url'] != url):
+            return False
+        try:
+            if os.path.getsize(outFileName) != entry['size']:
+                return False
+        except OSError:
+            return False
+        return not verify or fileHash(outFileName).hexdigest() == entry['sha256']
+
+    def add(self, outFileName, url, size, sha256):
+        with self.lock:
+            self.entries[self._key(outFileName)] = {'url': url, 'size': size, 'sha256': sha256}
+            tmpName = self.fileName+'.tmp'
+            with open(tmpName, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmpName, self.fileName)
+
+class tahunaDownloader:
+    """
+    Download the tracks of many Tahuna link files concurrently ('workers' threads
+    sharing one pooled requests.Session, or 'session', e.g. with a local stand-in's adapter).
+    outDir: directory for the tracks (default: next to each link file; link.txt -> link.gpx)
+    manifest: downloadManifest or its file name (default for download(): tahuna.json
+      in outDir, or next to the first link file); finished downloads listed in it are skipped
+    verify: check the SHA-256 of existing files (otherwise only their size) before skipping them
+    """
+    def __init__(self, outDir=None, manifest=None, workers=4, chunkSize=1<<20, timeout=30, verify=True, session=None):
+        self.outDir = outDir
+        self.manifest = downloadManifest(manifest) if isinstance(manifest, str) else manifest
+        self.workers = workers
+        self.chunkSize = chunkSize
+        self.timeout = timeout
+        self.verify = verify
+        self.session = pooledSession(workers) if session is None else session
+        return
+
+    def outFileName(self, linkFileName):
+        base = os.path.splitext(os.path.basename(linkFileName))[0]+'.gpx'
+        return os.path.join(os.path.dirname(linkFileName) if self.outDir is None else self.outDir, base)
+
+    def get(self, linkFileName, outFileName=None):
+        """
+        Download track of linkFileName (to outFileName, default see outFileName());
+        returns (outFileName, True if downloaded / False if skipped)
+        """
+        if outFileName is None:
+            outFileName = self.outFileName(linkFileName)
+        with open(linkFileName) as f:
+            pageUrl = f.read().strip()
+        if self.manifest is not None and self.manifest.done(outFileName, pageUrl, self.verify):
+            return outFileName, False
+        with self.session.get(pageUrl, timeout=self.timeout) as r:
+            r.raise_for_status()
+            url = trackUrl(r.text)
+        if url is None:
+            raise ValueError("tahuna.get: couldn't find URL pointing to track in page linked from %s"%linkFileName)
+        size, sha256 = fetch(self.session, requests.compat.urljoin(pageUrl, url), outFileName, self.chunkSize, self.timeout)
+        if self.manifest is not None:
+            self.manifest.add(outFileName, pageUrl, size, sha256)
+        return outFileName, True
+
+    def _get(self, linkFileName):
+        try:
+            outFileName, downloaded = self.get(linkFileName)
+            return linkFileName, outFileName, downloaded, None
+        except Exception as e:
+            return linkFileName, None, False, "%s: %s"%(e.__class__.__name__, e)
+
+    def download(self, linkFileNames):
+        """
+        Download tracks of all linkFileNames.  Errors are reported per file without stopping the others.
+        Returns list of (linkFileName, outFileName, downloaded (False: skipped), error message or None).
+        """
+        linkFileNames = list(linkFileNames)
+        if not linkFileNames:
+            return []
+        if self.outDir is not None:
+            os.makedirs(self.outDir, exist_ok=True)
+        if self.manifest is None:
+            manifestDir = self.outDir if self.outDir is not None else os.path.dirname(linkFileNames[0])
+            self.manifest = downloadManifest(os.path.join(manifestDir, 'tahuna.json'))
+        if self.workers > 1 and len(linkFileNames) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                return list(executor.map(self._get, linkFileNames))
+        return [self._get(fn) for fn in linkFileNames]
@@ -0,0 +1,166 @@
+### Local cache of OSM map tiles for plotTracks
+### Tiles are kept on disk (as fetched, PNG) so maps can be drawn again
+### without going back to the tile server, or without network access at all.
+
+# tileStore keeps tiles in cacheDir/z/x/y.png and stays below maxBytes by
+# removing the least recently used tiles.  cachedOSM is a drop-in replacement
+# for cartopy's OSM image source that reads through a tileStore; in offline
+# mode, tiles missing from the store are drawn blank instead of being fetched.
+
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+import shapely
+from PIL import Image
+import cartopy.crs as ccrs
+from cartopy.io.img_tiles import OSM
+
+def defaultTileDir():
+    """ $GPXTOOLS_TILE_CACHE, or tiles in ~/.cache/GPXtools """
+    return os.environ.get('GPXTOOLS_TILE_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'GPXtools', 'tiles'))
+
+class tileStore:
+    """ Disk-backed store of map tiles (x, y, z) -> PNG bytes, at most maxBytes large (LRU) """
+    def __init__(self, cacheDir, maxBytes=500<<20):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        os.makedirs(cacheDir, exist_ok=True)
+        self.totalBytes = sum(size for used, size, fn in self._files())
+        return
+
+    def fileName(self, tile):
+        x, y, z = tile
+        return os.path.join(self.cacheDir, str(z), str(x), '%i.png'%y)
+
+    def _files(self):
+        """ (last use, size, file name) of all stored tiles """
+        result = []
+        for root, dirs, files in os.walk(self.cacheDir):
+            for f in files:
+                if not f.endswith('.png'):
+                    continue
+                fn = os.path.join(root, f)
+                try:
+                    st = os.stat(fn)
+                except OSError:
+                    continue
+                result.append((st.st_mtime, st.st_size, fn))
+        return result
+
+    def __contains__(self, tile):
+        return os.path.isfile(self.fileName(tile))
+
+    def get(self, tile):
+        """ PNG bytes of tile, or None if not stored """
+        fn = self.fileName(tile)
+        try:
+            with open(fn, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(fn) # for LRU eviction
+        except OSError:
+            pass
+        return data
+
+    def put(self, tile, data):
+        fn = self.fileName(tile)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        tmp = fn+'.%i.tmp'%threading.get_ident()
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        with self.lock:
+            # a tile written again replaces the old one: count only the difference
+            try:
+                old = os.path.getsize(fn)
+            except OSError:
+                old = 0
+            os.replace(tmp, fn)
+            self.totalBytes += len(data)-old
+            if self.totalBytes > self.maxBytes:
+                self.evict()
+        return
+
+    def evict(self):
+        """ Remove least recently used tiles until store is below maxBytes """
+        files = sorted(self._files())
+        total = sum(size for used, size, fn in files)
+        for used, size, fn in files:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(fn)
+            except OSError:
+                continue
+            total -= size
+        self.totalBytes = total
+        return
+
+class cachedOSM(OSM):
+    """
+    cartopy OSM image source reading tiles through tileStore 'store'.
+    offline: never access the network; tiles not in store are blank.
+    urlTemplate: tile server URL with {x}, {y}, {z} (e.g. a local tile server)
+    """
+    blankColor = (250, 250, 250)
+    def __init__(self, store=None, offline=False, urlTemplate='https://a.tile.openstreetmap.org/{z}/{x}/{y}.png',
+                 userAgent='GPXtools', timeout=30):
+        super().__init__()
+        self.store = tileStore(defaultTileDir()) if store is None else store
+        self.offline = offline
+        self.urlTemplate = urlTemplate
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = userAgent
+        return
+
+    def _image_url(self, tile):
+        x, y, z = tile
+        return self.urlTemplate.format(x=x, y=y, z=z)
+
+    def fetch(self, tile):
+        """ PNG bytes of tile: from store, or (unless offline) from server, then stored; None if unavailable """
+        data = self.store.get(tile)
+        if data is not None or self.offline:
+            return data
+        try:
+            r = self.session.get(self._image_url(tile), timeout=self.timeout)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            print(e)
+            return None
+        self.store.put(tile, r.content)
+        return r.content
+
+    def get_image(self, tile):
+        data = self.fetch(tile)
+        if data is None:
+            img = Image.fromarray(np.full((256, 256, 3), self.blankColor, dtype=np.uint8))
+        else:
+            img = Image.open(io.BytesIO(data))
+        return img.convert(self.desired_tile_form), self.tileextent(tile), 'lower'
+
+    def tilesFor(self, extent, zoom):
+        """ Tiles (x, y, z) covering extent [minLon, maxLon, minLat, maxLat] at zoom level """
+        corners = self.crs.transform_points(ccrs.PlateCarree(), np.array(extent[:2]), np.array(extent[2:]))
+        domain = shapely.box(corners[0, 0], corners[0, 1], corners[1, 0], corners[1, 1])
+        return list(self.find_images(domain, int(zoom)))
+
+    def prefetch(self, extent, zoom, workers=2):
+        """
+        Make sure all tiles covering extent at zoom level are in the store
+        (no-op in offline mode).  Returns number of tiles fetched.
+        """
+        if self.offline:
+            return 0
+        missing = [tile for tile in self.tilesFor(extent, zoom) if tile not in self.store]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fetched = list(executor.map(self.fetch, missing))
+        return sum(data is not None for data in fetched)
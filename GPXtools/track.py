@@ -0,0 +1,147 @@
+### Array-backed track model
+### Track points are stored column-wise in contiguous NumPy arrays
+### (one array each for latitude, longitude, elevation, time)
+### rather than as one Python object per point.
+
+# Anything else a track point may contain (extensions, sat, hdop, ...) is kept
+# verbatim as an XML fragment in Segment.extra, so that reading and writing a
+# GPX file through this model doesn't lose information.  The same holds for
+# track info (name, type, ...) and for everything in the file outside tracks.
+# See gpxStream.readGpx / gpxStream.writeGpx for conversion to and from GPX.
+
+import numpy as np
+
+timeUnit = 'datetime64[us]'
+
+class Segment:
+    """
+    Track segment.
+      * lat, lon: float arrays (degrees)
+      * ele: float array (m), NaN where missing
+      * time: datetime64[us] array (UTC), NaT where missing
+      * extra: None (no point has any further data) or object array
+        holding, per point, None or an XML fragment with the
+        remaining children of the <trkpt> element
+    """
+    __slots__ = ('lat', 'lon', 'ele', 'time', 'extra')
+
+    def __init__(self, lat, lon, ele=None, time=None, extra=None):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        n = len(self.lat)
+        if len(self.lon) != n:
+            raise ValueError("Segment: need as many longitudes as latitudes")
+        self.ele = np.full(n, np.nan) if ele is None else np.asarray(ele, dtype=float)
+        self.time = np.full(n, np.datetime64('NaT'), dtype=timeUnit) if time is None else np.asarray(time, dtype=timeUnit)
+        self.extra = None if extra is None else np.asarray(extra, dtype=object)
+        return
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __getitem__(self, idx):
+        """ Sub-segment: idx can be a slice, a boolean mask, or an index array """
+        if isinstance(idx, (int, np.integer)):
+            idx = slice(idx, idx+1 if idx != -1 else None)
+        return Segment(self.lat[idx], self.lon[idx], self.ele[idx], self.time[idx],
+                       None if self.extra is None else self.extra[idx])
+
+    @classmethod
+    def concatenate(cls, segments):
+        """ Join segments (e.g., chunks read from a stream) into one """
+        segments = list(segments)
+        if len(segments) == 1:
+            return segments[0]
+        if len(segments) == 0:
+            return cls([], [])
+        extra = None
+        if any(s.extra is not None for s in segments):
+            extra = np.concatenate([np.empty(len(s), dtype=object) if s.extra is None else s.extra for s in segments])
+        return cls(np.concatenate([s.lat for s in segments]),
+                   np.concatenate([s.lon for s in segments]),
+                   np.concatenate([s.ele for s in segments]),
+                   np.concatenate([s.time for s in segments]),
+                   extra)
+
+    def timeRange(self):
+        """ First and last valid time stamp (NaT if there are none) """
+        valid = self.time[~np.isnat(self.time)]
+        if len(valid) == 0:
+            return np.datetime64('NaT', 'us'), np.datetime64('NaT', 'us')
+        return valid[0], valid[-1]
+
+    def shiftTimes(self, shift):
+        """
+        Add shift (timedelta or timedelta64) to all time stamps.
+        The time array is replaced, not modified, so this works on read-only (cached) arrays.
+        """
+        self.time = self.time + (np.timedelta64(shift, 'us') if not isinstance(shift, np.timedelta64) else shift)
+        return
+
+class Track:
+    """
+    Track: list of segments plus 'info', list of XML fragments holding the
+    children of <trk> other than <trkseg> (name, type, ...)
+    """
+    __slots__ = ('info', 'segments')
+
+    def __init__(self, segments=None, info=None):
+        self.segments = [] if segments is None else segments
+        self.info = [] if info is None else info
+        return
+
+    def __len__(self):
+        """ Number of track points """
+        return sum(len(s) for s in self.segments)
+
+    def timeRange(self):
+        """ First and last valid time stamp (NaT if there are none) """
+        return timeRangeOf(s.timeRange() for s in self.segments)
+
+class GPX:
+    """
+    GPX document: tracks plus everything else needed to write it back out.
+      * tag, attrib: root element tag and attributes
+      * namespaces: {prefix: uri} declared on the root element
+      * head, tail: XML fragments of root children before / after the tracks
+        (metadata, waypoints, routes / extensions)
+    """
+    __slots__ = ('tag', 'attrib', 'namespaces', 'head', 'tracks', 'tail')
+
+    def __init__(self, tag='{http://www.topografix.com/GPX/1/1}gpx', attrib=None, namespaces=None, head=None, tracks=None, tail=None):
+        self.tag = tag
+        self.attrib = {'version': '1.1', 'creator': 'GPXtools'} if attrib is None else attrib
+        self.namespaces = {'': 'http://www.topografix.com/GPX/1/1'} if namespaces is None else namespaces
+        self.head = [] if head is None else head
+        self.tracks = [] if tracks is None else tracks
+        self.tail = [] if tail is None else tail
+        return
+
+    def header(self):
+        """ Copy of the document without tracks """
+        return GPX(self.tag, self.attrib, self.namespaces, self.head, [], self.tail)
+
+    def events(self):
+        """ Event stream as produced by gpxStream.iterEvents """
+        yield 'gpx', self.header()
+        for track in self.tracks:
+            yield 'trk', Track(info=track.info)
+            for seg in track.segments:
+                yield 'trkseg', None
+                if len(seg):
+                    yield 'trkpts', seg
+        yield 'end', self
+
+    def timeRange(self):
+        """ First and last valid time stamp (NaT if there are none) """
+        return timeRangeOf(t.timeRange() for t in self.tracks)
+
+def timeRangeOf(ranges):
+    """ Overall (first, last) from iterable of (first, last) pairs; NaT if nothing valid """
+    first = last = np.datetime64('NaT', 'us')
+    for f, l in ranges:
+        if np.isnat(first):
+            first = f
+        if not np.isnat(l):
+            last = l
+    return first, last
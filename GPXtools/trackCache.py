@@ -0,0 +1,177 @@
+### On-disk cache of parsed GPX files
+### Track points are stored as binary columns (.npy files), so that
+### a GPX file only needs to be parsed once; later reads memory-map the columns.
+
+# Each cached file gets a directory (named after the hash of its absolute path)
+# holding lat.npy, lon.npy, ele.npy, time.npy (all segments concatenated),
+# offsets.npy (segment boundaries), and meta.json (file size, mtime,
+# content hash, document header, track info, point extras).
+# An entry is valid as long as size and mtime of the source file (for members
+# of zip archives: of the archive) are unchanged;
+# if they changed but the content hash didn't, the entry is kept.
+# The cache is kept below maxBytes by evicting least recently used entries.
+
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import numpy as np
+
+from .track import Segment, Track, GPX
+from . import gpxStream
+
+columns = ('lat', 'lon', 'ele', 'time')
+
+def contentHash(fileName, blockSize=1<<20):
+    h = hashlib.sha1()
+    with open(gpxStream.splitArchivePath(fileName)[0], 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class trackCache:
+    """
+    Cache of parsed GPX files in directory cacheDir, at most maxBytes large.
+    load(fileName) returns a track.GPX document whose segments are
+    read-only views of memory-mapped arrays.
+    """
+    def __init__(self, cacheDir, maxBytes=2<<30):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        os.makedirs(cacheDir, exist_ok=True)
+        return
+
+    def entryDir(self, fileName):
+        return os.path.join(self.cacheDir, hashlib.sha1(os.path.abspath(fileName).encode()).hexdigest())
+
+    def load(self, fileName):
+        """ GPX document from cache, parsing (and caching) fileName if needed """
+        entry = self.entryDir(fileName)
+        meta = self._validMeta(fileName, entry)
+        if meta is None:
+            doc = gpxStream.readGpx(fileName)
+            self.store(fileName, doc)
+            entry = self.entryDir(fileName)
+            meta = self._readMeta(entry)
+            if meta is None:
+                # couldn't store, e.g. disk full
+                return doc
+        os.utime(os.path.join(entry, 'meta.json')) # for LRU eviction
+        return self._docFromEntry(entry, meta)
+
+    def _readMeta(self, entry):
+        try:
+            with open(os.path.join(entry, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _validMeta(self, fileName, entry):
+        """ Metadata of cache entry if it matches the current content of fileName, else None """
+        meta = self._readMeta(entry)
+        if meta is None:
+            return None
+        st = os.stat(gpxStream.splitArchivePath(fileName)[0])
+        if meta['size'] == st.st_size and meta['mtime'] == st.st_mtime_ns:
+            return meta
+        if meta['size'] != st.st_size or meta['hash'] != contentHash(fileName):
+            return None
+        # touched but unchanged
+        meta['mtime'] = st.st_mtime_ns
+        self._writeMeta(entry, meta)
+        return meta
+
+    def _writeMeta(self, entry, meta):
+        tmp = os.path.join(entry, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(entry, 'meta.json'))
+
+    def _docFromEntry(self, entry, meta):
+        arrays = {c: np.load(os.path.join(entry, c+'.npy'), mmap_mode='r') for c in columns}
+        offsets = np.load(os.path.join(entry, 'offsets.npy'))
+        extra = None
+        if meta['extra']:
+            extra = np.empty(len(arrays['lat']), dtype=object)
+            for i, fragment in meta['extra']:
+                extra[i] = fragment
+        tracks = []
+        iSeg = 0
+        for info, nSegments in zip(meta['trackInfo'], meta['nSegments']):
+            segments = []
+            for k in range(iSeg, iSeg+nSegments):
+                sl = slice(offsets[k], offsets[k+1])
+                segments.append(Segment(arrays['lat'][sl], arrays['lon'][sl], arrays['ele'][sl], arrays['time'][sl],
+                                        None if extra is None else extra[sl]))
+            iSeg += nSegments
+            tracks.append(Track(segments, info))
+        return GPX(meta['tag'], meta['attrib'], meta['namespaces'], meta['head'], tracks, meta['tail'])
+
+    def store(self, fileName, doc):
+        """ Store GPX document doc parsed from fileName """
+        st = os.stat(gpxStream.splitArchivePath(fileName)[0])
+        segments = [seg for track in doc.tracks for seg in track.segments]
+        offsets = np.cumsum([0]+[len(seg) for seg in segments])
+        extra = []
+        for seg, offset in zip(segments, offsets):
+            if seg.extra is not None:
+                extra.extend([int(offset+i), x] for i, x in enumerate(seg.extra) if x is not None)
+        meta = {'source': os.path.abspath(fileName), 'size': st.st_size, 'mtime': st.st_mtime_ns,
+                'hash': contentHash(fileName), 'tag': doc.tag, 'attrib': doc.attrib,
+                'namespaces': doc.namespaces, 'head': doc.head, 'tail': doc.tail,
+                'trackInfo': [t.info for t in doc.tracks], 'nSegments': [len(t.segments) for t in doc.tracks],
+                'extra': extra}
+        entry = self.entryDir(fileName)
+        # Write into temporary directory first, so that readers never see half-written entries
+        tmp = tempfile.mkdtemp(dir=self.cacheDir, prefix='.tmp')
+        try:
+            for c in columns:
+                data = [getattr(seg, c) for seg in segments]
+                np.save(os.path.join(tmp, c+'.npy'), np.concatenate(data) if data else
+                        np.zeros(0, dtype=getattr(Segment([], []), c).dtype))
+            np.save(os.path.join(tmp, 'offsets.npy'), offsets)
+            self._writeMeta(tmp, meta)
+            if os.path.isdir(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+        return
+
+    def entries(self):
+        """ List of (last use, size in bytes, directory) of all cache entries """
+        result = []
+        for name in os.listdir(self.cacheDir):
+            entry = os.path.join(self.cacheDir, name)
+            if name.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                used = os.path.getmtime(os.path.join(entry, 'meta.json'))
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            except OSError:
+                continue
+            result.append((used, size, entry))
+        return result
+
+    def evict(self):
+        """ Remove least recently used entries until cache is below maxBytes """
+        entries = sorted(self.entries())
+        total = sum(size for used, size, entry in entries)
+        for used, size, entry in entries:
+            if total <= self.maxBytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        return
+
+    def invalidate(self, fileName):
+        """ Remove cache entry of fileName """
+        shutil.rmtree(self.entryDir(fileName), ignore_errors=True)
+
+    def clear(self):
+        """ Remove all entries """
+        for used, size, entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
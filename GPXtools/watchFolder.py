@@ -0,0 +1,271 @@
+### Watching a folder for new GPX files
+### Recorders drop GPX files into a folder; every new (or changed) file gets
+### its privacy zones applied and is uploaded to Strava, once.
+
+# A manifest (JSON, .gpxwatch.json in the watched folder by default) records
+# for every file its size, mtime, content hash and state:
+#   'processed' (written to outDir), 'uploaded', 'duplicate' (same content as
+#   a file already done), 'failed' (with error message), or 'uploading'.
+# A file whose size and mtime match its manifest entry is never read again,
+# so restarting the watcher doesn't rescan file contents; a file whose size
+# or mtime changed is hashed, and only processed if its content is new.
+# Files still being written are left alone until their size and mtime have
+# been unchanged for 'settle' seconds.  A file that fails (e.g. truncated
+# XML) is tried again once its size or mtime changes.
+# An upload interrupted (crash, kill) between starting and recording its
+# result stays 'uploading' and is not repeated automatically: Strava may
+# already have it.
+# On Linux, the folder is watched with inotify (through libc, no extra
+# dependencies); elsewhere, or with poll=True, it is listed every 'interval'
+# seconds.  Subfolders are not watched.
+
+import ctypes
+import ctypes.util
+import fnmatch
+import json
+import os
+import select
+import struct
+import time
+
+from . import gpxTools
+from .trackCache import contentHash
+
+watchPatterns = ('*.gpx', '*.gpx.gz', '*.gpx.bz2')
+
+class watchManifest:
+    """
+    Processing state of the files in a folder, in JSON file fileName:
+    file name (relative to the folder) -> {'size', 'mtime', 'hash', 'state', 'output', 'error', 'time'}.
+    Saved (atomically) after every change.
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.entries = {}
+        if os.path.isfile(fileName):
+            with open(fileName) as f:
+                self.entries = json.load(f)
+        # content hash -> file name, for files done (processed or uploaded)
+        self.done = {e['hash']: name for name, e in self.entries.items()
+                     if e['state'] in ('processed', 'uploaded')}
+        return
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def set(self, name, **entry):
+        """ Update the entry of file name and save """
+        entry = dict(self.entries.get(name, {}), time=time.time(), **entry)
+        self.entries[name] = entry
+        if entry['state'] in ('processed', 'uploaded'):
+            self.done[entry['hash']] = name
+        self.save()
+        return entry
+
+    def save(self):
+        tmpName = self.fileName+'.tmp'
+        with open(tmpName, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmpName, self.fileName)
+
+class _inotify:
+    """ inotify watch of directory path through libc (Linux); names() returns names of files written or moved in """
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_Q_OVERFLOW = 0x4000
+    _header = struct.Struct('iIII')
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch failed for %s'%path)
+        return
+
+    def names(self, timeout):
+        """ Names of files changed within timeout (s); None if events were lost (rescan needed) """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 1<<16)
+        except BlockingIOError:
+            return []
+        names, offset = [], 0
+        while offset < len(data):
+            wd, mask, cookie, length = self._header.unpack_from(data, offset)
+            offset += self._header.size
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+            names.append(os.fsdecode(data[offset:offset+length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+class folderWatcher:
+    """
+    Apply privacy zones to new GPX files in folder and upload them to Strava, each once.
+    zone: gpxTools.privacyZone (None: files are uploaded as they are); output is
+      written to outDir (default: subfolder processed), as file_pz.gpx
+    strava: stravaAtHome instance with access (None: no uploads, only processing);
+      activityType, private, commute: see stravaAtHome.uploadFile
+    manifest: watchManifest or its file name (default: .gpxwatch.json in folder)
+    settle: seconds a file's size and mtime must stay unchanged before it is processed
+    interval: seconds between listings of the folder when polling (poll=True, or no inotify)
+    """
+    def __init__(self, folder, zone=None, strava=None, outDir=None, manifest=None, activityType=None,
+                 private=None, commute=None, settle=5., interval=10., poll=False):
+        if zone is None and strava is None:
+            raise ValueError("watchFolder.folderWatcher: nothing to do without zone or strava")
+        self.folder = folder
+        self.zone = zone
+        self.strava = strava
+        self.outDir = os.path.join(folder, 'processed') if outDir is None else outDir
+        if manifest is None:
+            manifest = os.path.join(folder, '.gpxwatch.json')
+        self.manifest = watchManifest(manifest) if isinstance(manifest, str) else manifest
+        self.activityType = activityType
+        self.private = private
+        self.commute = commute
+        self.settle = settle
+        self.interval = interval
+        self.poll = poll
+        # file name -> (size, mtime, monotonic time of last change) of files waiting to settle
+        self.pending = {}
+        self.stopped = False
+        return
+
+    @staticmethod
+    def isTrack(name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in watchPatterns)
+
+    def check(self, name):
+        """ Note file name (relative to folder) as pending if it is new or changed since the manifest entry """
+        try:
+            st = os.stat(os.path.join(self.folder, name))
+        except OSError:
+            # gone (e.g. renamed by its writer)
+            self.pending.pop(name, None)
+            return
+        size, mtime = st.st_size, st.st_mtime_ns
+        entry = self.manifest.get(name)
+        if entry is not None and (entry['size'], entry['mtime']) == (size, mtime):
+            self.pending.pop(name, None)
+            return
+        old = self.pending.get(name)
+        if old is None or old[:2] != (size, mtime):
+            # not modified for 'settle' seconds already: no need to wait any longer
+            age = time.time()-mtime/1e9
+            self.pending[name] = (size, mtime, time.monotonic()-min(max(age, 0.), self.settle))
+        return
+
+    def scan(self):
+        """ Check all files in folder (size and mtime only) """
+        names = [name for name in os.listdir(self.folder) if self.isTrack(name)]
+        for name in set(self.pending)-set(names):
+            del self.pending[name]
+        for name in names:
+            self.check(name)
+
+    def ready(self):
+        """ Pending files whose size and mtime have been unchanged for settle seconds """
+        now = time.monotonic()
+        return sorted(name for name, (size, mtime, changed) in self.pending.items() if now-changed >= self.settle)
+
+    def process(self, name):
+        """
+        Process and upload file name (relative to folder) unless its content was done before;
+        returns its new manifest entry (None if it changed or is gone)
+        """
+        fileName = os.path.join(self.folder, name)
+        old = self.pending.pop(name, None)
+        try:
+            st = os.stat(fileName)
+            if old is not None and old[:2] != (st.st_size, st.st_mtime_ns):
+                # changed since it was checked: wait for it to settle again
+                self.check(name)
+                return None
+            h = contentHash(fileName)
+        except OSError:
+            # gone (renamed or deleted since it was checked)
+            return None
+        stat = {'size': st.st_size, 'mtime': st.st_mtime_ns}
+        if h in self.manifest.done:
+            print("%s: same content as %s, skipped"%(name, self.manifest.done[h]))
+            return self.manifest.set(name, hash=h, state='duplicate', output=None, error=None, **stat)
+        output = fileName
+        try:
+            if self.zone is not None:
+                os.makedirs(self.outDir, exist_ok=True)
+                output = gpxTools.outputName(fileName, '_pz', self.outDir)
+                gpxTools.applyPrivacyZone(fileName, self.zone, outFileName=output)
+        except Exception as e:
+            print("Failed: %s (%s: %s)"%(name, e.__class__.__name__, e))
+            return self.manifest.set(name, hash=h, state='failed', output=None,
+                                     error="%s: %s"%(e.__class__.__name__, e), **stat)
+        if self.strava is None:
+            return self.manifest.set(name, hash=h, state='processed', output=output, error=None, **stat)
+        # recorded before uploading, so that an interrupted upload isn't repeated after a restart
+        self.manifest.set(name, hash=h, state='uploading', output=output, error=None, **stat)
+        try:
+            ok = self.strava.uploadFile(output, self.activityType, commute=self.commute, private=self.private)
+            error = None if ok else 'upload failed'
+        except Exception as e:
+            ok, error = False, "%s: %s"%(e.__class__.__name__, e)
+        return self.manifest.set(name, state='uploaded' if ok else 'failed', error=error)
+
+    def processReady(self):
+        """ Process all files that have settled; returns their names """
+        names = self.ready()
+        for name in names:
+            self.process(name)
+        return names
+
+    def run(self, once=False):
+        """
+        Watch folder until stop() is called (e.g. from a signal handler) or, if once,
+        until all files present at the start are done.
+        """
+        notifier = None
+        if not (self.poll or once):
+            try:
+                notifier = _inotify(self.folder)
+            except (OSError, AttributeError) as e:
+                print("No inotify (%s), polling every %g s"%(e, self.interval))
+        for name, entry in sorted(self.manifest.entries.items()):
+            if entry['state'] == 'uploading':
+                print("%s: upload was interrupted, not repeated (check Strava)"%name)
+        self.scan()
+        try:
+            while not self.stopped:
+                self.processReady()
+                if once and not self.pending:
+                    break
+                # wake up when the next pending file may have settled
+                timeout = self.interval
+                if self.pending:
+                    now = time.monotonic()
+                    timeout = min(timeout, max(0.1, min(changed+self.settle-now for size, mtime, changed in self.pending.values())))
+                if notifier is None:
+                    time.sleep(timeout)
+                    self.scan()
+                    continue
+                names = notifier.names(timeout)
+                if names is None:
+                    self.scan()
+                    continue
+                for name in set(names) | set(self.pending):
+                    if self.isTrack(name):
+                        self.check(name)
+        finally:
+            if notifier is not None:
+                notifier.close()
+        return
+
+    def stop(self):
+        self.stopped = True
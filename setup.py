@@ -24,6 +24,9 @@ setup(
     description='Tools to mess with bicycle GPS tracks.',
     keywords = ['GPS', 'GPX', 'bicycle', 'sport'],
     packages=['GPXtools'],
+    entry_points={
+        'console_scripts': ['gpxtools=GPXtools.gpxTools:main']
+    },
     classifiers = [
         "Programming Language :: Python :: 3.5",
         "Operating System :: OS Independent"
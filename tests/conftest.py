@@ -0,0 +1,53 @@
+import contextlib
+import http.server
+import os
+import sys
+import threading
+
+# run the tests against this checkout, installed or not
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+import numpy as np
+import pytest
+
+def syntheticSegment(start, nPoints, lat0=53.2, lon0=6.56, step=1, stepDeg=1e-5):
+    """ track.Segment of nPoints points, one every step seconds from start (ISO time), heading north-east """
+    from GPXtools.track import Segment
+    i = np.arange(nPoints)
+    time = np.datetime64(start, 'us')+i*np.timedelta64(step, 's')
+    return Segment(lat0+i*stepDeg, lon0+i*stepDeg, np.full(nPoints, 10.), time)
+
+def writeTrack(fileName, segments, creator=None):
+    """ Write one track of segments (list of track.Segment or (start, nPoints) pairs) to GPX file fileName """
+    from GPXtools import gpxStream
+    from GPXtools.track import GPX, Track
+    segments = [s if hasattr(s, 'lat') else syntheticSegment(*s) for s in segments]
+    doc = GPX(tracks=[Track(segments, ['<name>%s</name>'%os.path.basename(fileName)])])
+    if creator is not None:
+        doc.attrib['creator'] = creator
+    gpxStream.writeGpx(doc, fileName)
+    return fileName
+
+@pytest.fixture
+def track(tmp_path):
+    """ track(name, segments): write a GPX file (see writeTrack) into tmp_path, return its name """
+    return lambda name, segments, creator=None: writeTrack(str(tmp_path/name), segments, creator)
+
+@contextlib.contextmanager
+def localServer(handler):
+    """ Local stand-in for a web server: http.server with handler class, in a thread; yields its base URL """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:%i'%server.server_port
+    finally:
+        server.shutdown()
+        server.server_close()
+
+class quietHandler(http.server.BaseHTTPRequestHandler):
+    """ Request handler base class that doesn't log to stderr """
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+
+shapely = pytest.importorskip('shapely')
+from GPXtools import gpxStream
+from GPXtools.archiveIndex import archiveIndex
+from conftest import syntheticSegment
+
+@pytest.fixture
+def archive(track, tmp_path):
+    """
+    a: 53.2,6.56 to 53.21,6.57 (heading north-east) on January 1st, at 8:00 and 10:00 (two segments);
+    b: same place, January 2nd; c: 53.3,6.7 north-east, January 1st
+    """
+    track('a.gpx', [('2020-01-01T08:00', 1001), ('2020-01-01T10:00', 1001)])
+    track('b.gpx', [('2020-01-02T08:00', 1001)])
+    track('c.gpx', [syntheticSegment('2020-01-01T12:00', 500, lat0=53.3, lon0=6.7)])
+    return tmp_path
+
+def countingReadGpx():
+    """ readGpx that records the names of the files it parses """
+    parsed = []
+    def readGpx(fileName):
+        parsed.append(os.path.basename(fileName))
+        return gpxStream.readGpx(fileName)
+    readGpx.parsed = parsed
+    return readGpx
+
+def names(result):
+    return [os.path.basename(fn) for fn in result]
+
+def testIncrementalIngest(archive, track):
+    readGpx = countingReadGpx()
+    index = archiveIndex(str(archive/'index.sqlite'), readGpx=readGpx)
+    files = [str(archive/name) for name in ('a.gpx', 'b.gpx', 'c.gpx')]
+    assert index.ingest(files) == (3, 0, [])
+    assert sorted(readGpx.parsed) == ['a.gpx', 'b.gpx', 'c.gpx']
+    # nothing changed: nothing parsed again
+    assert index.ingest(files) == (0, 3, [])
+    assert len(readGpx.parsed) == 3
+    # a new version of b, and a new file
+    track('b.gpx', [('2020-01-03T08:00', 800)])
+    (archive/'d.gpx').write_text('not a track')
+    indexed, unchanged, errors = index.ingest(files+[str(archive/'d.gpx')])
+    assert (indexed, unchanged) == (1, 2)
+    assert [os.path.basename(fn) for fn, error in errors] == ['d.gpx']
+    assert readGpx.parsed[3:] == ['b.gpx', 'd.gpx']
+    assert len(index) == 3
+    # b indexed with its new segment only
+    assert names(index.query(start='2020-01-02T00:00', end='2020-01-02T23:59')) == []
+    segments = index.query(start='2020-01-03T00:00').segments
+    assert [(os.path.basename(fn), iTrack, iSeg) for fn, iTrack, iSeg, first, last in segments] == [('b.gpx', 0, 0)]
+    assert segments[0][3:] == (np.datetime64('2020-01-03T08:00'), np.datetime64('2020-01-03T08:13:19'))
+    # the same files through another instance
+    assert archiveIndex(str(archive/'index.sqlite')).ingest(files) == (0, 3, [])
+    os.remove(files[2])
+    assert index.prune() == 1
+    assert len(index) == 2
+    assert names(index.query(bbox=[6.6, 6.8, 53.2, 53.4])) == []
+
+def testQuery(archive):
+    index = archiveIndex(str(archive/'index.sqlite'))
+    index.ingest([str(archive/name) for name in ('a.gpx', 'b.gpx', 'c.gpx')], workers=2)
+    # sorted by time of the first matching segment
+    assert names(index.query()) == ['a.gpx', 'c.gpx', 'b.gpx']
+    assert names(index.query(bbox=[6.56, 6.57, 53.2, 53.21])) == ['a.gpx', 'b.gpx']
+    assert names(index.query(bbox=[6.56, 6.57, 53.2, 53.21], start='2020-01-01T09:00', end='2020-01-01T20:00')) == ['a.gpx']
+    result = index.query(start='2020-01-01T09:00', end='2020-01-01T20:00')
+    assert [(os.path.basename(fn), iSeg) for fn, iTrack, iSeg, first, last in result.segments] == [('a.gpx', 1), ('c.gpx', 0)]
+
+def testPolygonQuery(archive):
+    index = archiveIndex(str(archive/'index.sqlite'))
+    index.ingest([str(archive/name) for name in ('a.gpx', 'b.gpx', 'c.gpx')])
+    # a square on the line of a and b
+    crossing = [(6.564, 53.204), (6.566, 53.204), (6.566, 53.206), (6.564, 53.206)]
+    # a triangle beside it: inside their bounding boxes, off their lines
+    corner = [(6.56, 53.205), (6.565, 53.21), (6.56, 53.21)]
+    bbox = [6.56, 6.566, 53.204, 53.21]
+    inBox = index.query(bbox=bbox).segments
+    assert len(inBox) == 3
+    assert index.query(polygon=crossing).segments == index.query(bbox=[6.564, 6.566, 53.204, 53.206]).segments
+    assert index.query(polygon=corner).segments == []
+    assert set(index.query(bbox=bbox, polygon=shapely.geometry.Polygon(crossing)).segments) <= set(inBox)
+    # polygon and time
+    assert names(index.query(polygon=crossing, start='2020-01-02T00:00')) == ['b.gpx']
+    assert names(index.query(polygon=shapely.geometry.Polygon(crossing).buffer(0.2))) == ['a.gpx', 'c.gpx', 'b.gpx']
+    # a polygon that only reaches c
+    assert names(index.query(polygon=[(6.701, 53.3), (6.703, 53.3), (6.703, 53.303), (6.701, 53.303)])) == ['c.gpx']
@@ -0,0 +1,30 @@
+import os
+import zipfile
+
+import numpy as np
+
+from GPXtools import gpxStream, gpxTools
+from conftest import writeTrack
+
+def testSameOutputNameRefused(tmp_path):
+    rides = tmp_path/'rides'
+    rides.mkdir()
+    writeTrack(str(rides/'x.gpx'), [('2020-01-01T08:00', 20)])
+    writeTrack(str(rides/'x.gpx.gz'), [('2020-01-02T08:00', 20)])
+    writeTrack(str(rides/'y.gpx'), [('2020-01-03T08:00', 20)])
+    with zipfile.ZipFile(str(rides/'export.zip'), 'w') as zf:
+        for member, day in (('a/track.gpx', 4), ('b/track.gpx', 5), ('c/other.gpx', 6)):
+            zf.write(writeTrack(str(tmp_path/'member.gpx'), [('2020-01-%02iT08:00'%day, 20)]), member)
+    outDir = str(tmp_path/'out')
+    results = gpxTools.batchProcess(str(rides), 'shift', nHours=1, outDir=outDir, workers=2)
+    results = {os.path.relpath(fn, str(rides)): (outFileName, error) for fn, outFileName, error in results}
+    assert sorted(results) == ['export.zip/a/track.gpx', 'export.zip/b/track.gpx', 'export.zip/c/other.gpx',
+                               'x.gpx', 'x.gpx.gz', 'y.gpx']
+    for name in ('x.gpx', 'x.gpx.gz', 'export.zip/a/track.gpx', 'export.zip/b/track.gpx'):
+        outFileName, error = results[name]
+        assert outFileName is None
+        assert error.startswith('ValueError: output file')
+    assert 'x.gpx.gz' in results['x.gpx'][1]
+    assert sorted(os.listdir(outDir)) == ['other_timewarp.gpx', 'y_timewarp.gpx']
+    seg = gpxStream.readGpx(os.path.join(outDir, 'y_timewarp.gpx')).tracks[0].segments[0]
+    assert seg.time[0] == np.datetime64('2020-01-03T09:00')
@@ -0,0 +1,22 @@
+import pytest
+
+from GPXtools import gpxStream, gpxTools
+
+@pytest.mark.parametrize('argv, message', [
+    (['run', 'a.gpx'], 'run needs --output'),
+    (['privacy', 'rides/'], 'privacy needs --zone'),
+    (['watch', 'inbox/'], 'watch needs --zone'),
+    ])
+def testMissingArguments(argv, message, capsys):
+    with pytest.raises(SystemExit) as e:
+        gpxTools.main(argv)
+    assert e.value.code == 2
+    assert message in capsys.readouterr().err
+
+def testRun(track, tmp_path):
+    a = track('a.gpx', [('2020-01-01T08:00', 100)])
+    out = str(tmp_path/'out.gpx')
+    assert gpxTools.main(['run', a, '--shift', '1', '--zone', '53.2,6.56', '50', '-o', out]) == 0
+    seg = gpxStream.readGpx(out).tracks[0].segments[0]
+    assert 0 < len(seg) < 100
+    assert str(seg.time[-1]).startswith('2020-01-01T09:01')
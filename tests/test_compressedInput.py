@@ -0,0 +1,68 @@
+import bz2
+import gzip
+import os
+import shutil
+import zipfile
+
+import numpy as np
+import pytest
+
+from GPXtools import gpxStream, gpxTools
+from conftest import writeTrack
+
+@pytest.fixture
+def rides(tmp_path):
+    """
+    Folder with the same track plain, gzip and bzip2 compressed,
+    a zip archive with two other tracks in subfolders, and a single-track archive
+    """
+    folder = tmp_path/'rides'
+    folder.mkdir()
+    plain = writeTrack(str(folder/'plain.gpx'), [('2020-01-01T08:00', 100)])
+    with open(plain, 'rb') as src, gzip.open(str(folder/'gzipped.gpx.gz'), 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    with open(plain, 'rb') as src, bz2.open(str(folder/'bzipped.gpx.bz2'), 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    with zipfile.ZipFile(str(folder/'export.zip'), 'w') as zf:
+        zf.write(writeTrack(str(tmp_path/'x.gpx'), [('2020-01-02T08:00', 50)]), '2020/a.gpx')
+        zf.write(writeTrack(str(tmp_path/'x.gpx'), [('2020-01-03T08:00', 60)]), '2021/b.gpx')
+        zf.writestr('notes.txt', 'not a track')
+    with zipfile.ZipFile(str(tmp_path/'single.zip'), 'w') as zf:
+        zf.write(plain, 'only.gpx')
+    return folder
+
+def testExpandInputs(rides):
+    files = [os.path.relpath(fn, str(rides)) for fn in gpxTools.expandInputs(str(rides))]
+    assert sorted(files) == ['bzipped.gpx.bz2', 'export.zip/2020/a.gpx', 'export.zip/2021/b.gpx',
+                             'gzipped.gpx.gz', 'plain.gpx']
+
+def testReadGpx(rides):
+    plain = gpxStream.readGpx(str(rides/'plain.gpx')).tracks[0].segments[0]
+    for name in ('gzipped.gpx.gz', 'bzipped.gpx.bz2', '../single.zip', '../single.zip/only.gpx'):
+        seg = gpxStream.readGpx(str(rides/name)).tracks[0].segments[0]
+        assert np.array_equal(seg.lat, plain.lat) and np.array_equal(seg.time, plain.time)
+    assert len(gpxStream.readGpx(str(rides/'export.zip/2021/b.gpx')).tracks[0].segments[0]) == 60
+    # compression is recognized from the content, not the name
+    os.rename(str(rides/'bzipped.gpx.bz2'), str(rides/'renamed.gpx'))
+    assert gpxStream.compression(str(rides/'renamed.gpx')) == 'bzip2'
+    assert len(gpxStream.readGpx(str(rides/'renamed.gpx')).tracks[0].segments[0]) == 100
+
+def testArchiveErrors(rides):
+    with pytest.raises(ValueError):
+        gpxStream.readGpx(str(rides/'export.zip'))
+    with pytest.raises(FileNotFoundError):
+        gpxStream.readGpx(str(rides/'export.zip/2022/c.gpx'))
+
+def testOutputName(rides):
+    assert gpxTools.outputName(str(rides/'gzipped.gpx.gz'), '_pz') == str(rides/'gzipped_pz.gpx')
+    assert gpxTools.outputName(str(rides/'bzipped.gpx.bz2'), '_pz', 'out') == os.path.join('out', 'bzipped_pz.gpx')
+    # next to the archive
+    assert gpxTools.outputName(str(rides/'export.zip/2020/a.gpx'), '_timewarp') == str(rides/'a_timewarp.gpx')
+
+def testBatchOverArchive(rides, tmp_path):
+    outDir = str(tmp_path/'out')
+    results = gpxTools.batchProcess(str(rides/'export.zip'), 'shift', nHours=1, outDir=outDir, workers=1)
+    assert [error for fn, outFileName, error in results] == [None, None]
+    assert sorted(os.listdir(outDir)) == ['a_timewarp.gpx', 'b_timewarp.gpx']
+    seg = gpxStream.readGpx(os.path.join(outDir, 'b_timewarp.gpx')).tracks[0].segments[0]
+    assert seg.time[0] == np.datetime64('2020-01-03T09:00')
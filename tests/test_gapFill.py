@@ -0,0 +1,42 @@
+import numpy as np
+
+from GPXtools.gapFill import fillerIndex, gapFiller
+from conftest import syntheticSegment
+
+def filler(track):
+    """ gapFiller with one filler file, one point per second from 08:00 to 09:00 """
+    return gapFiller(fillerIndex([track('filler.gpx', [('2020-01-01T08:00', 3601)])]), minGap=60)
+
+def testGapAfterUntimedPoint(track):
+    first = syntheticSegment('2020-01-01T08:00', 600)
+    first.time[-1] = np.datetime64('NaT')
+    second = syntheticSegment('2020-01-01T08:30', 600)
+    gf = filler(track)
+    out = [gf(first), gf(second)]
+    assert len(out[0]) == 600
+    # filled from the last timed point of the first chunk (08:09:58) to 08:30
+    assert len(out[1]) == 1201+600
+    assert out[1].time[0] == np.datetime64('2020-01-01T08:09:59')
+    assert out[1].time[1200] == np.datetime64('2020-01-01T08:29:59')
+    assert (gf.nGaps, gf.nFilled, gf.nPoints) == (1, 1, 1201)
+
+def testUntimedChunk(track):
+    gf = filler(track)
+    gf(syntheticSegment('2020-01-01T08:00', 10))
+    untimed = syntheticSegment('2020-01-01T08:00', 5)
+    untimed.time[:] = np.datetime64('NaT')
+    assert len(gf(untimed)) == 5
+    out = gf(syntheticSegment('2020-01-01T08:05', 10))
+    assert len(out) == 290+10
+    assert out.time[0] == np.datetime64('2020-01-01T08:00:10')
+
+def testGapAcrossUntimedPointInChunk(track):
+    seg = syntheticSegment('2020-01-01T08:00', 20)
+    seg.time[10:] += np.timedelta64(5, 'm')
+    seg.time[10] = np.datetime64('NaT')
+    out = filler(track)(seg)
+    # inserted right before the first timed point after the gap, after the untimed point
+    assert len(out) == 20+301
+    assert np.isnat(out.time[10])
+    assert out.time[11] == np.datetime64('2020-01-01T08:00:10')
+    assert out.time[-10] == np.datetime64('2020-01-01T08:05:10')
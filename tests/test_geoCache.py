@@ -0,0 +1,97 @@
+import sqlite3
+import time
+
+import pytest
+
+pytest.importorskip('geopy')
+from geopy.location import Location
+
+from GPXtools import geoCache, gpxTools
+from GPXtools.geoCache import geocodeCache
+
+class stubGeolocator:
+    """ Offline geocoder: every address is at 53.2, 6.56; calls are recorded """
+    def __init__(self):
+        self.calls = []
+
+    def geocode(self, query):
+        self.calls.append(('geocode', query))
+        return Location(query, (53.2, 6.56, 0.), {'display_name': query})
+
+    def reverse(self, query):
+        self.calls.append(('reverse', query))
+        return Location('Grote Markt, Groningen', (53.2, 6.56, 0.), {})
+
+@pytest.fixture
+def geolocator(monkeypatch):
+    monkeypatch.setattr(gpxTools, '_geolocator', None)
+    monkeypatch.setattr(gpxTools, '_geocodeCache', None)
+    stub = stubGeolocator()
+    gpxTools.setGeolocator(stub)
+    return stub
+
+def testMemoryHit(geolocator):
+    gpxTools.setGeocodeCache(geocodeCache(None))
+    loc = gpxTools.getCoordsFromAddress('Grote Markt, Groningen')
+    assert (loc.latitude, loc.longitude) == (53.2, 6.56)
+    # same address, other white space: not resolved again
+    assert gpxTools.getCoordsFromAddress(' Grote Markt, Groningen ') is loc
+    assert gpxTools.getAddressFromCoords('53.2, 6.56').address == 'Grote Markt, Groningen'
+    gpxTools.getAddressFromCoords('53.2,6.56')
+    assert geolocator.calls == [('geocode', 'Grote Markt, Groningen'), ('reverse', '53.2, 6.56')]
+    # without cache: always resolved
+    gpxTools.getCoordsFromAddress('Grote Markt, Groningen', useCache=False)
+    assert len(geolocator.calls) == 3
+
+def testFileHitAcrossInstances(geolocator, tmp_path):
+    fileName = str(tmp_path/'geocode.sqlite')
+    gpxTools.setGeocodeCache(geocodeCache(fileName))
+    gpxTools.getCoordsFromAddress('Vismarkt, Groningen')
+    # a new cache (e.g. next run) finds it in the file
+    gpxTools.setGeocodeCache(geocodeCache(fileName))
+    loc = gpxTools.getCoordsFromAddress('Vismarkt, Groningen')
+    assert loc.address == 'Vismarkt, Groningen'
+    assert loc.raw == {'display_name': 'Vismarkt, Groningen'}
+    assert geolocator.calls == [('geocode', 'Vismarkt, Groningen')]
+
+def testExpiry(geolocator, tmp_path):
+    fileName = str(tmp_path/'geocode.sqlite')
+    gpxTools.setGeocodeCache(geocodeCache(fileName, ttl=0.2))
+    gpxTools.getCoordsFromAddress('Vismarkt, Groningen')
+    gpxTools.getCoordsFromAddress('Vismarkt, Groningen')
+    assert len(geolocator.calls) == 1
+    time.sleep(0.3)
+    # expired in memory and in the file
+    gpxTools.getCoordsFromAddress('Vismarkt, Groningen')
+    assert len(geolocator.calls) == 2
+    gpxTools.setGeocodeCache(geocodeCache(fileName, ttl=0.2))
+    gpxTools.getCoordsFromAddress('Vismarkt, Groningen')
+    assert len(geolocator.calls) == 2
+
+def testFileEviction(geolocator, tmp_path):
+    fileName = str(tmp_path/'geocode.sqlite')
+    gpxTools.setGeocodeCache(geocodeCache(fileName, maxEntries=2, memoryEntries=1))
+    for address in ('a', 'b', 'c'):
+        gpxTools.getCoordsFromAddress(address)
+    # least recently used went
+    gpxTools.setGeocodeCache(geocodeCache(fileName))
+    for address in ('b', 'c', 'a'):
+        gpxTools.getCoordsFromAddress(address)
+    assert [query for kind, query in geolocator.calls] == ['a', 'b', 'c', 'a']
+
+def testConnectionsClosed(geolocator, tmp_path, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+    def recorded(*args, **keywords):
+        opened.append(connect(*args, **keywords))
+        return opened[-1]
+    monkeypatch.setattr(geoCache.sqlite3, 'connect', recorded)
+    cache = geocodeCache(str(tmp_path/'geocode.sqlite'), memoryEntries=0)
+    gpxTools.setGeocodeCache(cache)
+    gpxTools.getCoordsFromAddress('a')
+    gpxTools.getCoordsFromAddress('a')
+    cache.clear()
+    assert len(opened) == 5
+    for db in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            db.execute('SELECT 1')
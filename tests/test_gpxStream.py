@@ -0,0 +1,77 @@
+import gzip
+import io
+import re
+
+import numpy as np
+import pytest
+
+from GPXtools import gpxStream
+from GPXtools.pipeline import pipeline
+from conftest import syntheticSegment
+
+def header(text):
+    return text[:text.index('<trk>')]
+
+def testSummaryFilledInPlainFile(track, tmp_path):
+    a = track('a.gpx', [('2020-01-01T08:00', 100)])
+    out = pipeline(a).write(str(tmp_path/'out.gpx'))
+    head = header(open(out).read())
+    assert '<bounds minlat="53.2000000"' in head
+    assert 'points="100"' in head
+    # reserved space is sized to the widest summary, not much more
+    assert max(len(run) for run in re.findall(' +', head)) < 64
+
+def testNoPlaceholderInGzipFile(track, tmp_path):
+    a = track('a.gpx', [('2020-01-01T08:00', 100)])
+    out = pipeline(a).write(str(tmp_path/'out.gpx.gz'))
+    with gzip.open(out, 'rt') as f:
+        head = header(f.read())
+    assert 'gpxtools:summary' not in head
+    assert '    ' not in head.replace('\n  ', '\n')
+    assert gpxStream.readGpx(out).tracks[0].segments[0].lat.size == 100
+
+def testSummaryInUploadBuffer(track):
+    a = track('a.gpx', [('2020-01-01T08:00', 100)])
+    buf = pipeline(a).buffer()
+    assert buf.name == 'track.gpx.gz' and buf.tell() == 0
+    head = header(gzip.decompress(buf.read()).decode())
+    assert 'points="100"' in head and '<bounds' in head
+
+def testNotSeekable(track):
+    class pipe(io.StringIO):
+        def seekable(self):
+            return False
+    a = track('a.gpx', [('2020-01-01T08:00', 100)])
+    out = pipe()
+    pipeline(a).write(out)
+    assert 'gpxtools:summary' not in header(out.getvalue())
+    assert not gpxStream.canRewrite(out)
+
+def timedTrack(track, name, untimedHead=0, untimedTail=0):
+    """ Track of two segments, without time stamps on its first / last points """
+    first = syntheticSegment('2020-01-01T08:00', 100)
+    second = syntheticSegment('2020-01-01T09:00', 100)
+    first.time[:untimedHead] = np.datetime64('NaT')
+    if untimedTail:
+        second.time[-untimedTail:] = np.datetime64('NaT')
+    return track(name, [first, second])
+
+@pytest.mark.parametrize('name, untimedHead, untimedTail, blockSize', [
+    ('a.gpx', 0, 0, 1<<16),
+    ('a.gpx', 1, 1, 1<<16),
+    # last time stamp only found after reading back several blocks
+    ('a.gpx', 3, 60, 64),
+    ('a.gpx.gz', 1, 1, 1<<16),
+    ])
+def testProbeTimeRange(track, name, untimedHead, untimedTail, blockSize):
+    fn = timedTrack(track, name, untimedHead, untimedTail)
+    first, last = gpxStream.probeTimeRange(fn, blockSize)
+    assert (first, last) == gpxStream.timeRange(fn)
+    assert first == np.datetime64('2020-01-01T08:00')+np.timedelta64(untimedHead, 's')
+    assert last == np.datetime64('2020-01-01T09:01:39')-np.timedelta64(untimedTail, 's')
+
+def testProbeTimeRangeUntimed(track):
+    seg = syntheticSegment('2020-01-01T08:00', 10)
+    seg.time[:] = np.datetime64('NaT')
+    fn = track('a.gpx', [seg])
+    assert all(np.isnat(t) for t in gpxStream.probeTimeRange(fn))
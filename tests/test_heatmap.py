@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+from GPXtools.heatmap import densify, earthRadius, heatmap, webMercator
+from GPXtools.track import Segment
+
+def pixelCenters(hm, pixels):
+    """ Segment of points at the centers of pixels [(ix, iy), ...] of heatmap hm """
+    ix, iy = np.array(pixels, dtype=float).T
+    x = hm.x0+(ix+0.5)*hm.pixel
+    y = hm.y0+(iy+0.5)*hm.pixel
+    lat = np.degrees(2*np.arctan(np.exp(y/earthRadius))-np.pi/2)
+    lon = np.degrees(x/earthRadius)
+    return Segment(lat, lon)
+
+def testCountsByHand():
+    hm = heatmap([6.5, 6.6, 53.2, 53.25], width=4, lineDensity=False)
+    assert hm.height == 4
+    hm.add(pixelCenters(hm, [(0, 0), (0, 0), (3, 2), (1, 2)]))
+    # outside the grid: not counted
+    hm.add(Segment(np.array([53.2, 60.]), np.array([6.0, 6.55])))
+    hm.add(pixelCenters(hm, [(1, 2), (2, 1)]))
+    assert hm.counts.tolist() == [[2, 0, 0, 0],
+                                  [0, 0, 2, 0],
+                                  [0, 1, 0, 0],
+                                  [0, 0, 1, 0]]
+    assert hm.nPoints == 8
+
+def testFarEdgeInLastPixel():
+    extent = [6.5, 6.6, 53.2, 53.25]
+    hm = heatmap(extent, width=4, lineDensity=False)
+    hm.add(Segment(np.array([extent[2], extent[3]]), np.array([extent[0], extent[1]])))
+    assert hm.counts[0, 0] == 1
+    assert hm.counts[3, hm.height-1] == 1
+
+def testMatchesHistogram():
+    rng = np.random.default_rng(1)
+    hm = heatmap([6.5, 6.6, 53.2, 53.25], width=64)
+    expected = np.zeros_like(hm.counts)
+    for i in range(20):
+        seg = Segment(53.19+0.07*rng.random(30), 6.49+0.12*rng.random(30))
+        hm.add(seg)
+        x, y = webMercator(seg.lat, seg.lon)
+        x, y = densify(x, y, hm.pixel)
+        expected += np.histogram2d(x, y, bins=(hm.width, hm.height),
+                                   range=((hm.x0, hm.x0+hm.width*hm.pixel), (hm.y0, hm.y0+hm.height*hm.pixel)))[0]
+    assert np.array_equal(hm.counts, expected)
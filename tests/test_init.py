@@ -0,0 +1,59 @@
+# Lazy attributes of the GPXtools package; each check runs in a fresh
+# interpreter, since importing a submodule changes the package for good.
+
+import importlib.util
+import os
+import subprocess
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run(code):
+    subprocess.check_call([sys.executable, '-c', code], cwd=root)
+
+isClass = '''
+import sys
+import GPXtools
+from GPXtools import stravaAtHome
+assert isinstance(stravaAtHome, type), stravaAtHome
+assert GPXtools.stravaAtHome is stravaAtHome
+assert sys.modules['GPXtools.stravaAtHome'].stravaAtHome is stravaAtHome
+'''
+
+@pytest.mark.parametrize('before', [
+    '',
+    'from GPXtools import gpxTools',
+    'import GPXtools\nGPXtools.stravaAtHome\nimport GPXtools.stravaAtHome\nfrom GPXtools.stravaAtHome import stravaRateLimiter',
+    ])
+def testStravaAtHomeIsClass(before):
+    pytest.importorskip('stravalib')
+    run(before+'\n'+isClass)
+
+def testSubmoduleImportedByName():
+    # as in any package, 'import GPXtools.stravaAtHome' binds the submodule
+    pytest.importorskip('stravalib')
+    run('''
+import GPXtools.stravaAtHome
+assert isinstance(GPXtools.stravaAtHome.stravaAtHome, type)
+''')
+
+def testImportIsLight():
+    run('''
+import sys
+import GPXtools
+heavy = [m for m in ('numpy', 'stravalib', 'matplotlib', 'shapely') if m in sys.modules]
+assert not heavy, heavy
+assert 'stravaAtHome' in dir(GPXtools)
+''')
+
+def testImportTime(monkeypatch):
+    # util/benchmarkImport.py with a generous budget (its default is 50 ms)
+    monkeypatch.chdir(root)
+    spec = importlib.util.spec_from_file_location('benchmarkImport', os.path.join(root, 'util', 'benchmarkImport.py'))
+    benchmark = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(benchmark)
+    ms, heavy = benchmark.importTime('GPXtools', repeat=3)
+    assert not heavy
+    assert ms < 5*benchmark.defaultBudgets['GPXtools']
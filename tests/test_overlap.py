@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from GPXtools import gpxStream, gpxTools
+from GPXtools.overlap import resolveOverlaps, sweep
+
+def testSweep():
+    t = lambda s: np.datetime64('2020-01-01T'+s, 'us')
+    starts = np.array([t('08:00'), t('08:10'), t('09:00'), 'NaT'], dtype='datetime64[us]')
+    ends = np.array([t('08:30'), t('08:20'), t('09:10'), 'NaT'], dtype='datetime64[us]')
+    groups = sweep(starts, ends)
+    assert groups[0] == groups[1]
+    assert len(set(groups)) == 3
+
+def testInterleavedSourcesStayInTimeOrder(track):
+    # A: 08:00-08:29 and 09:30-09:59; B: 08:45-09:14, between them, overlapping neither
+    a = gpxStream.readGpx(track('a.gpx', [('2020-01-01T08:00', 30, 60), ('2020-01-01T09:30', 30, 60)]))
+    b = gpxStream.readGpx(track('b.gpx', [('2020-01-01T08:45', 30, 60)]))
+    tracks, nOverlaps = resolveOverlaps([a, b], ['a.gpx', 'b.gpx'])
+    assert nOverlaps == 0
+    starts = [str(seg.time[0])[11:16] for trk in tracks for seg in trk.segments]
+    assert starts == ['08:00', '08:45', '09:30']
+    # a new <trk> whenever the source changes
+    assert [len(trk.segments) for trk in tracks] == [1, 1, 1]
+    assert [trk.info for trk in tracks] == [a.tracks[0].info, b.tracks[0].info, a.tracks[0].info]
+
+@pytest.mark.parametrize('policy', ['density', 'prefer', 'interleave'])
+def testMergedOutputIsTimeOrdered(track, tmp_path, policy):
+    files = [track('a.gpx', [('2020-01-01T08:00', 30, 60), ('2020-01-01T09:30', 30, 60)]),
+             track('b.gpx', [('2020-01-01T08:45', 30, 60)]),
+             track('c.gpx', [('2020-01-01T09:40', 600, 1)], creator='Garmin')]
+    out = str(tmp_path/'merged.gpx')
+    gpxTools.gpxTools().mergeTracks(files, out, overlap=policy, prefer=['Garmin'])
+    time = np.concatenate([seg.time for trk in gpxStream.readGpx(out).tracks for seg in trk.segments])
+    assert (np.diff(time) > np.timedelta64(0)).all()
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from GPXtools import gpxStream, gpxTools
+from GPXtools.pipeline import pipeline
+
+def points(fileName):
+    return sum(len(seg) for trk in gpxStream.readGpx(fileName).tracks for seg in trk.segments)
+
+def testMergeWritesAllPoints(track, tmp_path):
+    a = track('a.gpx', [('2020-01-01T08:00', 100)])
+    b = track('b.gpx', [('2020-01-01T09:00', 50)])
+    out = str(tmp_path/'merged.gpx')
+    gpxTools.gpxTools().mergeTracks([b, a], out)
+    assert points(out) == 150
+    assert not os.path.exists(out+'.tmp')
+
+def testRejectedMergeWritesNothing(track, tmp_path):
+    a = track('a.gpx', [('2020-01-01T08:00', 100)])
+    b = track('b.gpx', [('2020-01-01T08:01', 100)])
+    out = str(tmp_path/'merged.gpx')
+    with pytest.raises(ValueError):
+        gpxTools.gpxTools().mergeTracks([a, b], out, overlap='error')
+    assert sorted(os.listdir(str(tmp_path))) == ['a.gpx', 'b.gpx']
+
+@pytest.mark.parametrize('outName', ['out.gpx', 'out.gpx.gz'])
+def testFailedRunLeavesNoOutput(track, tmp_path, outName):
+    a = track('a.gpx', [('2020-01-01T08:00', 100)])
+    out = str(tmp_path/outName)
+    def fail(seg):
+        raise RuntimeError('stage failed')
+    with pytest.raises(RuntimeError):
+        pipeline(a, chunkSize=10).apply(fail).write(out)
+    assert sorted(os.listdir(str(tmp_path))) == ['a.gpx']
+
+def testCompressedOutput(track, tmp_path):
+    a = track('a.gpx', [('2020-01-01T08:00', 100)])
+    out = pipeline(a).write(str(tmp_path/'out.gpx.gz'))
+    with open(out, 'rb') as f:
+        assert f.read(2) == b'\x1f\x8b'
+    assert points(out) == 100
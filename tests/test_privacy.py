@@ -0,0 +1,108 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('gpxpy')
+from gpxpy.geo import Location
+
+from GPXtools import gpxStream, gpxTools
+
+def perPoint(lats, lons, zones):
+    """ The per-point filter privacy zones used to have: gpxpy distance to every zone center """
+    return np.array([any(Location(lat, lon).distance_2d(center) < radius for center, radius in zones)
+                     for lat, lon in zip(lats, lons)])
+
+def testMatchesPerPointFilter():
+    zones = [(Location(53.2, 6.56), 100.), (Location(53.21, 6.58), 1000.),
+             # more than 0.2 degrees: haversine
+             (Location(53.0, 6.0), 30000.),
+             (Location(78.2, 15.6), 500.), (Location(-33.9, 151.2), 50.)]
+    pz = gpxTools.privacyZone([center for center, radius in zones], [radius for center, radius in zones])
+    rng = np.random.default_rng(3)
+    lats, lons = [], []
+    for center, radius in zones:
+        # around each zone, out to twice its radius
+        d = 2*radius/gpxTools.ONE_DEGREE
+        lats.append(center.latitude+d*(2*rng.random(2000)-1))
+        lons.append(center.longitude+d/np.cos(np.radians(center.latitude))*(2*rng.random(2000)-1))
+    lats, lons = np.concatenate(lats), np.concatenate(lons)
+    mask = pz.pointsTooClose(lats, lons)
+    expected = perPoint(lats, lons, zones)
+    assert 0 < expected.sum() < len(expected)
+    assert np.array_equal(mask, expected)
+
+def testApplyPrivacyZone(track, tmp_path):
+    fn = track('a.gpx', [('2020-01-01T08:00', 300)])
+    out = str(tmp_path/'out.gpx')
+    gpxTools.applyPrivacyZone(fn, [Location(53.2, 6.56)], [100], outFileName=out)
+    seg = gpxStream.readGpx(fn).tracks[0].segments[0]
+    kept = gpxStream.readGpx(out).tracks[0].segments[0]
+    expected = ~perPoint(seg.lat, seg.lon, [(Location(53.2, 6.56), 100.)])
+    assert 0 < expected.sum() < len(seg)
+    assert np.array_equal(kept.lat, seg.lat[expected])
+    assert np.array_equal(kept.time, seg.time[expected])
+
+def writeZones(fileName, geometries, crs=None):
+    """ GeoJSON FeatureCollection of geometries (GeoJSON dicts) """
+    collection = {'type': 'FeatureCollection',
+                  'features': [{'type': 'Feature', 'properties': {}, 'geometry': g} for g in geometries]}
+    if crs is not None:
+        collection['crs'] = {'type': 'name', 'properties': {'name': crs}}
+    with open(fileName, 'w') as f:
+        json.dump(collection, f)
+    return fileName
+
+# a square across the synthetic track (53.2,6.56 heading north-east, 1e-5 degrees per point),
+# a triangle right beside it, and one further north
+depot = {'type': 'Polygon', 'coordinates': [[[6.56055, 53.20055], [6.56155, 53.20055], [6.56155, 53.20155],
+                                             [6.56055, 53.20155], [6.56055, 53.20055]]]}
+clients = {'type': 'MultiPolygon', 'coordinates': [[[[6.563, 53.2028], [6.565, 53.2028], [6.565, 53.2048], [6.563, 53.2028]]],
+                                                   [[[6.57, 53.3], [6.58, 53.3], [6.58, 53.31], [6.57, 53.3]]]]}
+
+def testPolygonZones(tmp_path):
+    pytest.importorskip('fiona')
+    shapely = pytest.importorskip('shapely')
+    fn = writeZones(str(tmp_path/'zones.geojson'), [depot, clients])
+    rng = np.random.default_rng(5)
+    lats, lons = 53.2+0.006*rng.random(20000), 6.56+0.006*rng.random(20000)
+    inside = np.zeros(len(lats), dtype=bool)
+    for g in (depot, clients):
+        inside |= shapely.contains_xy(shapely.geometry.shape(g), lons, lats)
+    assert 0 < inside.sum() < len(inside)
+    assert np.array_equal(gpxTools.privacyZone(polygons=fn).pointsTooClose(lats, lons), inside)
+    # together with a circle, and a file name in a list
+    circle = (Location(53.205, 6.56), 100.)
+    expected = inside | perPoint(lats, lons, [circle])
+    assert (expected & ~inside).any()
+    pz = gpxTools.privacyZone([circle[0]], [circle[1]], polygons=[fn])
+    assert np.array_equal(pz.pointsTooClose(lats, lons), expected)
+    # the same polygons given as shapely geometries
+    pz = gpxTools.privacyZone([circle[0]], [circle[1]], polygons=[shapely.geometry.shape(g) for g in (depot, clients)])
+    assert np.array_equal(pz.pointsTooClose(lats, lons), expected)
+
+def testApplyPolygonZones(track, tmp_path):
+    pytest.importorskip('fiona')
+    shapely = pytest.importorskip('shapely')
+    fn = track('a.gpx', [('2020-01-01T08:00', 600)])
+    zones = gpxTools.privacyZone([Location(53.2, 6.56)], [50], polygons=writeZones(str(tmp_path/'zones.geojson'), [depot, clients]))
+    out = str(tmp_path/'out.gpx')
+    gpxTools.applyPrivacyZone(fn, zones, outFileName=out)
+    seg = gpxStream.readGpx(fn).tracks[0].segments[0]
+    kept = gpxStream.readGpx(out).tracks[0].segments[0]
+    expected = ~perPoint(seg.lat, seg.lon, [(Location(53.2, 6.56), 50.)])
+    for g in (depot, clients):
+        expected &= ~shapely.contains_xy(shapely.geometry.shape(g), seg.lon, seg.lat)
+    # the track leaves the circle after point 38 and crosses the depot from point 56 to 154;
+    # it passes the first client without touching it
+    assert np.array_equal(np.flatnonzero(np.diff(expected)), [38, 55, 154])
+    assert np.array_equal(kept.lat, seg.lat[expected])
+    assert np.array_equal(kept.time, seg.time[expected])
+
+def testBadZoneFiles(tmp_path):
+    pytest.importorskip('fiona')
+    point = {'type': 'Point', 'coordinates': [6.56, 53.2]}
+    with pytest.raises(ValueError, match='Point'):
+        gpxTools.privacyZone(polygons=writeZones(str(tmp_path/'points.geojson'), [depot, point]))
+    with pytest.raises(ValueError, match='EPSG:3857'):
+        gpxTools.loadZones(writeZones(str(tmp_path/'mercator.geojson'), [depot], crs='urn:ogc:def:crs:EPSG::3857'))
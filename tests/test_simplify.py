@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+
+from GPXtools import gpxStream, gpxTools
+from GPXtools.simplify import monotonicMask, segmentSimplifier, simplifySegment, visvalingamMask
+from GPXtools.track import Segment
+from conftest import syntheticSegment
+
+def times(*seconds):
+    return np.datetime64('2020-01-01T08:00', 'us')+np.array(seconds)*np.timedelta64(1, 's')
+
+def zigzag(start, n):
+    """ Segment whose points are all kept by simplification (tolerance 1 m) """
+    seg = syntheticSegment(start, n)
+    seg.lon = seg.lon+(np.arange(n) % 2)*1e-4
+    return seg
+
+def testMonotonicMask():
+    t = times(0, 1, 1, 3, 2, 4)
+    t[1] = np.datetime64('NaT')
+    assert monotonicMask(t).tolist() == [True, True, True, True, False, True]
+    assert monotonicMask(times(1, 2, 5), previous=times(3)[0]).tolist() == [False, False, True]
+
+def testMonotonicAcrossChunks():
+    # time steps back by 10 s at the boundary between the chunks
+    seg = zigzag('2020-01-01T08:00', 40)
+    seg.time[20:] -= np.timedelta64(10, 's')
+    whole = segmentSimplifier(1, monotonicTimes=True)(seg)
+    simp = segmentSimplifier(1, monotonicTimes=True)
+    chunked = [simp(seg[i:i+20]) for i in (0, 20)]
+    assert sum(len(c) for c in chunked) == len(whole) == 30
+    # a new segment starts afresh
+    simp.startSegment()
+    assert len(simp(seg[20:])) == 20
+
+def testSimplifyTrackChunked(track, tmp_path):
+    seg = zigzag('2020-01-01T08:00', 40)
+    seg.time[20:] -= np.timedelta64(10, 's')
+    fn = track('a.gpx', [seg, zigzag('2020-01-01T07:00', 10)])
+    out = str(tmp_path/'out.gpx')
+    gpxTools.simplifyTrack(fn, 1, out, monotonicTimes=True, chunkSize=20)
+    segs = gpxStream.readGpx(out).tracks[0].segments
+    assert [len(s) for s in segs] == [30, 10]
+    assert (np.diff(segs[0].time) > np.timedelta64(0)).all()
+
+def testVisvalingamDuplicateRun():
+    # one hour stopped (3600 identical points) within 36000 points of zigzag
+    seg = zigzag('2020-01-01T08:00', 36000)
+    seg.lat[10000:13600] = seg.lat[10000]
+    seg.lon[10000:13600] = seg.lon[10000]
+    start = time.perf_counter()
+    out = simplifySegment(seg, 1, 'vw')
+    # a run of equal areas used to lose a single point per pass
+    assert time.perf_counter()-start < 1
+    keep = np.isin(seg.time, out.time)
+    assert keep[10000:13600].sum() <= 2
+    assert keep[:10000].all() and keep[13601:].all()
+
+def testVisvalingamEqualAreas():
+    x = np.arange(32000.)
+    assert visvalingamMask(x, np.zeros_like(x), 1).nonzero()[0].tolist() == [0, 31999]
+    # areas above the threshold: all kept
+    y = (np.arange(len(x)) % 2)*1.
+    assert visvalingamMask(x, y, 0.5).all()
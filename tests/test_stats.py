@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from GPXtools.stats import trackStats
+from conftest import syntheticSegment
+
+def withEle(seg, ele):
+    seg.ele = np.asarray(ele, dtype=float)
+    return seg
+
+def testElevationIsResetBetweenSegments():
+    # flat at 100 m, then flat at 150 m: no climb between segments
+    stats = trackStats()
+    stats.add(withEle(syntheticSegment('2020-01-01T08:00', 50), np.full(50, 100.)))
+    stats.startSegment()
+    stats.add(withEle(syntheticSegment('2020-01-01T09:00', 50), np.full(50, 150.)))
+    assert stats.uphill == 0 and stats.downhill == 0
+
+def testElevationAcrossSegments():
+    stats = trackStats()
+    stats.add(withEle(syntheticSegment('2020-01-01T08:00', 50), np.linspace(0, 60, 50)))
+    stats.startSegment()
+    stats.add(withEle(syntheticSegment('2020-01-01T09:00', 50), np.linspace(200, 175, 50)))
+    assert stats.uphill == pytest.approx(60, abs=5)
+    assert stats.downhill == pytest.approx(25, abs=5)
+
+def testChunksMatchWholeSegment():
+    seg = withEle(syntheticSegment('2020-01-01T08:00', 1000), 10*np.sin(np.arange(1000)/50.))
+    whole = trackStats()
+    whole.add(seg)
+    chunked = trackStats()
+    for i in range(0, 1000, 77):
+        chunked.add(seg[i:i+77])
+    assert chunked.summary() == pytest.approx(whole.summary())
+
+def testDistanceIsResetBetweenSegments():
+    stats = trackStats()
+    stats.add(syntheticSegment('2020-01-01T08:00', 2, lat0=53.))
+    stats.startSegment()
+    stats.add(syntheticSegment('2020-01-01T09:00', 2, lat0=54.))
+    assert stats.distance < 10
@@ -0,0 +1,247 @@
+# stravaAtHome against a local stand-in for the Strava API (stravaHandler);
+# the client's requests to www.strava.com are redirected to it.
+
+import datetime
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+pytest.importorskip('stravalib')
+from requests.adapters import HTTPAdapter
+from stravalib.client import BatchedResultsIterator
+
+from GPXtools import gpxStream
+from GPXtools.stravaAtHome import stravaAtHome
+from conftest import localServer, quietHandler
+
+firstStart = datetime.datetime(2019, 5, 1, 8, tzinfo=datetime.timezone.utc)
+
+def activity(i):
+    """ Summary of activity 1000+i, started i days after firstStart """
+    start = firstStart+datetime.timedelta(days=i)
+    return {'id': 1000+i, 'name': 'Ride <%i>'%i, 'type': 'Ride', 'sport_type': 'Ride', 'resource_state': 2,
+            'start_date': start.strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+def streams(nPoints=100):
+    """ latlng, time and altitude streams of nPoints points, keyed by type """
+    data = {'latlng': [[53.2+k*1e-4, 6.5+k*1e-4] for k in range(nPoints)],
+            'time': list(range(0, 2*nPoints, 2)),
+            'altitude': [5.+k for k in range(nPoints)]}
+    return {t: {'type': t, 'data': d, 'series_type': 'time', 'original_size': nPoints, 'resolution': 'high'}
+            for t, d in data.items()}
+
+class stravaHandler(quietHandler):
+    """
+    Strava API stand-in: activities (list of summaries, see activity()) with streams;
+    activities in noGPS have none, streams of those in failing give a server error.
+    Uploads are processed after polls polls; uploaded files containing 'corrupt' fail.
+    Requests are counted in hits; uploads and activity updates are recorded in events.
+    """
+    polls = 2
+    lock = threading.Lock()
+    @classmethod
+    def reset(cls, nActivities=12):
+        cls.activities = [activity(i) for i in range(nActivities)]
+        cls.noGPS = set()
+        cls.failing = set()
+        cls.hits = {'list': 0, 'streams': 0, 'upload': 0, 'poll': 0, 'update': 0}
+        cls.uploads = {} # upload ID -> [polls left, data type, error, file name]
+        cls.events = []  # ('upload' / 'done' / 'update', ID)
+        cls.updates = {} # activity ID -> update
+
+    def send(self, obj, code=200):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-RateLimit-Limit', '600,30000')
+        self.send_header('X-RateLimit-Usage', '1,1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == '/api/v3/athlete/activities':
+            self.hits['list'] += 1
+            after = float(query.get('after', ['0'])[0])
+            page = int(query.get('page', ['1'])[0])
+            perPage = int(query.get('per_page', ['200'])[0])
+            selected = [a for a in self.activities
+                        if datetime.datetime.fromisoformat(a['start_date'].replace('Z', '+00:00')).timestamp() > after]
+            return self.send(selected[(page-1)*perPage:page*perPage])
+        m = re.match(r'^/api/v3/activities/(\d+)/streams$', url.path)
+        if m is not None:
+            self.hits['streams'] += 1
+            activityID = int(m.group(1))
+            if activityID in self.failing:
+                return self.send({'message': 'Server Error'}, 500)
+            return self.send({} if activityID in self.noGPS else streams())
+        m = re.match(r'^/api/v3/uploads/(\d+)$', url.path)
+        if m is not None:
+            uploadID = int(m.group(1))
+            with self.lock:
+                self.hits['poll'] += 1
+                upload = self.uploads[uploadID]
+                upload[0] -= 1
+                if upload[0] > 0:
+                    return self.send({'id': uploadID, 'status': 'Your activity is still being processed.'})
+                self.events.append(('done', uploadID))
+            if upload[2] is not None:
+                return self.send({'id': uploadID, 'status': 'There was an error processing your activity.',
+                                  'error': upload[2]})
+            return self.send({'id': uploadID, 'status': 'Your activity is ready.', 'activity_id': 5000+uploadID})
+        self.send({'message': 'Record Not Found'}, 404)
+
+    def body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/api/v3/uploads':
+            return self.send({'message': 'Record Not Found'}, 404)
+        body = self.body()
+        dataType = urllib.parse.parse_qs(url.query)['data_type'][0]
+        fileName = re.search(rb'filename="([^"]*)"', body).group(1).decode()
+        with self.lock:
+            self.hits['upload'] += 1
+            uploadID = len(self.uploads)+1
+            self.uploads[uploadID] = [self.polls, dataType, 'corrupt file' if b'corrupt' in body else None, fileName]
+            self.events.append(('upload', uploadID))
+        self.send({'id': uploadID, 'status': 'Your activity is still being processed.'}, 201)
+
+    def do_PUT(self):
+        m = re.match(r'^/api/v3/activities/(\d+)$', urllib.parse.urlparse(self.path).path)
+        if m is None:
+            return self.send({'message': 'Record Not Found'}, 404)
+        activityID = int(m.group(1))
+        update = json.loads(self.body() or b'{}')
+        with self.lock:
+            self.hits['update'] += 1
+            self.updates[activityID] = update
+            self.events.append(('update', activityID))
+        self.send({'id': activityID, 'name': update.get('name'), 'resource_state': 3})
+
+class redirectAdapter(HTTPAdapter):
+    """ Sends requests for https://www.strava.com to base URL instead """
+    def __init__(self, base, **keywords):
+        super().__init__(**keywords)
+        self.base = base
+
+    def send(self, request, **keywords):
+        request.url = request.url.replace('https://www.strava.com', self.base)
+        return super().send(request, **keywords)
+
+@pytest.fixture
+def strava(tmp_path, monkeypatch):
+    """ stravaAtHome with a valid token, talking to stravaHandler; lists 5 activities per page """
+    monkeypatch.setattr(BatchedResultsIterator, 'default_per_page', 5)
+    stravaHandler.reset()
+    (tmp_path/'client.secret').write_text('1234,secret\n')
+    (tmp_path/'token').write_text('access %i refresh\n'%(time.time()+86400))
+    parmFile = tmp_path/'parms.yaml'
+    parmFile.write_text('tokenFile: %s\nclientIDFile: %s\nscopesNeeded: [activity:read_all, activity:write]\n'%(
+        tmp_path/'token', tmp_path/'client.secret'))
+    with localServer(stravaHandler) as url:
+        client = stravaAtHome(str(parmFile), batchmode=True, thoroughCheck=False)
+        client.protocol.rsession.mount('https://www.strava.com', redirectAdapter(url))
+        yield client
+
+def countAcquire(client):
+    """ Count the rate-limiter tokens client takes, in the returned list """
+    count = [0]
+    acquire = client.rateLimiter.acquire
+    def counted():
+        count[0] += 1
+        acquire()
+    client.rateLimiter.acquire = counted
+    return count
+
+def testDownloadTakesTokenPerRequest(strava, tmp_path):
+    acquired = countAcquire(strava)
+    newFiles = strava.downloadGPX(str(tmp_path/'out'))
+    assert len(newFiles) == 12
+    # 12 activities, 5 per page: 3 pages
+    assert stravaHandler.hits['list'] == 3
+    assert stravaHandler.hits['streams'] == 12
+    assert acquired[0] == 3+12
+    # limits from the stand-in's headers
+    assert strava.rateLimiter.limits == [600, 30000]
+
+def testDownloadIncremental(strava, tmp_path):
+    outDir = str(tmp_path/'out')
+    stravaHandler.noGPS = {1003}
+    stravaHandler.failing = {1005}
+    newFiles = strava.downloadGPX(outDir)
+    assert len(newFiles) == 10
+    assert stravaHandler.hits['streams'] == 12
+    name = os.path.join(outDir, '20190501T080000_1000.gpx.gz')
+    assert name in newFiles
+    doc = gpxStream.readGpx(name)
+    assert len(doc.tracks[0].segments[0].lat) == 100
+    assert not [f for f in os.listdir(outDir) if f.startswith('.')]
+    with open(os.path.join(outDir, 'strava.json')) as f:
+        state = json.load(f)
+    # stops before the failed activity
+    assert datetime.datetime.fromisoformat(state['highWaterMark']) == firstStart+datetime.timedelta(days=4)
+    assert state['activities']['1003'] is None
+    assert '1005' not in state['activities']
+    # the failed activity is fetched again, nothing else
+    stravaHandler.failing = set()
+    stravaHandler.hits['streams'] = 0
+    assert strava.downloadGPX(outDir) == [os.path.join(outDir, '20190506T080000_1005.gpx.gz')]
+    assert stravaHandler.hits['streams'] == 1
+    stravaHandler.hits['streams'] = 0
+    assert strava.downloadGPX(outDir) == []
+    assert stravaHandler.hits['streams'] == 0
+    assert len([f for f in os.listdir(outDir) if f.endswith('.gpx.gz')]) == 11
+
+def testUploadMany(strava, track, tmp_path):
+    names = [track('ride%i.gpx'%i, [('2019-05-0%iT08:00:00'%(i+1), 50)]) for i in range(5)]
+    names.append(str(tmp_path/'ride5.gpx.gz'))
+    gpxStream.writeGpx(gpxStream.readGpx(names[0]), names[-1])
+    bad = str(tmp_path/'bad.gpx')
+    with open(bad, 'w') as f:
+        f.write('<gpx>corrupt</gpx>')
+    names.insert(2, bad)
+    acquired = countAcquire(strava)
+    activityNames = ['Ride %i'%i for i in range(len(names))]
+    results = strava.uploadMany(names, activityNames=activityNames, commute=True, maxInFlight=3,
+                                firstPoll=0.01, maxPoll=0.05)
+    assert list(results) == names
+    assert results[bad] is None
+    uploadIDs = {upload[3]: i for i, upload in stravaHandler.uploads.items()}
+    uploadIDs = {fn: uploadIDs[os.path.basename(fn)] for fn in names}
+    for fn in names:
+        if fn != bad:
+            assert results[fn] == 5000+uploadIDs[fn]
+    # every request took a token
+    hits = stravaHandler.hits
+    assert hits['upload'] == len(names)
+    assert hits['poll'] == stravaHandler.polls*len(names)
+    assert acquired[0] == hits['upload']+hits['poll']+hits['update']
+    # data type from file name
+    assert stravaHandler.uploads[uploadIDs[names[-1]]][1] == 'gpx.gz'
+    assert stravaHandler.uploads[uploadIDs[names[0]]][1] == 'gpx'
+    # several uploads in flight, never more than maxInFlight
+    inFlight, maxSeen = 0, 0
+    for event, i in stravaHandler.events:
+        inFlight += {'upload': 1, 'done': -1}.get(event, 0)
+        maxSeen = max(maxSeen, inFlight)
+    assert 1 < maxSeen <= 3
+    # activity details only set for successful uploads, once all are done
+    kinds = [event for event, i in stravaHandler.events]
+    assert max(k for k, event in enumerate(kinds) if event == 'done') < kinds.index('update')
+    assert stravaHandler.updates == {results[fn]: {'name': name, 'commute': True}
+                                     for fn, name in zip(names, activityNames) if fn != bad}
+
+def testUploadManyNothingToUpdate(strava, track):
+    names = [track('ride%i.gpx'%i, [('2019-05-0%iT08:00:00'%(i+1), 50)]) for i in range(2)]
+    results = strava.uploadMany(names, firstPoll=0.01)
+    assert sorted(results.values()) == [5001, 5002]
+    assert stravaHandler.hits['update'] == 0
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import re
+
+import pytest
+
+from GPXtools.tahuna import downloadManifest, fetch, pooledSession, tahunaDownloader, trackUrl
+from conftest import localServer, quietHandler
+
+def trackData(i):
+    return b'<?xml version="1.0"?><gpx>'+b'x'*(300000+i)+b'</gpx>'
+
+class tahunaHandler(quietHandler):
+    """
+    Tahuna stand-in: page /page/i links to track /track/i.gpx (20 tracks), page /page/none to nothing.
+    Honours Range requests unless ranges is False; requests and bytes sent are counted in hits.
+    """
+    protocol_version = 'HTTP/1.1'
+    ranges = True
+    @classmethod
+    def reset(cls):
+        cls.ranges = True
+        cls.hits = {'page': 0, 'track': 0, 'range': 0, 'bytes': 0}
+
+    def reply(self, code, body=b''):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        m = re.match(r'^/page/(\w+)$', self.path)
+        if m is not None:
+            self.hits['page'] += 1
+            link = '' if m.group(1) == 'none' else '<a class="gpx" href="/track/%s.gpx?uniqueid=abc&amp;y=1">GPX</a>'%m.group(1)
+            return self.reply(200, ('<html>\n<body>%s</body></html>'%link).encode())
+        m = re.match(r'^/track/(\d+)\.gpx\?uniqueid=abc&y=1$', self.path)
+        if m is None:
+            return self.reply(404)
+        self.hits['track'] += 1
+        data = trackData(int(m.group(1)))
+        rangeHeader = self.headers.get('Range')
+        if rangeHeader is None or not self.ranges:
+            return self.reply(200, data)
+        self.hits['range'] += 1
+        start = int(re.match(r'^bytes=(\d+)-$', rangeHeader).group(1))
+        if start >= len(data):
+            return self.reply(416)
+        self.hits['bytes'] += len(data)-start
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %i-%i/%i'%(start, len(data)-1, len(data)))
+        self.send_header('Content-Length', str(len(data)-start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+@pytest.fixture
+def tahuna():
+    tahunaHandler.reset()
+    with localServer(tahunaHandler) as url:
+        yield url
+
+def linkFiles(directory, url, pages):
+    names = []
+    for page in pages:
+        name = str(directory/('link%s.txt'%page))
+        with open(name, 'w') as f:
+            f.write('%s/page/%s\n'%(url, page))
+        names.append(name)
+    return names
+
+def read(fileName):
+    with open(fileName, 'rb') as f:
+        return f.read()
+
+def testTrackUrl():
+    assert trackUrl('<a HREF = \'/t.gpx?uniqueid=1&amp;a=2\'>') == '/t.gpx?uniqueid=1&a=2'
+    assert trackUrl('<a href="/t.gpx">') is None
+
+def testDownloadAndRerun(tahuna, tmp_path):
+    links = linkFiles(tmp_path, tahuna, range(20))
+    outDir = tmp_path/'out'
+    results = tahunaDownloader(str(outDir), workers=4).download(links)
+    assert [(link, error) for link, outFileName, downloaded, error in results] == [(link, None) for link in links]
+    assert all(downloaded for link, outFileName, downloaded, error in results)
+    for i, (link, outFileName, downloaded, error) in enumerate(results):
+        assert outFileName == str(outDir/('link%i.gpx'%i))
+        assert read(outFileName) == trackData(i)
+    assert tahunaHandler.hits['track'] == 20
+    manifest = downloadManifest(str(outDir/'tahuna.json'))
+    assert manifest.entries['link7.gpx'] == {'url': '%s/page/7'%tahuna, 'size': len(trackData(7)),
+                                             'sha256': hashlib.sha256(trackData(7)).hexdigest()}
+    # all there: nothing fetched
+    results = tahunaDownloader(str(outDir)).download(links)
+    assert not any(downloaded or error for link, outFileName, downloaded, error in results)
+    assert tahunaHandler.hits['page'] == tahunaHandler.hits['track'] == 20
+
+def testChangedFilesFetchedAgain(tahuna, tmp_path):
+    links = linkFiles(tmp_path, tahuna, range(3))
+    tahunaDownloader().download(links)
+    # same size, other content: only found by the hash
+    corrupted = str(tmp_path/'link0.gpx')
+    data = bytearray(read(corrupted))
+    data[100] ^= 1
+    with open(corrupted, 'wb') as f:
+        f.write(data)
+    os.remove(str(tmp_path/'link1.gpx'))
+    results = tahunaDownloader(verify=False).download(links)
+    assert [downloaded for link, outFileName, downloaded, error in results] == [False, True, False]
+    results = tahunaDownloader().download(links)
+    assert [downloaded for link, outFileName, downloaded, error in results] == [True, False, False]
+    assert read(corrupted) == trackData(0)
+
+def testResume(tahuna, tmp_path):
+    url = '%s/track/5.gpx?uniqueid=abc&y=1'%tahuna
+    outFileName = str(tmp_path/'track.gpx')
+    data = trackData(5)
+    with open(outFileName+'.part', 'wb') as f:
+        f.write(data[:1000])
+    s = pooledSession()
+    assert fetch(s, url, outFileName, chunkSize=4096) == (len(data), hashlib.sha256(data).hexdigest())
+    assert read(outFileName) == data
+    assert not os.path.exists(outFileName+'.part')
+    assert tahunaHandler.hits['range'] == 1
+    assert tahunaHandler.hits['bytes'] == len(data)-1000
+    # stale .part, longer than the track: start over
+    with open(outFileName+'.part', 'wb') as f:
+        f.write(b'y'*(len(data)+10))
+    assert fetch(s, url, outFileName)[0] == len(data)
+    assert read(outFileName) == data
+    # server without ranges: start over
+    tahunaHandler.ranges = False
+    with open(outFileName+'.part', 'wb') as f:
+        f.write(b'y'*1000)
+    assert fetch(s, url, outFileName)[0] == len(data)
+    assert read(outFileName) == data
+
+def testErrorsReportedPerFile(tahuna, tmp_path):
+    links = linkFiles(tmp_path, tahuna, [0, 'none', 1])
+    results = tahunaDownloader(str(tmp_path/'out')).download(links)
+    assert [error is None for link, outFileName, downloaded, error in results] == [True, False, True]
+    assert results[1][3].startswith('ValueError: tahuna.get:')
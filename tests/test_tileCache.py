@@ -0,0 +1,68 @@
+import io
+import re
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cartopy')
+from PIL import Image
+
+from GPXtools.tileCache import cachedOSM, tileStore
+from conftest import localServer, quietHandler
+
+def png(color):
+    out = io.BytesIO()
+    Image.fromarray(np.full((256, 256, 3), color, dtype=np.uint8)).save(out, format='PNG')
+    return out.getvalue()
+
+class tileHandler(quietHandler):
+    """ Tile server stand-in: every tile /z/x/y.png is a red square; requests are recorded """
+    requests = []
+    def do_GET(self):
+        m = re.match(r'^/(\d+)/(\d+)/(\d+)\.png$', self.path)
+        if m is None:
+            self.send_error(404)
+            return
+        tileHandler.requests.append(self.path)
+        data = png((255, 0, 0))
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+extent = [6.50, 6.62, 53.18, 53.25]
+
+def testPrefetchThenOffline(tmp_path):
+    tileHandler.requests = []
+    store = tileStore(str(tmp_path))
+    with localServer(tileHandler) as url:
+        osm = cachedOSM(store, urlTemplate=url+'/{z}/{x}/{y}.png')
+        tiles = osm.tilesFor(extent, 12)
+        assert osm.prefetch(extent, 12) == len(tiles) > 0
+        assert len(tileHandler.requests) == len(tiles)
+        # all there: nothing fetched again
+        assert osm.prefetch(extent, 12) == 0
+        assert len(tileHandler.requests) == len(tiles)
+    # server gone: offline reads come from the store
+    offline = cachedOSM(store, offline=True, urlTemplate=url+'/{z}/{x}/{y}.png')
+    img, tileExtent, origin = offline.get_image(tiles[0])
+    assert img.convert('RGB').getpixel((0, 0)) == (255, 0, 0)
+    assert offline.prefetch(extent, 13) == 0
+    # missing tiles are blank
+    img, tileExtent, origin = offline.get_image((0, 0, 1))
+    assert img.convert('RGB').getpixel((0, 0)) == cachedOSM.blankColor
+
+def testOverwriteDoesNotCountTwice(tmp_path):
+    data = png((0, 0, 255))
+    store = tileStore(str(tmp_path), maxBytes=3*len(data))
+    for i in range(5):
+        store.put((1, 1, 5), data)
+    assert store.totalBytes == len(data)
+    store.put((2, 1, 5), data)
+    store.put((3, 1, 5), data)
+    # still below the limit: nothing evicted
+    assert all(tile in store for tile in [(1, 1, 5), (2, 1, 5), (3, 1, 5)])
+    store.put((4, 1, 5), data)
+    assert store.totalBytes == 3*len(data)
+    assert (1, 1, 5) not in store or (4, 1, 5) not in store
@@ -0,0 +1,67 @@
+import os
+import time
+
+import numpy as np
+
+from GPXtools import gpxStream, trackCache as trackCacheModule
+from GPXtools.trackCache import trackCache
+from conftest import syntheticSegment
+
+def countParses(monkeypatch):
+    """ Count the files the track cache parses, in the returned list """
+    parsed = []
+    readGpx = gpxStream.readGpx
+    def counted(fileName):
+        parsed.append(os.path.basename(fileName))
+        return readGpx(fileName)
+    monkeypatch.setattr(trackCacheModule.gpxStream, 'readGpx', counted)
+    return parsed
+
+def testHit(track, tmp_path, monkeypatch):
+    fn = track('a.gpx', [('2020-01-01T08:00', 100), ('2020-01-01T09:00', 50)])
+    parsed = countParses(monkeypatch)
+    cache = trackCache(str(tmp_path/'cache'))
+    first = cache.load(fn)
+    second = cache.load(fn)
+    assert parsed == ['a.gpx']
+    expected = gpxStream.readGpx(fn)
+    assert [len(s) for s in second.tracks[0].segments] == [100, 50]
+    for seg, ref in zip(second.tracks[0].segments, expected.tracks[0].segments):
+        assert np.array_equal(seg.lat, ref.lat) and np.array_equal(seg.time, ref.time)
+        assert not seg.lat.flags.writeable
+    assert second.tracks[0].info == expected.tracks[0].info
+
+def testChangedFileParsedAgain(track, tmp_path, monkeypatch):
+    fn = track('a.gpx', [('2020-01-01T08:00', 100)])
+    parsed = countParses(monkeypatch)
+    cache = trackCache(str(tmp_path/'cache'))
+    cache.load(fn)
+    # touched, same content: still a hit
+    os.utime(fn, (time.time()+10, time.time()+10))
+    cache.load(fn)
+    assert parsed == ['a.gpx']
+    track('a.gpx', [('2020-01-02T08:00', 70)])
+    assert len(cache.load(fn).tracks[0].segments[0]) == 70
+    assert parsed == ['a.gpx', 'a.gpx']
+    # same size, other content
+    seg = syntheticSegment('2020-01-03T08:00', 70)
+    track('a.gpx', [seg])
+    assert cache.load(fn).tracks[0].segments[0].time[0] == np.datetime64('2020-01-03T08:00')
+    assert len(parsed) == 3
+
+def testEviction(track, tmp_path, monkeypatch):
+    names = [track('%s.gpx'%name, [('2020-01-01T08:00', 1000)]) for name in 'abc']
+    parsed = countParses(monkeypatch)
+    cache = trackCache(str(tmp_path/'cache'))
+    cache.load(names[0])
+    entrySize = cache.entries()[0][1]
+    cache.maxBytes = 2*entrySize
+    for fn in (names[1], names[0], names[2]):
+        # a used more recently than b: b goes when c comes in
+        time.sleep(0.01)
+        cache.load(fn)
+    assert len(cache.entries()) == 2
+    assert sum(size for used, size, entry in cache.entries()) <= cache.maxBytes
+    for fn in (names[0], names[2], names[1]):
+        cache.load(fn)
+    assert parsed == ['a.gpx', 'b.gpx', 'c.gpx', 'b.gpx']
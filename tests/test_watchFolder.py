@@ -0,0 +1,91 @@
+import os
+import shutil
+import threading
+import time
+import types
+
+from GPXtools import gpxStream, gpxTools
+from GPXtools.watchFolder import folderWatcher, watchManifest
+from conftest import writeTrack
+
+class stubStrava:
+    """ Records uploaded files instead of uploading them """
+    def __init__(self):
+        self.uploaded = []
+
+    def uploadFile(self, fileName, activityType=None, activityName=None, commute=None, private=None):
+        self.uploaded.append(os.path.basename(fileName))
+        return True
+
+def zone():
+    # around the start of the synthetic tracks
+    return gpxTools.privacyZone([types.SimpleNamespace(latitude=53.2, longitude=6.56)], [50])
+
+def watcher(folder, strava, **keywords):
+    return folderWatcher(str(folder), zone(), strava, settle=0., **keywords)
+
+def states(folder):
+    return {name: e['state'] for name, e in watchManifest(str(folder/'.gpxwatch.json')).entries.items()}
+
+def testNewAndDuplicate(tmp_path):
+    writeTrack(str(tmp_path/'a.gpx'), [('2020-01-01T08:00', 100)])
+    shutil.copy(str(tmp_path/'a.gpx'), str(tmp_path/'b.gpx'))
+    writeTrack(str(tmp_path/'c.gpx'), [('2020-01-02T08:00', 100)])
+    strava = stubStrava()
+    watcher(tmp_path, strava).run(once=True)
+    assert states(tmp_path) == {'a.gpx': 'uploaded', 'b.gpx': 'duplicate', 'c.gpx': 'uploaded'}
+    assert sorted(strava.uploaded) == ['a_pz.gpx', 'c_pz.gpx']
+    # points within the zone are gone
+    seg = gpxStream.readGpx(str(tmp_path/'processed'/'a_pz.gpx')).tracks[0].segments[0]
+    assert 0 < len(seg) < 100
+    # a restart does nothing again
+    watcher(tmp_path, strava).run(once=True)
+    assert len(strava.uploaded) == 2
+
+def testFailedThenChanged(tmp_path):
+    fn = str(tmp_path/'a.gpx')
+    with open(fn, 'w') as f:
+        f.write('<?xml version="1.0"?><gpx><trk><trkseg><trkpt lat="53.2"')
+    strava = stubStrava()
+    watcher(tmp_path, strava).run(once=True)
+    entry = watchManifest(str(tmp_path/'.gpxwatch.json')).get('a.gpx')
+    assert entry['state'] == 'failed' and entry['error']
+    # unchanged: not tried again
+    watcher(tmp_path, strava).run(once=True)
+    assert watchManifest(str(tmp_path/'.gpxwatch.json')).get('a.gpx') == entry
+    writeTrack(fn, [('2020-01-01T08:00', 100)])
+    watcher(tmp_path, strava).run(once=True)
+    assert states(tmp_path) == {'a.gpx': 'uploaded'}
+    assert strava.uploaded == ['a_pz.gpx']
+
+def testVanishedFile(tmp_path):
+    writeTrack(str(tmp_path/'a.gpx'), [('2020-01-01T08:00', 100)])
+    writeTrack(str(tmp_path/'b.gpx'), [('2020-01-02T08:00', 100)])
+    strava = stubStrava()
+    w = watcher(tmp_path, strava)
+    w.scan()
+    assert w.ready() == ['a.gpx', 'b.gpx']
+    # renamed away between ready() and process()
+    os.rename(str(tmp_path/'a.gpx'), str(tmp_path/'a.gpx.old'))
+    assert w.processReady() == ['a.gpx', 'b.gpx']
+    assert not w.pending
+    assert states(tmp_path) == {'b.gpx': 'uploaded'}
+    assert strava.uploaded == ['b_pz.gpx']
+
+def testPollMode(tmp_path):
+    strava = stubStrava()
+    w = watcher(tmp_path, strava, poll=True, interval=0.05)
+    thread = threading.Thread(target=w.run)
+    thread.start()
+    try:
+        writeTrack(str(tmp_path/'a.gpx'), [('2020-01-01T08:00', 100)])
+        writeTrack(str(tmp_path/'notes.txt'), [('2020-01-01T08:00', 10)])
+        deadline = time.monotonic()+10
+        while not strava.uploaded and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        w.stop()
+        thread.join(10)
+    assert not thread.is_alive()
+    assert strava.uploaded == ['a_pz.gpx']
+    assert states(tmp_path) == {'a.gpx': 'uploaded'}
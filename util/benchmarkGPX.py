@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+### Benchmark GPXtools operations on synthetic GPX files.
+### Generates files of configurable size, times parsing, merging, time shifts,
+### privacy zones, serialization and plot preparation, records peak memory
+### (tracemalloc), and saves results as JSON for comparison across commits.
+###
+### Usage: benchmarkGPX.py [--points N] [--segments N] [--tracks N] [--files N]
+###                        [--zones N] [--polygons N] [--repeat N] [--output results.json]
+###                        [--compare old.json]
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from gpxpy.geo import Location
+
+from GPXtools import gpxTools, gpxStream
+from GPXtools.track import Segment, Track, GPX
+
+def syntheticSegment(rng, nPoints, lat0, lon0, t0, stepDeg=1e-4):
+    """ Random walk at 1 Hz starting at (lat0, lon0), time t0 (datetime64) """
+    lat = lat0+np.cumsum(rng.normal(0, stepDeg, nPoints))
+    lon = lon0+np.cumsum(rng.normal(0, stepDeg, nPoints))
+    ele = 10+np.cumsum(rng.normal(0, 0.2, nPoints))
+    time = t0+np.arange(nPoints)*np.timedelta64(1, 's')
+    return Segment(lat, lon, np.round(ele, 1), time)
+
+def syntheticFiles(outDir, nFiles=4, nTracks=1, nSegments=2, nPoints=10000, seed=42,
+                   lat0=53.22, lon0=6.57, start='2020-01-01T08:00:00'):
+    """
+    Write nFiles GPX files into outDir, each with nTracks tracks of nSegments
+    segments of nPoints points.  Files follow each other in time (no overlap).
+    Returns list of file names.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.datetime64(start, 'us')
+    fileNames = []
+    for i in range(nFiles):
+        doc = GPX()
+        for j in range(nTracks):
+            segments = []
+            for k in range(nSegments):
+                segments.append(syntheticSegment(rng, nPoints, lat0, lon0, t))
+                t += np.timedelta64(nPoints+60, 's')
+            doc.tracks.append(Track(segments, ['<name>synthetic %i.%i</name>'%(i, j)]))
+        fn = os.path.join(outDir, 'synthetic%03i.gpx'%i)
+        gpxStream.writeGpx(doc, fn)
+        fileNames.append(fn)
+        t += np.timedelta64(3600, 's')
+    return fileNames
+
+def syntheticZones(nZones, seed=43, lat0=53.22, lon0=6.57, spreadDeg=0.02):
+    """ Privacy zones (coordinates, radii in m) scattered around (lat0, lon0) """
+    rng = np.random.default_rng(seed)
+    coords = [Location(lat, lon) for lat, lon in zip(lat0+rng.normal(0, spreadDeg, nZones),
+                                                      lon0+rng.normal(0, spreadDeg, nZones))]
+    return coords, list(rng.uniform(50, 500, nZones))
+
+def syntheticPolygons(nPolygons, seed=44, lat0=53.22, lon0=6.57, spreadDeg=0.02):
+    """ Polygonal privacy zones (irregular 12-gons, 50-500 m across) scattered around (lat0, lon0) """
+    import shapely
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2*np.pi, 12, endpoint=False)
+    polygons = []
+    for lat, lon in zip(lat0+rng.normal(0, spreadDeg, nPolygons), lon0+rng.normal(0, spreadDeg, nPolygons)):
+        r = rng.uniform(25, 250, len(angles))/gpxTools.ONE_DEGREE
+        polygons.append(shapely.Polygon(np.column_stack((lon+r*np.cos(angles)/np.cos(np.radians(lat)),
+                                                         lat+r*np.sin(angles)))))
+    return polygons
+
+def measure(function, repeat=1):
+    """ Best wall time (s) out of repeat runs and peak traced memory (MB) of function() """
+    best = np.inf
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter()-t0)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': best, 'peakMB': peak/2**20}
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runBenchmarks(args, workDir):
+    files = syntheticFiles(workDir, args.files, args.tracks, args.segments, args.points)
+    zone = gpxTools.privacyZone(*syntheticZones(args.zones))
+    polygonZone = gpxTools.privacyZone(polygons=syntheticPolygons(args.polygons))
+    doc = gpxStream.readGpx(files[0])
+    tool = gpxTools.gpxTools()
+    out = os.path.join(workDir, 'out.gpx')
+    def quiet(function):
+        # mergeTracks prints progress
+        def run():
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                function()
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+        return run
+    benchmarks = {
+        'parse': lambda: gpxStream.readGpx(files[0]),
+        'serialize': lambda: gpxStream.writeGpx(doc, out),
+        'shiftTimes': lambda: gpxTools.shiftTimes(files[0], 1, out),
+        'applyPrivacyZone': lambda: gpxTools.applyPrivacyZone(files[0], zone, outFileName=out),
+        'polygonZones': lambda: gpxTools.applyPrivacyZone(files[0], polygonZone, outFileName=out),
+        'mergeTracks': quiet(lambda: tool.mergeTracks(files, out)),
+        'prepareTracks': lambda: tool.prepareTracks(files),
+        }
+    results = {}
+    for name, function in benchmarks.items():
+        results[name] = measure(function, args.repeat)
+        print('%-18s %8.3f s %9.1f MB'%(name, results[name]['seconds'], results[name]['peakMB']))
+    return results
+
+def compare(results, oldFileName):
+    with open(oldFileName) as f:
+        old = json.load(f)
+    print('\nCompared to %s (commit %s): new/old'%(oldFileName, old.get('commit')))
+    for name, r in results.items():
+        if name not in old['results']:
+            continue
+        o = old['results'][name]
+        print('%-18s time %6.2f   memory %6.2f'%(name, r['seconds']/o['seconds'], r['peakMB']/max(o['peakMB'], 1e-9)))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark GPXtools on synthetic GPX files')
+    parser.add_argument('--points', type=int, default=10000, help='points per segment')
+    parser.add_argument('--segments', type=int, default=2, help='segments per track')
+    parser.add_argument('--tracks', type=int, default=1, help='tracks per file')
+    parser.add_argument('--files', type=int, default=4, help='number of files (merged)')
+    parser.add_argument('--zones', type=int, default=20, help='number of privacy zones')
+    parser.add_argument('--polygons', type=int, default=20, help='number of polygonal privacy zones')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per benchmark (best is reported)')
+    parser.add_argument('--output', default=None, help='save results as JSON')
+    parser.add_argument('--compare', default=None, help='JSON results of earlier run to compare to')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workDir:
+        results = runBenchmarks(args, workDir)
+    report = {'commit': gitCommit(), 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'numpy': np.__version__,
+              'parameters': vars(args), 'results': results}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare is not None:
+        compare(results, args.compare)
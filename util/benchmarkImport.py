@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+### Benchmark import times of GPXtools modules.
+### Each module is imported in a fresh interpreter (best of --repeat runs);
+### heavy dependencies pulled in by the import are listed.  Exits with
+### status 1 if an import takes longer than its budget, or if 'import
+### GPXtools' or 'import GPXtools.gpxTools' loads a heavy dependency, so
+### that it can be run as a check before committing.
+###
+### Usage: benchmarkImport.py [--repeat N] [--budget MODULE MS ...]
+###                           [--output results.json]
+
+import argparse
+import json
+import subprocess
+import sys
+
+# Needed only for plotting, geocoding, downloads, Strava, ...
+heavyModules = ['matplotlib', 'cartopy', 'shapely', 'fiona', 'gpxpy', 'geopy', 'requests',
+                'stravalib', 'yaml', 'PIL']
+modules = ['GPXtools', 'GPXtools.gpxStream', 'GPXtools.gpxTools', 'GPXtools.pipeline', 'GPXtools.stravaAtHome']
+# Modules that must not load any of heavyModules
+light = ['GPXtools', 'GPXtools.gpxStream', 'GPXtools.gpxTools']
+defaultBudgets = {'GPXtools': 50.}
+
+_probe = '''
+import sys, time, json
+t0 = time.perf_counter()
+import %s
+t1 = time.perf_counter()
+print(json.dumps({'ms': 1000*(t1-t0), 'heavy': sorted(m for m in %r if m in sys.modules)}))
+'''
+
+def importTime(module, repeat=5):
+    """ Best import time (ms) of module in a fresh interpreter, and heavy modules loaded by it """
+    best, heavy = float('inf'), []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', _probe%(module, heavyModules)])
+        result = json.loads(out.decode().strip().split('\n')[-1])
+        best = min(best, result['ms'])
+        heavy = result['heavy']
+    return best, heavy
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark import times of GPXtools modules')
+    parser.add_argument('--repeat', type=int, default=5, help='imports per module (best is reported)')
+    parser.add_argument('--budget', nargs=2, action='append', default=None, metavar=('MODULE', 'MS'),
+                        help="maximum import time (ms) of a module; default: GPXtools 50")
+    parser.add_argument('--output', default=None, help='save results as JSON')
+    args = parser.parse_args()
+    budgets = defaultBudgets if args.budget is None else {m: float(ms) for m, ms in args.budget}
+    results, failures = {}, []
+    for module in sorted(set(modules) | set(budgets), key=lambda m: (m not in modules, m)):
+        ms, heavy = importTime(module, args.repeat)
+        results[module] = {'ms': ms, 'heavy': heavy}
+        print('%-24s %8.1f ms  %s'%(module, ms, ', '.join(heavy)))
+        if module in budgets and ms > budgets[module]:
+            failures.append('%s: %.1f ms, budget %.1f ms'%(module, ms, budgets[module]))
+        if module in light and heavy:
+            failures.append('%s loads %s'%(module, ', '.join(heavy)))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'budgets': budgets, 'results': results}, f, indent=1)
+    for failure in failures:
+        print('Over budget: '+failure)
+    sys.exit(1 if failures else 0)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import gpxTools
+from GPXtools import gpxTools
 import sys
 import os
 